@@ -1,6 +1,7 @@
 import conclave.comp as comp
 import conclave.dag as condag
 import conclave.partition as part
+import conclave.widths as widths
 from conclave.codegen.python import PythonCodeGen
 from conclave.codegen.sharemind import SharemindCodeGen
 from conclave.codegen.spark import SparkCodeGen
@@ -21,10 +22,11 @@ def generate_code(protocol: callable, conclave_config: CodeGenConfig, mpc_framew
     :param local_frameworks: available local-processing backend frameworks
     :param apply_optimizations: flag indicating if optimization rewrite passes should be applied to condag
     :return: queue of job objects to be executed by dispatcher
-    """
 
-    # currently only allow one local and one mpc framework
-    assert len(mpc_frameworks) == 1 and len(local_frameworks) == 1
+    The cost-based partitioner and column bit widths use the statistics attached to the
+    protocol's Create nodes. These are not collected here: protocol must attach them,
+    the same at every party, e.g. with :func:`~conclave.stats.collect_stats`.
+    """
 
     # set up code gen config object
     if isinstance(conclave_config, CodeGenConfig):
@@ -32,13 +34,24 @@ def generate_code(protocol: callable, conclave_config: CodeGenConfig, mpc_framew
     else:
         cfg = CodeGenConfig.from_dict(conclave_config)
 
+    # heupart only allows one local and one mpc framework, costpart chooses among several
+    if cfg.partitioner == "heupart":
+        assert len(mpc_frameworks) == 1 and len(local_frameworks) == 1
+    elif cfg.partitioner != "costpart":
+        raise Exception("Unknown partitioner: " + cfg.partitioner)
+
     # apply optimizations
     dag = condag.OpDag(protocol())
     # only apply optimizations if required
     if apply_optimizations:
         dag = comp.rewrite_dag(dag)
+    # bound the values of every column so that code generators can pick narrow data types
+    widths.infer_widths(dag)
     # partition into subdags that will run in specific frameworks
-    mapping = part.heupart(dag, mpc_frameworks, local_frameworks)
+    if cfg.partitioner == "costpart":
+        mapping = part.costpart(dag, mpc_frameworks, local_frameworks, cfg.cost_model)
+    else:
+        mapping = part.heupart(dag, mpc_frameworks, local_frameworks)
     # for each sub condag run code gen and add resulting job to job queue
     job_queue = []
     for job_num, (framework, sub_dag, stored_with) in enumerate(mapping):
@@ -61,6 +74,8 @@ def generate_code(protocol: callable, conclave_config: CodeGenConfig, mpc_framew
         # TODO: this probably doesn't belong here
         if conclave_config.pid not in stored_with:
             job.skip = True
+
+    _set_job_deps(job_queue, [sub_dag for (_, sub_dag, _) in mapping])
     return job_queue
 
 
@@ -90,5 +105,23 @@ def generate_and_dispatch(protocol: callable, conclave_config: CodeGenConfig, mp
     dispatch_jobs(job_queue, conclave_config)
 
 
+def _set_job_deps(job_queue: list, sub_dags: list):
+    """
+    Record for each job which earlier jobs produce its inputs. Sub-dags read
+    relations computed by earlier sub-dags through Create nodes with the same
+    relation name.
+    """
+
+    # maps relation names to the job that computes them
+    producers = {}
+    for job, sub_dag in zip(job_queue, sub_dags):
+        nodes = sub_dag.top_sort()
+        inputs = [node.out_rel.name for node in nodes if isinstance(node, condag.Create)]
+        job.deps = sorted(set([producers[name] for name in inputs if name in producers]))
+        for node in nodes:
+            if not isinstance(node, condag.Create):
+                producers[node.out_rel.name] = job.name
+
+
 def _setup_networked_peer(network_config):
     return setup_peer(network_config)
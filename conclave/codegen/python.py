@@ -3,10 +3,22 @@ import os
 import pystache
 
 from conclave.codegen import CodeGen
+from conclave.config import PythonConfig
 from conclave.job import PythonJob
 import conclave.dag as saldag
 
 
+# operators that only look at one row at a time and can therefore
+# be applied to each chunk of a streamed relation separately
+STREAMING_OPS = (saldag.Project, saldag.Multiply, saldag.Divide, saldag.Filter)
+
+# aggregators supported by the Python runtimes
+AGGREGATORS = {"+", "sum", "count", "min", "max", "mean", "avg"}
+
+# comparison operators that are spelled differently in Python
+FILTER_OPERATORS = {"=": "==", "<>": "!="}
+
+
 class PythonCodeGen(CodeGen):
     """ Codegen subclass for generating Python code. """
 
@@ -15,9 +27,38 @@ class PythonCodeGen(CodeGen):
         """ Initialize PythonCodeGen object. """
         super(PythonCodeGen, self).__init__(config, dag)
         self.template_directory = template_directory
+        self.py_config = config.system_configs.get("python", PythonConfig())
+        # maps members of fused operator chains to their chain
+        self.fused_chains = {}
         # this belongs inside config
         self.space = space
 
+    def _generate(self, job_name: [str, None], output_directory: [str, None]):
+        """ Fuse operator chains before generating code for the DAG. """
+        self.fused_chains = self._find_fused_chains() if self.py_config.fuse_ops else {}
+        return super(PythonCodeGen, self)._generate(job_name, output_directory)
+
+    def _find_fused_chains(self):
+        """
+        Find maximal chains of at least two row-local operators in which
+        every operator but the last one has the next one as its only child.
+        Only the last operator of a chain produces a relation.
+        """
+        chains = {}
+        for node in self.dag.top_sort():
+            if not isinstance(node, STREAMING_OPS) or node in chains:
+                continue
+            chain = [node]
+            while len(chain[-1].children) == 1:
+                child = next(iter(chain[-1].children))
+                if not isinstance(child, STREAMING_OPS):
+                    break
+                chain.append(child)
+            if len(chain) > 1:
+                for member in chain:
+                    chains[member] = chain
+        return chains
+
     def _generate_outputs(self, op_code: str):
         """ Generate code to save outputs to file. """
         leaf_nodes = [node for node in self.dag.top_sort() if node.is_leaf()]
@@ -25,13 +66,169 @@ class PythonCodeGen(CodeGen):
             op_code += self._generate_output(leaf)
         return op_code
 
+    def _is_streamed(self, node: saldag.OpNode):
+        """
+        Return whether the output of node is produced as a stream of chunks
+        rather than a materialized relation. That is the case for streaming
+        operators and inputs whose output is either stored directly or
+        consumed by a single operator that accepts a stream.
+        """
+        if not self.py_config.chunk_size:
+            return False
+        if not (isinstance(node, (saldag.Create,) + STREAMING_OPS) or self._is_hash_join(node)):
+            return False
+        if node.is_leaf():
+            return True
+        if len(node.children) != 1:
+            return False
+        child = next(iter(node.children))
+        if isinstance(child, saldag.BinaryOpNode) and child.left_parent is child.right_parent:
+            # a stream can only be consumed once
+            return False
+        return self._consumes_stream(child)
+
+    @staticmethod
+    def _is_hash_join(node: saldag.OpNode):
+        """ Return whether node is a plain join, as opposed to its MPC variants. """
+        return isinstance(node, saldag.Join) and \
+            not isinstance(node, (saldag.IndexJoin, saldag.RevealJoin, saldag.HybridJoin))
+
+    def _consumes_stream(self, node: saldag.OpNode):
+        """ Return whether node can consume its input as a stream of chunks. """
+        if isinstance(node, STREAMING_OPS) or self._is_hash_join(node):
+            return True
+        # aggregations fold chunks into their hash table one at a time
+        return isinstance(node, saldag.Aggregate) and not isinstance(node, saldag.IndexAggregate)
+
+    def _generate_chunks(self, node: saldag.OpNode):
+        """ Generate an expression for the output of node as a stream of chunks. """
+        if self._is_streamed(node):
+            return node.out_rel.name
+        # a materialized relation is a stream with a single chunk
+        return "[{}]".format(node.out_rel.name)
+
+    def _generate_streaming_op(self, node: saldag.UnaryOpNode, func: str, args: list):
+        """ Generate code for an operator that can process its input chunk by chunk. """
+        if node in self.fused_chains:
+            chain = self.fused_chains[node]
+            # the whole chain is generated in place of its last operator
+            return self._generate_fused(chain) if node is chain[-1] else ""
+        return self._generate_stream_call(node, func, args, node.parent)
+
+    def _generate_stream_call(self, node: saldag.OpNode, func: str, args: list, parent: saldag.OpNode):
+        """
+        Generate the call of a row-local runtime function computing the output of node
+        from the output of parent, on whole relations or chunk by chunk.
+        """
+        in_rel = parent.out_rel.name
+        args = "".join([", " + str(arg) for arg in args])
+        if self._is_streamed(node):
+            return "{}{} = stream({}, {}{})\n".format(
+                self.space, node.out_rel.name, func, self._generate_chunks(parent), args)
+        elif self._is_streamed(parent):
+            return "{}{} = collect(stream({}, {}{}))\n".format(
+                self.space, node.out_rel.name, func, in_rel, args)
+        return "{}{} = {}({}{})\n".format(
+            self.space, node.out_rel.name, func, in_rel, args)
+
+    def _generate_fused(self, chain: list):
+        """
+        Generate a single function for a chain of row-local operators,
+        which computes each value once per row (or once per column in the
+        NumPy runtime) and only builds the output of the last operator.
+        """
+        head, tail = chain[0], chain[-1]
+        func = "fused_{}".format(tail.out_rel.name)
+        num_in_cols = len(head.get_in_rel().columns)
+        in_vars = ["v{}".format(idx) for idx in range(num_in_cols)]
+        # variables holding the columns of the relation at the current point in the chain
+        cols = list(in_vars)
+        # ("assign", var, expr) and ("filter", condition) steps, in chain order
+        steps = []
+        for node in chain:
+            if isinstance(node, saldag.Project):
+                cols = [cols[col.idx] for col in node.selected_cols]
+            elif isinstance(node, saldag.Filter):
+                operator = FILTER_OPERATORS.get(node.operator, node.operator)
+                in_col_idxs = {col.name: col.idx for col in node.get_in_rel().columns}
+                if node.filter_expr in in_col_idxs:
+                    expr = cols[in_col_idxs[node.filter_expr]]
+                else:
+                    expr = str(node.filter_expr)
+                steps.append(("filter", "{} {} {}".format(cols[node.target_col.idx], operator, expr)))
+            else:
+                operator = "*" if isinstance(node, saldag.Multiply) else "//"
+                operands = [cols[op.idx] if hasattr(op, "idx") else str(op) for op in node.operands]
+                var = "v{}".format(num_in_cols + len([step for step in steps if step[0] == "assign"]))
+                steps.append(("assign", var, " {} ".format(operator).join(operands)))
+                if node.target_col.idx == len(cols):
+                    cols.append(var)
+                else:
+                    cols[node.target_col.idx] = var
+
+        unpacked = ", ".join(in_vars) + ("," if len(in_vars) == 1 else "")
+        indent = self.space * 2
+        code = "{}def {}(rel):\n".format(self.space, func)
+        if self.py_config.use_numpy:
+            code += "{}{} = rel\n".format(indent, unpacked)
+            defined = list(in_vars)
+            for idx, step in enumerate(steps):
+                if step[0] == "assign":
+                    _, var, expr = step
+                    if any(token in defined for token in expr.split()):
+                        code += "{}{} = {}\n".format(indent, var, expr)
+                    else:
+                        # expressions over scalars only need to be broadcast
+                        code += "{}{} = as_column({}, len({}))\n".format(indent, var, expr, defined[0])
+                    defined.append(var)
+                else:
+                    code += "{}keep = {}\n".format(indent, step[1])
+                    # only columns that are still used need to be filtered
+                    used = set(cols)
+                    for later_step in steps[idx + 1:]:
+                        used.update(later_step[-1].split())
+                    defined = [var for var in defined if var in used]
+                    for var in defined:
+                        code += "{}{} = {}[keep]\n".format(indent, var, var)
+            code += "{}return [{}]\n".format(indent, ", ".join(cols))
+        else:
+            code += "{}res = []\n".format(indent)
+            code += "{}append = res.append\n".format(indent)
+            code += "{}for {} in rel:\n".format(indent, unpacked)
+            for step in steps:
+                if step[0] == "assign":
+                    code += "{}{} = {}\n".format(indent + self.space, step[1], step[2])
+                else:
+                    code += "{}if not ({}):\n".format(indent + self.space, step[1])
+                    code += "{}continue\n".format(indent + self.space * 2)
+            code += "{}append([{}])\n".format(indent + self.space, ", ".join(cols))
+            code += "{}return res\n".format(indent)
+        return code + self._generate_stream_call(tail, func, [], head.parent)
+
+    @staticmethod
+    def _generate_operand(operand):
+        """ Generate an expression for a column or scalar operand. """
+        if hasattr(operand, "idx"):
+            return "row[{}]".format(operand.idx)
+        return str(operand)
+
+    def _generate_arithmetic(self, op: [saldag.Multiply, saldag.Divide], operator: str):
+        """ Generate code for arithmetic operations over columns and scalars. """
+        operands = [self._generate_operand(operand) for operand in op.operands]
+        lambda_expr = "lambda row : " + " {} ".format(operator).join(operands)
+        return self._generate_streaming_op(op, "arithmetic_project", [op.target_col.idx, lambda_expr])
+
     def _generate_job(self, job_name: str, code_directory: str, op_code: str):
         """ Top level code generation function. """
         op_code = self._generate_outputs(op_code)
-        template = open("{}/top_level.tmpl"
-                        .format(self.template_directory), 'r').read()
+        # both runtimes expose the same operator functions, so only the
+        # top-level template differs between them
+        template_name = "top_level_numpy" if self.py_config.use_numpy else "top_level"
+        template = open("{}/{}.tmpl"
+                        .format(self.template_directory, template_name), 'r').read()
         data = {
-            'OP_CODE': op_code
+            'OP_CODE': op_code,
+            'MEMORY_BUDGET': str(self.py_config.memory_budget)
         }
 
         op_code = pystache.render(template, data)
@@ -40,33 +237,46 @@ class PythonCodeGen(CodeGen):
 
     def _generate_aggregate(self, agg_op: saldag.Aggregate):
         """ Generate code for Aggregate operations. """
-        # TODO handle multi-column case
-        return "{}{} = aggregate({}, {}, {}, '{}')\n".format(
+        if agg_op.aggregator not in AGGREGATORS:
+            raise Exception("Unsupported aggregator: {}".format(agg_op.aggregator))
+        group_cols = [col.idx for col in agg_op.group_cols]
+        return "{}{} = {}({}, {}, {}, '{}')\n".format(
             self.space,
             agg_op.out_rel.name,
+            "aggregate_chunks" if self._is_streamed(agg_op.parent) else "aggregate",
             agg_op.get_in_rel().name,
-            agg_op.group_cols[0].idx,
+            group_cols,
             agg_op.agg_col.idx,
             agg_op.aggregator
         )
 
     def _generate_multiply(self, mult_op: saldag.Multiply):
         """ Generate code for Multiply operations. """
-        operands = [col.idx for col in mult_op.operands]
-        lambda_expr = "lambda row : " + " * ".join(["row[{}]".format(idx) for idx in operands])
-        return "{}{} = arithmetic_project({}, {}, {})\n".format(
-            self.space,
-            mult_op.out_rel.name,
-            mult_op.get_in_rel().name,
-            mult_op.target_col.idx,
-            lambda_expr
-        )
+        return self._generate_arithmetic(mult_op, "*")
+
+    def _generate_divide(self, div_op: saldag.Divide):
+        """ Generate code for Divide operations. """
+        # integer division, relations only hold integer columns
+        return self._generate_arithmetic(div_op, "//")
+
+    def _generate_filter(self, filter_op: saldag.Filter):
+        """ Generate code for Filter operations. """
+        operator = FILTER_OPERATORS.get(filter_op.operator, filter_op.operator)
+        in_cols = {col.name: col for col in filter_op.get_in_rel().columns}
+        # filter expression is either a column name or a literal
+        if filter_op.filter_expr in in_cols:
+            expr = self._generate_operand(in_cols[filter_op.filter_expr])
+        else:
+            expr = str(filter_op.filter_expr)
+        lambda_expr = "lambda row : row[{}] {} {}".format(filter_op.target_col.idx, operator, expr)
+        return self._generate_streaming_op(filter_op, "filter_rows", [lambda_expr])
 
     def _generate_output(self, leaf: saldag.OpNode):
         """ Generate code for storing a single output. """
         schema_header = ",".join(['"' + col.name + '"' for col in leaf.out_rel.columns])
-        return "{}write_rel('{}', '{}.csv', {}, '{}')\n".format(
+        return "{}{}('{}', '{}.csv', {}, '{}')\n".format(
             self.space,
+            "write_rel_chunks" if self._is_streamed(leaf) else "write_rel",
             self.config.output_path,
             leaf.out_rel.name,
             leaf.out_rel.name,
@@ -75,32 +285,48 @@ class PythonCodeGen(CodeGen):
 
     def _generate_create(self, create_op: saldag.Create):
         """ Generate code for loading input data. """
+        path = self.config.input_path + "/" + create_op.out_rel.name + ".csv"
+        if self._is_streamed(create_op):
+            return "{}{} = read_rel_chunks('{}', {})\n".format(
+                self.space,
+                create_op.out_rel.name,
+                path,
+                self.py_config.chunk_size
+            )
         return "{}{} = read_rel('{}')\n".format(
             self.space,
             create_op.out_rel.name,
-            self.config.input_path + "/" + create_op.out_rel.name + ".csv"
+            path
         )
 
     def _generate_join(self, join_op: saldag.Join):
         """ Generate code for Join operations. """
-        return "{}{}  = join({}, {}, {}, {})\n".format(
-            self.space,
-            join_op.out_rel.name,
-            join_op.get_left_in_rel().name,
-            join_op.get_right_in_rel().name,
-            join_op.left_join_cols[0].idx,
-            join_op.right_join_cols[0].idx
+        left_cols = [col.idx for col in join_op.left_join_cols]
+        right_cols = [col.idx for col in join_op.right_join_cols]
+        if not (self._is_streamed(join_op) or self._is_streamed(join_op.left_parent)
+                or self._is_streamed(join_op.right_parent)):
+            return "{}{} = join({}, {}, {}, {})\n".format(
+                self.space,
+                join_op.out_rel.name,
+                join_op.get_left_in_rel().name,
+                join_op.get_right_in_rel().name,
+                left_cols,
+                right_cols
+            )
+        join_code = "join_chunks({}, {}, {}, {})".format(
+            self._generate_chunks(join_op.left_parent),
+            self._generate_chunks(join_op.right_parent),
+            left_cols,
+            right_cols
         )
+        if not self._is_streamed(join_op):
+            join_code = "collect({})".format(join_code)
+        return "{}{} = {}\n".format(self.space, join_op.out_rel.name, join_code)
 
     def _generate_project(self, project_op: saldag.Project):
         """ Generate code for Project operations. """
         selected_cols = [col.idx for col in project_op.selected_cols]
-        return "{}{} = project({}, {})\n".format(
-            self.space,
-            project_op.out_rel.name,
-            project_op.get_in_rel().name,
-            selected_cols
-        )
+        return self._generate_streaming_op(project_op, "project", [selected_cols])
 
     def _generate_distinct(self, distinct_op: saldag.Distinct):
         """ Generate code for Distinct operations. """
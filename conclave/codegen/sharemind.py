@@ -3,6 +3,7 @@ import sys
 
 import pystache
 
+import conclave.widths as widths
 from conclave.codegen import CodeGen
 from conclave.dag import *
 from conclave.job import SharemindJob
@@ -23,6 +24,8 @@ class SharemindCodeGen(CodeGen):
         super(SharemindCodeGen, self).__init__(config, dag)
         self.template_directory = template_directory
         self.pid = pid
+        # width of the secret type of each relation, see _rel_width
+        self.rel_widths = {}
 
     def generate(self, job_name: str, output_directory: str):
         """ Generate code for DAG passed and write to file. """
@@ -43,6 +46,8 @@ class SharemindCodeGen(CodeGen):
         controller_pid = self._get_controller_pid(nodes)
         # determine all input parties
         input_parties = self._get_input_parties(nodes)
+        # and the relations each of them inputs
+        input_rels = self._get_input_rels(nodes)
 
         # dict of all generated code
         op_code = {}
@@ -50,8 +55,8 @@ class SharemindCodeGen(CodeGen):
         # generate input code and schemas for input
         if self.pid in input_parties:
             # the data model definitions used by CSVImporter
-            # and the code the party will run to secret-share its
-            # inputs with the miners
+            # and the code the party will run to secret-share each
+            # of its inputs with the miners
             schemas, input_code = self._generate_input_code(
                 nodes, job_name, self.config.code_path)
             op_code["schemas"] = schemas
@@ -73,7 +78,7 @@ class SharemindCodeGen(CodeGen):
 
         # create job
         job = SharemindJob(job_name, self.config.code_path + "/" + job_name,
-                           controller_pid, input_parties)
+                           controller_pid, input_parties, input_rels)
         # check if this party participates in any way
         if not op_code:
             job.skip = True
@@ -116,11 +121,43 @@ class SharemindCodeGen(CodeGen):
             else:
                 print("encountered unknown operator type", repr(node))
 
-        # expand top-level protocol template
+        # expand top-level protocol template, with helper functions for each type used
         template = open(
             "{0}/protocol.tmpl".format(self.template_directory), 'r').read()
+        type_widths = sorted(set(self._rel_width(node) for node in nodes))
+        types = [{"TYPE": widths.uint_type(width)} for width in type_widths]
         return pystache.render(
-            template, {"PROTOCOL_CODE": miner_code})
+            template, {"TYPES": types, "PROTOCOL_CODE": miner_code})
+
+    def _rel_width(self, node: OpNode):
+        """
+        Width of the secret type of node's output relation. Relations are matrices of a
+        single type, so it must hold all of their columns. It is also at least as wide as
+        the relations node is computed from, so that values are only ever widened.
+        Persisted relations are the exception: jobs that read them back only know their
+        columns, so they are stored at the type that holds these.
+        """
+
+        if node not in self.rel_widths:
+            in_nodes = [] if isinstance(node, Persist) else list(node.parents)
+            if isinstance(node, IndexAggregate):
+                in_nodes += [node.eq_flag_op, node.sorted_keys_op]
+            col_widths = [widths.uint_width(col.bit_width) for col in node.out_rel.columns]
+            self.rel_widths[node] = max(col_widths + [self._rel_width(in_node) for in_node in in_nodes],
+                                        default=widths.uint_width(None))
+        return self.rel_widths[node]
+
+    def _rel_type(self, node: OpNode):
+        """ Secret type of node's output relation. """
+
+        return widths.uint_type(self._rel_width(node))
+
+    def _in_rel(self, node: OpNode, in_node: OpNode):
+        """ Name of in_node's output relation, widened to the type of node's relation if narrower. """
+
+        if self._rel_type(in_node) != self._rel_type(node):
+            return "({}) {}".format(self._rel_type(node), in_node.out_rel.name)
+        return in_node.out_rel.name
 
     def _get_controller_pid(self, nodes: list):
         """ Returns pid of Controller. """
@@ -146,52 +183,60 @@ class SharemindCodeGen(CodeGen):
         # want these in-order
         return sorted(list(input_parties))
 
+    def _get_input_rels(self, nodes: list):
+        """ Returns dict mapping pid's of input parties to the names of the relations they input. """
+
+        input_rels = {}
+        for close_op in filter(lambda op_node: isinstance(op_node, Close), nodes):
+            for pid in close_op.get_in_rel().stored_with:
+                input_rels.setdefault(pid, []).append(close_op.get_in_rel().name)
+        return input_rels
+
     def _generate_input_code(self, nodes: list, job_name: str, output_directory: str):
-        """ Generates code for loading inputs. """
+        """
+        Generates code for loading inputs, a separate script for each relation so
+        that relations can be imported in parallel and each used as soon as it is ready.
+        """
 
         # all schemas of the relations this party will input
         schemas = {}
+        # import script for each relation this party will input
+        input_code = {}
         # only need close ops to generate schemas
         close_ops = filter(lambda op_node: isinstance(op_node, Close), nodes)
         # only need schemas for my close ops
         my_close_ops = filter(
             lambda close_op: self.pid in close_op.get_in_rel().stored_with, close_ops)
-        # all CSVImports this party will perform
-        hdfs_import_statements = []
-        import_statements = []
+        # TODO: hack hack hack
+        if self.sm_config.use_docker:
+            top_level_template = open(
+                "{0}/csv_import_top_level.tmpl".format(self.template_directory), 'r').read()
+        else:
+            top_level_template = open(
+                "{0}/csv_import_no_docker.tmpl".format(self.template_directory), 'r').read()
         for close_op in my_close_ops:
             # generate schema and get its name
             name, schema, header = self._generate_schema(close_op)
             schemas[name] = schema
             # TODO: hack hack hack
             if self.sm_config.use_hdfs:
-                hdfs_import_statements.append(self._generate_hdfs_import(
-                    close_op, header, job_name)[:-1])
+                hdfs_import_statement = self._generate_hdfs_import(
+                    close_op, header, job_name)[:-1]
             else:
-                hdfs_import_statements.append("cp {} {}".format(
+                hdfs_import_statement = "cp {} {}".format(
                     self.config.output_path + "/" + name + ".csv",
                     self.config.code_path + "/" + job_name + "/" + name + ".csv"
                 )
-                )
-            # generate csv import code
-            import_statements.append(self._generate_csv_import(
-                close_op, output_directory, job_name)[:-1])
-        input_code = "&&".join(import_statements)
-        # expand top-level
-        # TODO: hack hack hack
-        if self.sm_config.use_docker:
-            top_level_template = open(
-                "{0}/csv_import_top_level.tmpl".format(self.template_directory), 'r').read()
-        else:
-            top_level_template = open(
-                "{0}/csv_import_no_docker.tmpl".format(self.template_directory), 'r').read()
-        top_level_data = {
-            "SHAREMIND_HOME": self.sm_config.home_path,
-            "HDFS_IMPORTS": "\n".join(hdfs_import_statements),
-            "IMPORTS": input_code
-        }
+            # generate csv import code and expand top-level
+            top_level_data = {
+                "SHAREMIND_HOME": self.sm_config.home_path,
+                "HDFS_IMPORTS": hdfs_import_statement,
+                "IMPORTS": self._generate_csv_import(
+                    close_op, output_directory, job_name)[:-1]
+            }
+            input_code[name] = pystache.render(top_level_template, top_level_data)
         # return schemas and input code
-        return schemas, pystache.render(top_level_template, top_level_data)
+        return schemas, input_code
 
     def _generate_submit_code(self, nodes: list, job_name: str, code_path: str):
         """ Generates code that submits Sharemind code to miners. """
@@ -262,15 +307,27 @@ class SharemindCodeGen(CodeGen):
         """ Generate code for Aggregate operations. """
 
         template = open(
-            "{0}/aggregate_sum.tmpl".format(self.template_directory), 'r').read()
+            "{0}/aggregate.tmpl".format(self.template_directory), 'r').read()
+
+        aggregators = {
+            "+": "aggregateSum",
+            "sum": "aggregateSum",
+            "count": "aggregateCount",
+            "min": "aggregateMin",
+            "max": "aggregateMax"
+        }
+        if agg_op.aggregator not in aggregators:
+            raise Exception("Unsupported aggregator: {}".format(agg_op.aggregator))
+
+        key_cols_str = ",".join([str(col.idx) for col in agg_op.group_cols])
 
-        # for now, only 1 groupCol in mpc ops
-        # TODO: update template with multi-col
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(agg_op),
+            "AGGREGATE": aggregators[agg_op.aggregator],
             "OUT_REL_NAME": agg_op.out_rel.name,
-            "IN_REL_NAME": agg_op.get_in_rel().name,
-            "KEY_COL_IDX": agg_op.group_cols[0].idx,
+            "IN_REL_NAME": self._in_rel(agg_op, agg_op.parent),
+            # hacking array brackets
+            "KEY_COLS": "{" + key_cols_str + "}",
             "AGG_COL_IDX": agg_op.agg_col.idx
         }
         return pystache.render(template, data)
@@ -282,13 +339,13 @@ class SharemindCodeGen(CodeGen):
             "{0}/index_aggregate_sum.tmpl".format(self.template_directory), 'r').read()
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(idx_agg_op),
             "OUT_REL_NAME": idx_agg_op.out_rel.name,
-            "IN_REL_NAME": idx_agg_op.get_in_rel().name,
+            "IN_REL_NAME": self._in_rel(idx_agg_op, idx_agg_op.parent),
             "GROUP_COL_IDX": idx_agg_op.group_cols[0].idx,
             "AGG_COL_IDX": idx_agg_op.agg_col.idx,
-            "EQ_FLAG_REL": idx_agg_op.eq_flag_op.out_rel.name,
-            "SORTED_KEYS_REL": idx_agg_op.sorted_keys_op.out_rel.name
+            "EQ_FLAG_REL": self._in_rel(idx_agg_op, idx_agg_op.eq_flag_op),
+            "SORTED_KEYS_REL": self._in_rel(idx_agg_op, idx_agg_op.sorted_keys_op)
         }
         return pystache.render(template, data)
 
@@ -298,16 +355,16 @@ class SharemindCodeGen(CodeGen):
         template = open(
             "{0}/close.tmpl".format(self.template_directory), 'r').read()
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(close_op),
             "OUT_REL_NAME": close_op.out_rel.name,
-            "IN_REL_NAME": close_op.get_in_rel().name
+            "IN_REL_NAME": self._in_rel(close_op, close_op.parent)
         }
         return pystache.render(template, data)
 
     def _generate_concat(self, concat_op: Concat):
         """ Generate code for Concat operations. """
 
-        in_rels = concat_op.get_in_rels()
+        in_rels = [self._in_rel(concat_op, parent) for parent in concat_op.ordered]
         assert len(in_rels) > 1
 
         # Sharemind only allows us to concatenate two relations at a time
@@ -318,7 +375,7 @@ class SharemindCodeGen(CodeGen):
         cats = cat_template
         for in_rel in in_rels[:-2]:
             data = {
-                "LEFT_REL": in_rel.name,
+                "LEFT_REL": in_rel,
                 "RIGHT_REL": cat_template
             }
             cats = pystache.render(cats, data)
@@ -326,13 +383,13 @@ class SharemindCodeGen(CodeGen):
             "{0}/concat_def.tmpl".format(self.template_directory), 'r').read()
         data = {
             "OUT_REL": concat_op.out_rel.name,
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(concat_op),
             "CATS": cats
         }
         outer = pystache.render(outer, data)
         data = {
-            "LEFT_REL": in_rels[-2].name,
-            "RIGHT_REL": in_rels[-1].name
+            "LEFT_REL": in_rels[-2],
+            "RIGHT_REL": in_rels[-1]
         }
         return pystache.render(outer, data)
 
@@ -343,7 +400,7 @@ class SharemindCodeGen(CodeGen):
             "{0}/read_from_db.tmpl".format(self.template_directory), 'r').read()
         data = {
             "NAME": create_op.out_rel.name,
-            "TYPE": "uint32"
+            "TYPE": self._rel_type(create_op)
         }
         return pystache.render(template, data)
 
@@ -361,9 +418,9 @@ class SharemindCodeGen(CodeGen):
         scalar_flags_str = ",".join(str(op) for op in scalar_flags)
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(divide_op),
             "OUT_REL": divide_op.out_rel.name,
-            "IN_REL": divide_op.get_in_rel().name,
+            "IN_REL": self._in_rel(divide_op, divide_op.parent),
             "TARGET_COL": divide_op.target_col.idx,
             # hacking array brackets
             "OPERANDS": "{" + operands_str + "}",
@@ -379,15 +436,17 @@ class SharemindCodeGen(CodeGen):
         left_rel = index_join_op.left_parent.out_rel
         right_rel = index_join_op.right_parent.out_rel
         index_rel = index_join_op.index_rel.out_rel
+        left_key_cols_str = ",".join([str(col.idx) for col in index_join_op.left_join_cols])
+        right_key_cols_str = ",".join([str(col.idx) for col in index_join_op.right_join_cols])
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(index_join_op),
             "OUT_REL": index_join_op.out_rel.name,
-            "LEFT_IN_REL": index_join_op.get_left_in_rel().name,
-            "LEFT_KEY_COLS": str(index_join_op.left_join_cols[0].idx),
-            "RIGHT_IN_REL": index_join_op.get_right_in_rel().name,
-            "RIGHT_KEY_COLS": str(index_join_op.right_join_cols[0].idx),
-            "INDEX_REL": index_rel.name
+            "LEFT_IN_REL": self._in_rel(index_join_op, index_join_op.left_parent),
+            "LEFT_KEY_COLS": "{" + left_key_cols_str + "}",
+            "RIGHT_IN_REL": self._in_rel(index_join_op, index_join_op.right_parent),
+            "RIGHT_KEY_COLS": "{" + right_key_cols_str + "}",
+            "INDEX_REL": self._in_rel(index_join_op, index_join_op.index_rel)
         }
         return pystache.render(template, data)
 
@@ -413,11 +472,11 @@ class SharemindCodeGen(CodeGen):
             [str(idx) for idx in cols_to_keep if idx not in cols_to_exclude])
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(join_op),
             "OUT_REL": join_op.out_rel.name,
-            "LEFT_IN_REL": join_op.get_left_in_rel().name,
+            "LEFT_IN_REL": self._in_rel(join_op, join_op.left_parent),
             "LEFT_KEY_COLS": "{" + left_key_cols_str + "}",
-            "RIGHT_IN_REL": join_op.get_right_in_rel().name,
+            "RIGHT_IN_REL": self._in_rel(join_op, join_op.right_parent),
             "RIGHT_KEY_COLS": "{" + right_key_cols_str + "}",
             "COLS_TO_KEEP": "{" + cols_to_keep_str + "}"
         }
@@ -442,9 +501,9 @@ class SharemindCodeGen(CodeGen):
             "{0}/shuffle.tmpl".format(self.template_directory), 'r').read()
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(shuffle_op),
             "OUT_REL": shuffle_op.out_rel.name,
-            "IN_REL": shuffle_op.get_in_rel().name
+            "IN_REL": self._in_rel(shuffle_op, shuffle_op.parent)
         }
         return pystache.render(template, data)
 
@@ -456,7 +515,7 @@ class SharemindCodeGen(CodeGen):
 
         data = {
             "OUT_REL": persist_op.out_rel.name,
-            "IN_REL": persist_op.get_in_rel().name,
+            "IN_REL": self._in_rel(persist_op, persist_op.parent),
         }
         return pystache.render(template, data)
 
@@ -469,9 +528,9 @@ class SharemindCodeGen(CodeGen):
         selected_col_str = ",".join([str(col.idx) for col in selected_cols])
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(project_op),
             "OUT_REL": project_op.out_rel.name,
-            "IN_REL": project_op.get_in_rel().name,
+            "IN_REL": self._in_rel(project_op, project_op.parent),
             # hacking array brackets
             "SELECTED_COLS": "{" + selected_col_str + "}"
         }
@@ -491,9 +550,9 @@ class SharemindCodeGen(CodeGen):
         scalar_flags_str = ",".join(str(op) for op in scalar_flags)
 
         data = {
-            "TYPE": "uint32",
+            "TYPE": self._rel_type(multiply_op),
             "OUT_REL": multiply_op.out_rel.name,
-            "IN_REL": multiply_op.get_in_rel().name,
+            "IN_REL": self._in_rel(multiply_op, multiply_op.parent),
             "TARGET_COL": multiply_op.target_col.idx,
             # hacking array brackets
             "OPERANDS": "{" + operands_str + "}",
@@ -515,7 +574,7 @@ class SharemindCodeGen(CodeGen):
             col_data = {
                 'IN_NAME': in_col.get_name(),
                 'OUT_NAME': out_col.get_name(),
-                'TYPE': "uint32"  # hard-coded for now
+                'TYPE': self._rel_type(close_op.parent)
             }
             col_defs.append(pystache.render(col_def_template, col_data))
         col_def_str = "\n".join(col_defs)
@@ -588,5 +647,10 @@ class SharemindCodeGen(CodeGen):
                 for schema_name in schemas:
                     _write(job_code_path, schema_name,
                            ext_lookup[code_type], schemas[schema_name], job_name)
+            elif code_type == "input":
+                # one input script per relation
+                for rel_name in code:
+                    _write(job_code_path, "input_" + rel_name,
+                           ext_lookup[code_type], code[rel_name], job_name)
             else:
                 _write(job_code_path, code_type, ext_lookup[code_type], code, job_name)
@@ -6,6 +6,7 @@ import warnings
 
 import conclave.dag as saldag
 import conclave.lang as sal
+import conclave.rel as rel
 import conclave.utils as utils
 
 
@@ -15,13 +16,9 @@ def push_op_node_down(top_node: saldag.OpNode, bottom_node: saldag.OpNode):
     and inserts their child nodes that can be done locally above it.
     """
 
-    # only dealing with one grandchild case for now
-    assert (len(bottom_node.children) <= 1)
-    child = next(iter(bottom_node.children), None)
-
-    # remove bottom node between the bottom node's child
+    # remove bottom node between the bottom node's children
     # and the top node
-    saldag.remove_between(top_node, child, bottom_node)
+    saldag.remove_between_children(top_node, bottom_node)
 
     # we need all parents of the parent node
     grand_parents = copy.copy(top_node.get_sorted_parents())
@@ -29,30 +26,82 @@ def push_op_node_down(top_node: saldag.OpNode, bottom_node: saldag.OpNode):
     # we will insert the removed bottom node between
     # each parent of the top node and the top node
     for idx, grand_parent in enumerate(grand_parents):
-        to_insert = copy.deepcopy(bottom_node)
+        to_insert = bottom_node.clone()
         to_insert.out_rel.rename(to_insert.out_rel.name + "_" + str(idx))
-        to_insert.parents = set()
-        to_insert.children = set()
         saldag.insert_between(grand_parent, top_node, to_insert)
         to_insert.update_stored_with()
 
 
-def split_node(node: saldag.OpNode):
+# aggregators whose result over a concatenation can be computed from the results over
+# each concatenated relation: aggregator -> (partial aggregator, final aggregator)
+DECOMPOSABLE_AGGREGATORS = {
+    "+": ("+", "+"),
+    "sum": ("sum", "sum"),
+    "count": ("count", "+"),
+    "min": ("min", "min"),
+    "max": ("max", "max")
+}
+
+# aggregators that are split into a sum and a count before decomposing
+MEAN_AGGREGATORS = {"mean", "avg"}
+
+
+def split_aggregate(node: saldag.Aggregate):
     """
-    For now, deals with case where there is a Concat into an
-    Aggregate. Here, local aggregation can be computed before
-    concatenation, and then another aggregation under MPC.
+    Splits an Aggregate whose parent is a Concat into a partial aggregate on each input
+    of the Concat, computed before concatenation, and a final aggregate that combines
+    the concatenated partial results under MPC.
     """
 
-    # Only dealing with single child case for now
-    assert (len(node.children) <= 1)
-    clone = copy.deepcopy(node)
-    clone.out_rel.rename(node.out_rel.name + "_obl")
-    clone.parents = set()
-    clone.children = set()
-    clone.is_mpc = True
-    child = next(iter(node.children), None)
-    saldag.insert_between(node, child, clone)
+    concat_op = node.parent
+    partial, final = DECOMPOSABLE_AGGREGATORS[node.aggregator]
+    node.aggregator = partial
+    push_op_node_down(concat_op, node)
+
+    # the concat now combines partial results, which are laid out like the aggregate's output
+    out_rel_cols = [col.clone() for col in node.out_rel.columns]
+    concat_op.out_rel.columns = out_rel_cols
+    concat_op.out_rel.update_columns()
+
+    final_op = node.clone()
+    final_op.out_rel.rename(node.out_rel.name + "_obl")
+    final_op.aggregator = final
+    final_op.is_mpc = True
+    saldag.insert_between_children(concat_op, final_op)
+    num_group_cols = len(node.group_cols)
+    final_op.group_cols = out_rel_cols[:num_group_cols]
+    final_op.agg_col = out_rel_cols[num_group_cols]
+
+
+def expand_mean(node: saldag.Aggregate):
+    """
+    Replaces a mean Aggregate with a sum and a count over the same groups, joined on the
+    group columns, followed by dividing the sum by the count. Both the sum and the count
+    can be split into partial and final aggregates. Returns the nodes that replace node.
+    """
+
+    parent = node.parent
+    name = node.out_rel.name
+    group_col_names = [col.name for col in node.group_cols]
+    agg_col_name = node.out_rel.columns[-1].name
+    count_col_name = agg_col_name + "_count"
+
+    parent.children.remove(node)
+    sum_op = sal.aggregate(parent, name + "_sum", group_col_names, node.agg_col.name, "sum", agg_col_name)
+    count_op = sal.aggregate(parent, name + "_count", group_col_names, node.agg_col.name, "count", count_col_name)
+    join_op = sal.join(sum_op, count_op, name + "_joined", group_col_names, group_col_names)
+    div_op = sal.divide(join_op, name + "_div", agg_col_name, [agg_col_name, count_col_name])
+    project_op = sal.project(div_op, name, group_col_names + [agg_col_name])
+    project_op.out_rel.stored_with = copy.copy(node.out_rel.stored_with)
+
+    for child in node.get_sorted_children():
+        child.replace_parent(node, project_op)
+        child.update_op_specific_cols()
+        project_op.children.add(child)
+    node.make_orphan()
+    node.children = set()
+
+    return [sum_op, count_op, join_op, div_op, project_op]
 
 
 # more than one child & is_boundary
@@ -70,7 +119,7 @@ def fork_node(node: saldag.Concat):
     for idx, child in child_it:
         # create clone and rename output relation to
         # avoid identical relation names for different nodes
-        clone = copy.deepcopy(node)
+        clone = node.clone()
         clone.out_rel.rename(node.out_rel.name + "_" + str(idx))
         clone.parents = copy.copy(node.parents)
         warnings.warn("hacky fork_node")
@@ -86,70 +135,267 @@ def fork_node(node: saldag.Concat):
 
 class DagRewriter:
     """ Top level DAG rewrite class. Traverses DAG, reorders nodes, and applies optimizations to certain nodes. """
-    def __init__(self):
+
+    # rewrite method for each node class. Nodes are dispatched on the first
+    # class in their MRO that has an entry and a matching method on the rewriter.
+    rewrite_methods = {
+        saldag.Aggregate: "_rewrite_aggregate",
+        saldag.Divide: "_rewrite_divide",
+        saldag.Project: "_rewrite_project",
+        saldag.Filter: "_rewrite_filter",
+        saldag.Multiply: "_rewrite_multiply",
+        saldag.RevealJoin: "_rewrite_reveal_join",
+        saldag.HybridJoin: "_rewrite_hybrid_join",
+        saldag.Join: "_rewrite_join",
+        saldag.Concat: "_rewrite_concat",
+        saldag.Close: "_rewrite_close",
+        saldag.Open: "_rewrite_open",
+        saldag.Create: "_rewrite_create",
+        saldag.Distinct: "_rewrite_distinct"
+    }
+
+    def __init__(self, verbose: bool = False):
 
         # If true we visit topological ordering of condag in reverse
         self.reverse = False
+        # If true we print each node we rewrite
+        self.verbose = verbose
+        # nodes touched by a rewrite that need to be rewritten again
+        self.worklist = []
+        # lookup from node class to rewrite method
+        self._handlers = {}
+
+    @classmethod
+    def register(cls, node_type: type, method_name: str):
+        """ Rewrite nodes of node_type (and its subclasses) with method_name in this class and its subclasses. """
+
+        rewrite_methods = dict(cls.rewrite_methods)
+        rewrite_methods[node_type] = method_name
+        cls.rewrite_methods = rewrite_methods
+
+    def _log(self, *args):
+
+        if self.verbose:
+            print(*args)
+
+    def _get_handler(self, node_type: type):
+
+        if node_type not in self._handlers:
+            handler = self._rewrite_unknown
+            for cls in node_type.__mro__:
+                method_name = self.rewrite_methods.get(cls)
+                if method_name is not None and hasattr(self, method_name):
+                    handler = getattr(self, method_name)
+                    break
+            self._handlers[node_type] = handler
+
+        return self._handlers[node_type]
+
+    def _rewrite_unknown(self, node: saldag.OpNode):
+        """ Nodes without a rewrite method are left unchanged. """
+
+        self._log(type(self).__name__, "skipping", type(node).__name__, node.out_rel.name)
+
+    def revisit(self, node: saldag.OpNode):
+        """ Queue a node touched by a rewrite so that this rewriter visits it again. """
+
+        self.worklist.append(node)
+
+    def visit(self, node: saldag.OpNode):
+        """ Rewrite node, then any nodes queued for another visit. """
+
+        self.worklist.append(node)
+        while self.worklist:
+            node = self.worklist.pop()
+            self._log(type(self).__name__, "rewriting", node.out_rel.name)
+            self._get_handler(type(node))(node)
 
     def rewrite(self, dag: saldag.OpDag):
         """ Traverse topologically sorted DAG, inspect each node. """
-        ordered = dag.top_sort()
-        if self.reverse:
-            ordered = ordered[::-1]
-
-        for node in ordered:
-            print(type(self).__name__, "rewriting", node.out_rel.name)
-            if isinstance(node, saldag.Aggregate):
-                self._rewrite_aggregate(node)
-            elif isinstance(node, saldag.Divide):
-                self._rewrite_divide(node)
-            elif isinstance(node, saldag.Project):
-                self._rewrite_project(node)
-            elif isinstance(node, saldag.Filter):
-                self._rewrite_filter(node)
-            elif isinstance(node, saldag.Multiply):
-                self._rewrite_multiply(node)
-            elif isinstance(node, saldag.RevealJoin):
-                self._rewrite_reveal_join(node)
-            elif isinstance(node, saldag.HybridJoin):
-                self._rewrite_hybrid_join(node)
-            elif isinstance(node, saldag.Join):
-                self._rewrite_join(node)
-            elif isinstance(node, saldag.Concat):
-                self._rewrite_concat(node)
-            elif isinstance(node, saldag.Close):
-                self._rewrite_close(node)
-            elif isinstance(node, saldag.Open):
-                self._rewrite_open(node)
-            elif isinstance(node, saldag.Create):
-                self._rewrite_create(node)
-            elif isinstance(node, saldag.Distinct):
-                self._rewrite_distinct(node)
-            else:
-                msg = "Unknown class " + type(node).__name__
-                raise Exception(msg)
+
+        run_rewriters(dag, [self])
+
+
+def run_rewriters(dag: saldag.OpDag, rewriters: list):
+    """
+    Runs several rewriters in one traversal of the DAG, handing each node to
+    every rewriter in turn. Only valid when each rewriter's decision for a node
+    depends on nodes that come before it in the traversal.
+    """
+
+    reverse = rewriters[0].reverse
+    assert all(rewriter.reverse == reverse for rewriter in rewriters)
+
+    ordered = dag.top_sort()
+    if reverse:
+        ordered = ordered[::-1]
+
+    for node in ordered:
+        for rewriter in rewriters:
+            rewriter.visit(node)
+
+
+class FilterPushUp(DagRewriter):
+    """
+    Moves filters above the Concat or Join they read from, towards the inputs of the
+    workflow, when the combined relation holds several parties' data and the filter
+    predicate only reads columns that come from one of its inputs. The filters can
+    then run in each party's local plan, before rows are secret-shared.
+    """
+
+    def __init__(self, verbose: bool = False):
+        """ Initialize FilterPushUp object. """
+
+        super(FilterPushUp, self).__init__(verbose)
+
+    @staticmethod
+    def _predicate_cols(node: saldag.Filter):
+        """ Returns indexes of the input columns that the filter predicate reads. """
+
+        idxs = [node.target_col.idx]
+        # filter expression is either a column name or a literal
+        for col in node.get_in_rel().columns:
+            if col.name == node.filter_expr:
+                idxs.append(col.idx)
+        return idxs
+
+    @staticmethod
+    def _join_col_maps(node: saldag.Join):
+        """
+        For each of the join's inputs, returns list mapping each output column index
+        to the index of the input column it comes from, or None.
+        """
+
+        left_key_idxs = [col.idx for col in node.left_join_cols]
+        right_key_idxs = [col.idx for col in node.right_join_cols]
+        # output is the key columns, then the other left columns, then the other right columns
+        left_other = [idx for idx in range(len(node.get_left_in_rel().columns)) if idx not in left_key_idxs]
+        right_other = [idx for idx in range(len(node.get_right_in_rel().columns)) if idx not in right_key_idxs]
+        left_map = left_key_idxs + left_other + [None] * len(right_other)
+        right_map = right_key_idxs + [None] * len(left_other) + right_other
+        return left_map, right_map
+
+    def _insert_filter(self, node: saldag.Filter, parent: saldag.OpNode, child: saldag.OpNode,
+                       idx: int, col_map: list):
+        """
+        Insert a copy of filter node between parent and child, where col_map maps the
+        filter's input column indexes to the indexes of parent's columns.
+        """
+
+        in_rel = parent.out_rel
+        out_rel = rel.Relation(node.out_rel.name + "_" + str(idx),
+                               [col.clone() for col in in_rel.columns], copy.copy(in_rel.stored_with))
+        out_rel.update_columns()
+        target_col = in_rel.columns[col_map[node.target_col.idx]]
+        expr = node.filter_expr
+        for col in node.get_in_rel().columns:
+            if col.name == node.filter_expr:
+                expr = in_rel.columns[col_map[col.idx]].name
+        filter_op = saldag.Filter(out_rel, None, target_col, node.operator, expr)
+        saldag.insert_between(parent, child, filter_op)
+        self._log(type(self).__name__, "inserting", out_rel.name)
+        # the copy may be able to move further up
+        self.revisit(filter_op)
+
+    def _remove_filter(self, node: saldag.Filter):
+        """
+        Remove filter node from below its parent. The parent takes over the filter's
+        output relation name and owners, so the workflow's outputs stay the same.
+        """
+
+        parent = node.parent
+        parent.children.remove(node)
+        for child in node.get_sorted_children():
+            child.replace_parent(node, parent)
+            child.update_op_specific_cols()
+            parent.children.add(child)
+        node.make_orphan()
+        node.children = set()
+        parent.out_rel.rename(node.out_rel.name)
+        parent.out_rel.stored_with = copy.copy(node.out_rel.stored_with)
+
+    def _push_above_concat(self, node: saldag.Filter):
+
+        concat_op = node.parent
+        for idx, parent in enumerate(copy.copy(concat_op.ordered)):
+            # concat matches columns by position
+            self._insert_filter(node, parent, concat_op, idx, list(range(len(parent.out_rel.columns))))
+        self._remove_filter(node)
+
+    def _push_above_join(self, node: saldag.Filter):
+
+        join_op = node.parent
+        pred_cols = self._predicate_cols(node)
+        # a predicate on key columns only holds for both inputs
+        targets = [(idx, parent, col_map) for idx, (parent, col_map) in enumerate(
+            zip([join_op.left_parent, join_op.right_parent], self._join_col_maps(join_op)))
+            if all(col_map[col_idx] is not None for col_idx in pred_cols)]
+        if not targets or join_op.left_parent is join_op.right_parent:
+            return
+        for idx, parent, col_map in targets:
+            self._insert_filter(node, parent, join_op, idx, col_map)
+        self._remove_filter(node)
+
+    def _rewrite_filter(self, node: saldag.Filter):
+
+        parent = node.parent
+        # only move filters that are the sole reader of a relation that combines several parties' data
+        if len(parent.children) != 1 or not parent.requires_mpc():
+            return
+        if isinstance(parent, saldag.Concat):
+            self._push_above_concat(node)
+        # join variants are created later during rewriting, and lay out their outputs differently
+        elif type(parent) is saldag.Join:
+            self._push_above_join(node)
 
 
 class MPCPushDown(DagRewriter):
     """ DagRewriter subclass for pushing MPC boundaries down in workflows. """
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
         """ Initialize MPCPushDown object. """
 
-        super(MPCPushDown, self).__init__()
+        super(MPCPushDown, self).__init__(verbose)
 
     def _do_commute(self, top_op: saldag.OpNode, bottom_op: saldag.OpNode):
-        # TODO: over-simplified
-        # TODO: add rules for other ops
+        """
+        Returns whether bottom_op, a child of top_op, can instead be applied to each of
+        the partial results that top_op combines, without changing the result.
+        """
 
-        if isinstance(top_op, saldag.Aggregate):
-            if isinstance(bottom_op, saldag.Divide):
-                return True
-            else:
-                return False
-        else:
+        if not isinstance(top_op, saldag.Aggregate):
             return False
 
+        num_group_cols = len(top_op.group_cols)
+        if isinstance(bottom_op, saldag.Filter):
+            # rows are kept or dropped by group, so filtering partial results drops the same groups
+            return all(idx < num_group_cols for idx in FilterPushUp._predicate_cols(bottom_op))
+
+        if isinstance(bottom_op, (saldag.Multiply, saldag.Divide)):
+            target_idx = bottom_op.target_col.idx
+            operands = bottom_op.operands
+            # only rules for scaling a column in place by constants
+            if not (isinstance(operands[0], rel.Column) and operands[0].idx == target_idx) or \
+                    any(isinstance(op, rel.Column) for op in operands[1:]):
+                return False
+            scalars = operands[1:]
+            if any(scalar == 0 for scalar in scalars):
+                return False
+            # division is integer division, which merges distinct values and does not
+            # distribute over sums
+            is_multiply = isinstance(bottom_op, saldag.Multiply)
+            if target_idx < num_group_cols:
+                # scaling by non-zero constants keeps distinct group keys distinct
+                return is_multiply
+            if target_idx == num_group_cols:
+                # c * (x + y) = c * x + c * y
+                if top_op.aggregator in ("+", "sum"):
+                    return is_multiply
+                # multiplying or dividing by c > 0 never reverses the order of values
+                return top_op.aggregator in ("min", "max") and all(scalar > 0 for scalar in scalars)
+
+        return False
+
     def _rewrite_default(self, node: saldag.OpNode):
         """
         Throughout the rewrite process, a node might switch from requiring
@@ -176,6 +422,9 @@ class MPCPushDown(DagRewriter):
             # node is not leaf
             if isinstance(parent, saldag.Concat) and parent.is_boundary():
                 push_op_node_down(parent, node)
+                # the concat now feeds all of node's children
+                if len(parent.children) > 1:
+                    fork_node(parent)
             elif isinstance(parent, saldag.Aggregate) and self._do_commute(parent, node):
                 agg_op = parent
                 agg_parent = agg_op.parent
@@ -198,8 +447,19 @@ class MPCPushDown(DagRewriter):
         parent = next(iter(node.parents))
         if parent.is_mpc:
             if isinstance(parent, saldag.Concat) and parent.is_boundary():
-                split_node(node)
-                push_op_node_down(parent, node)
+                # the aggregate is split on a concat of its own
+                if len(parent.children) > 1:
+                    fork_node(parent)
+                if node.aggregator in DECOMPOSABLE_AGGREGATORS:
+                    split_aggregate(node)
+                elif node.aggregator in MEAN_AGGREGATORS:
+                    expanded = expand_mean(node)
+                    fork_node(parent)
+                    # split the sum and the count first
+                    for expanded_node in reversed(expanded):
+                        self.revisit(expanded_node)
+                else:
+                    node.is_mpc = True
             else:
                 node.is_mpc = True
         else:
@@ -249,10 +509,10 @@ class MPCPushDown(DagRewriter):
 class MPCPushUp(DagRewriter):
     """ DagRewriter subclass for pushing MPC boundary up in workflows. """
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
         """ Initialize MPCPushUp object. """
 
-        super(MPCPushUp, self).__init__()
+        super(MPCPushUp, self).__init__(verbose)
         self.reverse = True
 
     def _rewrite_unary_default(self, node: saldag.UnaryOpNode):
@@ -260,7 +520,7 @@ class MPCPushUp(DagRewriter):
 
         par = next(iter(node.parents))
         if node.is_reversible() and node.is_lower_boundary() and not par.is_root():
-            print("lower boundary", node)
+            self._log("lower boundary", node)
             node.get_in_rel().stored_with = copy.copy(node.out_rel.stored_with)
             node.is_mpc = False
 
@@ -307,7 +567,8 @@ class MPCPushUp(DagRewriter):
 
             out_stored_with = node.out_rel.stored_with
             for par in node.parents:
-                if not par.is_root():
+                # local parents keep their output and send it in the clear instead
+                if not par.is_root() and par.is_mpc:
                     par.out_rel.stored_with = copy.copy(out_stored_with)
             node.is_mpc = False
 
@@ -323,9 +584,9 @@ class CollSetPropDown(DagRewriter):
     which are defined over whole relations.
     """
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
 
-        super(CollSetPropDown, self).__init__()
+        super(CollSetPropDown, self).__init__(verbose)
 
     def _rewrite_aggregate(self, node: [saldag.Aggregate, saldag.IndexAggregate]):
         """ Push down collusion sets for an Aggregate or IndexAggregate node. """
@@ -333,10 +594,10 @@ class CollSetPropDown(DagRewriter):
         in_group_cols = node.group_cols
         out_group_cols = node.out_rel.columns[:-1]
         for i in range(len(out_group_cols)):
-            out_group_cols[i].coll_sets |= copy.deepcopy(in_group_cols[i].coll_sets)
+            out_group_cols[i].coll_sets |= in_group_cols[i].coll_sets
         in_agg_col = node.agg_col
         out_agg_col = node.out_rel.columns[-1]
-        out_agg_col.coll_sets |= copy.deepcopy(in_agg_col.coll_sets)
+        out_agg_col.coll_sets |= in_agg_col.coll_sets
 
     def _rewrite_divide(self, node: saldag.Divide):
         """ Push down collusion sets for a Divide node. """
@@ -354,7 +615,7 @@ class CollSetPropDown(DagRewriter):
         # simply carry over
         for in_col, out_col in zip(node.get_in_rel().columns, out_rel_cols):
             if in_col != target_col:
-                out_col.coll_sets |= copy.deepcopy(in_col.coll_sets)
+                out_col.coll_sets |= in_col.coll_sets
 
     def _rewrite_project(self, node: saldag.Project):
         """ Push down collusion sets for a Project node. """
@@ -362,7 +623,7 @@ class CollSetPropDown(DagRewriter):
         selected_cols = node.selected_cols
 
         for in_col, out_col in zip(selected_cols, node.out_rel.columns):
-            out_col.coll_sets |= copy.deepcopy(in_col.coll_sets)
+            out_col.coll_sets |= in_col.coll_sets
 
     def _rewrite_filter(self, node: saldag.Filter):
         """ Push down collusion sets for a Filter node. """
@@ -370,7 +631,7 @@ class CollSetPropDown(DagRewriter):
         out_rel_cols = node.out_rel.columns
 
         for in_col, out_col in zip(node.get_in_rel().columns, out_rel_cols):
-            out_col.coll_sets |= copy.deepcopy(in_col.coll_sets)
+            out_col.coll_sets |= in_col.coll_sets
 
     def _rewrite_multiply(self, node: saldag.Multiply):
         """ Push down collusion sets for a Multiply node. """
@@ -388,7 +649,7 @@ class CollSetPropDown(DagRewriter):
         # simply carry over
         for in_col, out_col in zip(node.get_in_rel().columns, out_rel_cols):
             if in_col != target_col:
-                out_col.coll_sets |= copy.deepcopy(in_col.coll_sets)
+                out_col.coll_sets |= in_col.coll_sets
 
     def _rewrite_hybrid_join(self, node: saldag.HybridJoin):
 
@@ -446,9 +707,9 @@ class CollSetPropDown(DagRewriter):
 
 class HybridJoinOpt(DagRewriter):
     """ DagRewriter subclass specific to HybridJoin optimization rewriting. """
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
 
-        super(HybridJoinOpt, self).__init__()
+        super(HybridJoinOpt, self).__init__(verbose)
 
     def _rewrite_aggregate(self, node: saldag.Aggregate):
 
@@ -514,9 +775,9 @@ class InsertOpenAndCloseOps(DagRewriter):
     MPC and non-MPC boundaries into the DAG.
     """
 
-    def __init__(self):
+    def __init__(self, verbose: bool = False):
 
-        super(InsertOpenAndCloseOps, self).__init__()
+        super(InsertOpenAndCloseOps, self).__init__(verbose)
 
     def _rewrite_default_unary(self, node: saldag.UnaryOpNode):
         """
@@ -533,7 +794,7 @@ class InsertOpenAndCloseOps(DagRewriter):
                 # input is stored with one set of parties
                 # but output must be stored with another so we
                 # need an open operation
-                out_rel = copy.deepcopy(node.out_rel)
+                out_rel = node.out_rel.clone()
                 out_rel.rename(out_rel.name + "_open")
                 # reset stored_with on parent so input matches output
                 node.out_rel.stored_with = copy.copy(in_stored_with)
@@ -587,7 +848,7 @@ class InsertOpenAndCloseOps(DagRewriter):
         for parent in ordered_pars:
             if node.is_upper_boundary():
                 # Entering mpc mode so need to secret-share before op
-                out_rel = copy.deepcopy(parent.out_rel)
+                out_rel = parent.out_rel.clone()
                 out_rel.rename(out_rel.name + "_close")
                 out_rel.stored_with = copy.copy(in_stored_with)
                 # create and insert close node
@@ -616,7 +877,7 @@ class InsertOpenAndCloseOps(DagRewriter):
         for parent in ordered_pars:
             par_stored_with = parent.out_rel.stored_with
             if par_stored_with != out_stored_with:
-                out_rel = copy.deepcopy(parent.out_rel)
+                out_rel = parent.out_rel.clone()
                 out_rel.rename(out_rel.name + "_close")
                 out_rel.stored_with = copy.copy(out_stored_with)
                 # create and insert close node
@@ -635,8 +896,8 @@ class ExpandCompositeOps(DagRewriter):
     (for example hybrid joins) into subdags of primitive operators.
     """
 
-    def __init__(self):
-        super(ExpandCompositeOps, self).__init__()
+    def __init__(self, verbose: bool = False):
+        super(ExpandCompositeOps, self).__init__(verbose)
 
     def _rewrite_aggregate(self, node: [saldag.Aggregate, saldag.IndexAggregate]):
         pass
@@ -731,16 +992,469 @@ class ExpandCompositeOps(DagRewriter):
         pass
 
 
-def rewrite_dag(dag: saldag.OpDag):
+class MergeCommonSubexpressions(DagRewriter):
+    """
+    Merges operator nodes that compute the same relation, that is, nodes of the same
+    type with the same parameters, output columns and owners over the same parents.
+    Nodes are visited in topological order, so whole duplicated sub-plans collapse
+    into one, whose result is then shared by the children of all copies. Outputs of
+    the workflow are never merged.
+    """
+
+    def __init__(self, verbose: bool = False):
+
+        super(MergeCommonSubexpressions, self).__init__(verbose)
+        # node signature -> first node seen with that signature
+        self.seen = {}
+
+    @staticmethod
+    def _operand(operand):
+
+        return ("col", operand.idx) if isinstance(operand, rel.Column) else ("val", operand)
+
+    def _merge(self, node: saldag.OpNode, parents: tuple, params: tuple):
+        """ Replace node with an earlier node of the same signature, if there is one. """
+
+        if node.is_leaf():
+            return
+        signature = (
+            type(node),
+            parents,
+            params,
+            tuple(col.name for col in node.out_rel.columns),
+            frozenset(node.out_rel.stored_with)
+        )
+        kept = self.seen.setdefault(signature, node)
+        if kept is node:
+            return
+
+        self._log(type(self).__name__, "merging", node.out_rel.name, "into", kept.out_rel.name)
+        for parent in node.parents:
+            parent.children.discard(node)
+        for child in node.get_sorted_children():
+            child.replace_parent(node, kept)
+            child.update_op_specific_cols()
+            kept.children.add(child)
+        node.make_orphan()
+        node.children = set()
+
+    def _rewrite_unary(self, node: saldag.UnaryOpNode, params: tuple):
+
+        self._merge(node, (node.parent,), params)
+
+    def _rewrite_project(self, node: saldag.Project):
+
+        self._rewrite_unary(node, tuple(col.idx for col in node.selected_cols))
+
+    def _rewrite_filter(self, node: saldag.Filter):
+
+        self._rewrite_unary(node, (node.target_col.idx, node.operator, node.filter_expr))
+
+    def _rewrite_arithmetic(self, node: [saldag.Multiply, saldag.Divide]):
+
+        self._rewrite_unary(node, (node.target_col.idx, tuple(self._operand(op) for op in node.operands)))
+
+    def _rewrite_multiply(self, node: saldag.Multiply):
+
+        self._rewrite_arithmetic(node)
+
+    def _rewrite_divide(self, node: saldag.Divide):
+
+        self._rewrite_arithmetic(node)
+
+    def _rewrite_aggregate(self, node: saldag.Aggregate):
+
+        if isinstance(node, saldag.IndexAggregate):
+            return
+        params = (tuple(col.idx for col in node.group_cols), node.agg_col.idx, node.aggregator)
+        self._rewrite_unary(node, params)
+
+    def _rewrite_distinct(self, node: saldag.Distinct):
+
+        self._rewrite_unary(node, tuple(col.idx for col in node.selected_cols))
+
+    def _rewrite_sort_by(self, node: saldag.SortBy):
+
+        self._rewrite_unary(node, (node.sort_by_col.idx,))
+
+    def _rewrite_join(self, node: saldag.Join):
+
+        # join variants carry more state than their join columns
+        if type(node) is not saldag.Join:
+            return
+        params = (tuple(col.idx for col in node.left_join_cols), tuple(col.idx for col in node.right_join_cols))
+        self._merge(node, (node.left_parent, node.right_parent), params)
+
+    def _rewrite_concat(self, node: saldag.Concat):
+
+        self._merge(node, tuple(node.ordered), ())
+
+
+class ColumnLiveness(DagRewriter):
+    """
+    Computes from the leaves upward which output columns of each node are read by
+    a downstream operator or are part of a workflow output. Columns are identified
+    by their index in the node's original output relation.
+    """
+
+    def __init__(self, verbose: bool = False):
+
+        super(ColumnLiveness, self).__init__(verbose)
+        self.reverse = True
+        # node -> indexes of live output columns
+        self.live = {}
+        # node -> (parent, idxs) pairs, where idxs gives for each output column the index
+        # of the parent column it is copied from, or None if it is not copied from parent
+        self.sources = {}
+        # nodes whose output relation can be narrowed to fewer columns
+        self.narrowable = set()
+        # node -> number of columns in its original output relation
+        self.widths = {}
+
+    def _propagate(self, node: saldag.OpNode, sources: list, uses: list, narrowable: bool = True):
+        """
+        Record which columns node passes on from its parents, and mark as live the parent
+        columns that its own live columns come from, along with the columns it reads.
+        """
+
+        width = len(node.out_rel.columns)
+        self.widths[node] = width
+        self.sources[node] = sources
+        if narrowable and node.children:
+            self.narrowable.add(node)
+            live = self.live.get(node, set())
+            # keep at least one column so that every relation stays well-formed
+            if not live and width:
+                live = {0}
+        else:
+            live = set(range(width))
+        self.live[node] = live
+
+        for parent, idxs in sources:
+            parent_live = self.live.setdefault(parent, set())
+            if isinstance(idxs, range):
+                # columns are passed through unchanged
+                parent_live.update(live)
+            else:
+                parent_live.update(idxs[idx] for idx in live if idxs[idx] is not None)
+        for parent, parent_idx in uses:
+            self.live.setdefault(parent, set()).add(parent_idx)
+
+    def _pass_through(self, node: saldag.UnaryOpNode, uses: list = ()):
+
+        self._propagate(node, [(node.parent, range(len(node.out_rel.columns)))], list(uses))
+
+    def _rewrite_unknown(self, node: saldag.OpNode):
+        """ Operators without a rule read every column of their inputs and keep their outputs. """
+
+        uses = [(parent, idx) for parent in node.parents for idx in range(len(parent.out_rel.columns))]
+        self._propagate(node, [], uses, False)
+
+    def _rewrite_create(self, node: saldag.Create):
+
+        self._propagate(node, [], [])
+        # inputs cannot be narrowed themselves, a projection is inserted below them instead
+        self.narrowable.discard(node)
+
+    def _rewrite_project(self, node: saldag.Project):
+
+        self._propagate(node, [(node.parent, [col.idx for col in node.selected_cols])], [])
+
+    def _rewrite_filter(self, node: saldag.Filter):
+
+        uses = [(node.parent, node.target_col.idx)]
+        for col in node.get_in_rel().columns:
+            # filter expression is either a column name or a literal
+            if col.name == node.filter_expr:
+                uses.append((node.parent, col.idx))
+        self._pass_through(node, uses)
+
+    def _rewrite_sort_by(self, node: saldag.SortBy):
+
+        self._pass_through(node, [(node.parent, node.sort_by_col.idx)])
+
+    def _rewrite_pass_through(self, node: saldag.UnaryOpNode):
+
+        self._pass_through(node)
+
+    def _rewrite_open(self, node: saldag.Open):
+
+        self._pass_through(node)
+
+    def _rewrite_close(self, node: saldag.Close):
+
+        self._pass_through(node)
+
+    def _rewrite_arithmetic(self, node: [saldag.Multiply, saldag.Divide]):
+
+        in_width = len(node.get_in_rel().columns)
+        idxs = list(range(in_width))
+        if node.target_col.idx < in_width:
+            # target column is overwritten
+            idxs[node.target_col.idx] = None
+        else:
+            idxs.append(None)
+        uses = [(node.parent, op.idx) for op in node.operands if isinstance(op, rel.Column)]
+        self._propagate(node, [(node.parent, idxs)], uses)
+
+    def _rewrite_multiply(self, node: saldag.Multiply):
+
+        self._rewrite_arithmetic(node)
+
+    def _rewrite_divide(self, node: saldag.Divide):
+
+        self._rewrite_arithmetic(node)
+
+    def _rewrite_index(self, node: saldag.Index):
+
+        idxs = [None] + list(range(len(node.get_in_rel().columns)))
+        self._propagate(node, [(node.parent, idxs)], [])
+
+    def _rewrite_aggregate(self, node: [saldag.Aggregate, saldag.IndexAggregate]):
+
+        uses = [(node.parent, col.idx) for col in node.group_cols + [node.agg_col]]
+        self._propagate(node, [], uses, False)
+
+    def _rewrite_distinct(self, node: saldag.Distinct):
+
+        uses = [(node.parent, col.idx) for col in node.selected_cols]
+        self._propagate(node, [], uses, False)
+
+    def _rewrite_comp_neighs(self, node: saldag.CompNeighs):
+
+        self._propagate(node, [], [(node.parent, node.comp_col.idx)], False)
+
+    def _rewrite_join(self, node: saldag.Join):
+
+        # output is the key columns, then the other left columns, then the other right columns
+        copied = []
+        uses = []
+        for parent, key_cols in [(node.left_parent, node.left_join_cols), (node.right_parent, node.right_join_cols)]:
+            key_idxs = set(col.idx for col in key_cols)
+            copied.append([idx for idx in range(len(parent.out_rel.columns)) if idx not in key_idxs])
+            uses += [(parent, idx) for idx in key_idxs]
+        left_copied, right_copied = copied
+        key_none = [None] * len(node.left_join_cols)
+        sources = [
+            (node.left_parent, key_none + left_copied + [None] * len(right_copied)),
+            (node.right_parent, key_none + [None] * len(left_copied) + right_copied)
+        ]
+        self._propagate(node, sources, uses)
+
+    def _rewrite_concat(self, node: saldag.Concat):
+
+        width = len(node.out_rel.columns)
+        self._propagate(node, [(parent, range(width)) for parent in node.ordered], [])
+
+    def _rewrite_reveal_join(self, node: saldag.RevealJoin):
+
+        self._rewrite_unknown(node)
+
+    def _rewrite_hybrid_join(self, node: saldag.HybridJoin):
+
+        self._rewrite_unknown(node)
+
+    def _rewrite_index_join(self, node: saldag.IndexJoin):
+
+        self._rewrite_unknown(node)
+
+
+class PruneDeadColumns(DagRewriter):
+    """
+    Drops columns that no downstream operator or output reads. Projections keep only
+    live columns, operators that pass columns through keep what their input keeps, and
+    a projection is inserted below inputs that have dead columns, so that dead columns
+    are never secret-shared or carried through MPC operators.
+    """
+
+    def __init__(self, verbose: bool = False):
+
+        super(PruneDeadColumns, self).__init__(verbose)
+        self.liveness = None
+        # node -> original column index -> column in narrowed output relation
+        self.col_map = {}
+        # (child, parent) -> projection inserted between them
+        self.inserted = {}
+        # nodes whose output relation needs reindexing
+        self.narrowed = []
+
+    def rewrite(self, dag: saldag.OpDag):
+
+        self.liveness = ColumnLiveness(self.verbose)
+        self.liveness.rewrite(dag)
+        super(PruneDeadColumns, self).rewrite(dag)
+        # column indexes are only updated at the end, so that operator columns can be
+        # looked up by their original index during the traversal
+        for node in self.narrowed:
+            node.out_rel.update_columns()
+
+    def _col(self, parent: saldag.OpNode, col):
+        """ Returns the column of parent's narrowed output that was at col's original index. """
+
+        if isinstance(col, rel.Column):
+            return self.col_map[parent][col.idx]
+        return col
+
+    def _kept(self, node: saldag.OpNode):
+
+        if node not in self.liveness.narrowable:
+            return list(range(self.liveness.widths[node]))
+        if isinstance(node, (saldag.Project, saldag.Concat)):
+            return sorted(self.liveness.live[node])
+        # other operators keep a column unless it is copied from a parent that dropped it
+        dropped = set()
+        for parent, idxs in self.liveness.sources[node]:
+            parent = self.inserted.get((node, parent), parent)
+            parent_cols = self.col_map[parent]
+            if len(parent_cols) < self.liveness.widths[parent]:
+                dropped.update(idx for idx, parent_idx in enumerate(idxs)
+                               if parent_idx is not None and parent_idx not in parent_cols)
+        return [idx for idx in range(self.liveness.widths[node]) if idx not in dropped]
+
+    def _narrow(self, node: saldag.OpNode):
+
+        columns = node.out_rel.columns
+        kept = self._kept(node)
+        self.col_map[node] = {idx: columns[idx] for idx in kept}
+        if len(kept) < len(columns):
+            self._log(type(self).__name__, "narrowing", node.out_rel.name, len(columns), "->", len(kept))
+            node.out_rel.columns = [columns[idx] for idx in kept]
+        self.narrowed.append(node)
+
+    def _insert_project(self, parent: saldag.OpNode, children: list, idxs: list):
+        """ Insert projection onto the columns at idxs of parent's output between parent and children. """
+
+        selected_cols = [self.col_map[parent][idx] for idx in idxs]
+        out_rel_cols = [col.clone() for col in selected_cols]
+        for col in out_rel_cols:
+            col.coll_sets = utils.CollusionRecord()
+        out_rel = rel.Relation(parent.out_rel.name + "_live", out_rel_cols, copy.copy(parent.out_rel.stored_with))
+        project_op = saldag.Project(out_rel, parent, selected_cols)
+        self._log(type(self).__name__, "inserting", out_rel.name)
+
+        for child in children:
+            child.replace_parent(parent, project_op)
+            parent.children.remove(child)
+            project_op.children.add(child)
+            self.inserted[(child, parent)] = project_op
+        parent.children.add(project_op)
+
+        # the projection's columns keep the original indexes of parent's columns
+        self.col_map[project_op] = dict(zip(idxs, out_rel_cols))
+        self.liveness.widths[project_op] = self.liveness.widths[parent]
+        self.narrowed.append(project_op)
+        return project_op
+
+    def _rewrite_unknown(self, node: saldag.OpNode):
+
+        self._narrow(node)
+
+    def _rewrite_create(self, node: saldag.Create):
+
+        self._narrow(node)
+        live = sorted(self.liveness.live[node])
+        if len(live) < self.liveness.widths[node]:
+            self._insert_project(node, list(node.children), live)
+
+    def _rewrite_project(self, node: saldag.Project):
+
+        kept = self._kept(node)
+        node.selected_cols = [self._col(node.parent, node.selected_cols[idx]) for idx in kept]
+        self._narrow(node)
+
+    def _rewrite_filter(self, node: saldag.Filter):
+
+        node.target_col = self._col(node.parent, node.target_col)
+        self._narrow(node)
+
+    def _rewrite_sort_by(self, node: saldag.SortBy):
+
+        node.sort_by_col = self._col(node.parent, node.sort_by_col)
+        self._narrow(node)
+
+    def _rewrite_arithmetic(self, node: [saldag.Multiply, saldag.Divide]):
+
+        if node.target_col.idx < self.liveness.widths[node.parent]:
+            node.target_col = self._col(node.parent, node.target_col)
+        node.operands = [self._col(node.parent, op) for op in node.operands]
+        self._narrow(node)
+
+    def _rewrite_multiply(self, node: saldag.Multiply):
+
+        self._rewrite_arithmetic(node)
+
+    def _rewrite_divide(self, node: saldag.Divide):
+
+        self._rewrite_arithmetic(node)
+
+    def _rewrite_aggregate(self, node: [saldag.Aggregate, saldag.IndexAggregate]):
+
+        node.group_cols = [self._col(node.parent, col) for col in node.group_cols]
+        node.agg_col = self._col(node.parent, node.agg_col)
+        self._narrow(node)
+
+    def _rewrite_distinct(self, node: saldag.Distinct):
+
+        node.selected_cols = [self._col(node.parent, col) for col in node.selected_cols]
+        self._narrow(node)
+
+    def _rewrite_comp_neighs(self, node: saldag.CompNeighs):
+
+        node.comp_col = self._col(node.parent, node.comp_col)
+        self._narrow(node)
+
+    def _rewrite_join(self, node: saldag.Join):
+
+        node.left_join_cols = [self._col(node.left_parent, col) for col in node.left_join_cols]
+        node.right_join_cols = [self._col(node.right_parent, col) for col in node.right_join_cols]
+        self._narrow(node)
+
+    def _rewrite_concat(self, node: saldag.Concat):
+
+        live = sorted(self.liveness.live[node])
+        # inputs are matched by position, so each must keep exactly the live columns
+        for parent in list(node.ordered):
+            if sorted(self.col_map[parent]) != live:
+                self._insert_project(parent, [node], live)
+        self._narrow(node)
+
+    def _rewrite_reveal_join(self, node: saldag.RevealJoin):
+
+        self._narrow(node)
+
+    def _rewrite_hybrid_join(self, node: saldag.HybridJoin):
+
+        self._narrow(node)
+
+    def _rewrite_index_join(self, node: saldag.IndexJoin):
+
+        self._narrow(node)
+
+
+for _rewriter in [ColumnLiveness, PruneDeadColumns]:
+    _rewriter.register(saldag.SortBy, "_rewrite_sort_by")
+    _rewriter.register(saldag.Index, "_rewrite_index")
+    _rewriter.register(saldag.CompNeighs, "_rewrite_comp_neighs")
+    _rewriter.register(saldag.IndexJoin, "_rewrite_index_join")
+    for _node_type in [saldag.Shuffle, saldag.Persist, saldag.Store, saldag.Send]:
+        _rewriter.register(_node_type, "_rewrite_pass_through")
+MergeCommonSubexpressions.register(saldag.SortBy, "_rewrite_sort_by")
+
+
+def rewrite_dag(dag: saldag.OpDag, verbose: bool = False):
     """ Combines and calls all rewrite operations. """
 
-    MPCPushDown().rewrite(dag)
+    MergeCommonSubexpressions(verbose).rewrite(dag)
+    PruneDeadColumns(verbose).rewrite(dag)
+    FilterPushUp(verbose).rewrite(dag)
+    MPCPushDown(verbose).rewrite(dag)
     # ironic?
-    MPCPushUp().rewrite(dag)
-    CollSetPropDown().rewrite(dag)
-    HybridJoinOpt().rewrite(dag)
-    InsertOpenAndCloseOps().rewrite(dag)
-    ExpandCompositeOps().rewrite(dag)
+    MPCPushUp(verbose).rewrite(dag)
+    # collusion sets only flow downwards, so a join can be turned into a
+    # hybrid join as soon as its own collusion sets are known
+    run_rewriters(dag, [CollSetPropDown(verbose), HybridJoinOpt(verbose)])
+    InsertOpenAndCloseOps(verbose).rewrite(dag)
+    ExpandCompositeOps(verbose).rewrite(dag)
     return dag
 
 
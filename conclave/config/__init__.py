@@ -27,7 +27,7 @@ config_all = CodeGenConfig("big_job"). \
 class NetworkConfig:
     """ Config object for network module. """
 
-    def __init__(self, parties: list, pid: int = 1):
+    def __init__(self, parties: list, pid: int = 1, legacy_framing: bool = False):
         """ Initialize NetworkConfig object. """
 
         self.inited = True
@@ -36,6 +36,9 @@ class NetworkConfig:
         # and their own master node / port is indicated in network_config['parties'],
         # where the PID corresponds to each tuple.
         self.parties = parties
+        # send messages in the old delimiter-separated format, for talking to
+        # peers that do not understand length-prefixed frames yet
+        self.legacy_framing = legacy_framing
 
     def set_network_config(self):
         """ Return network configuration dict. """
@@ -46,7 +49,8 @@ class NetworkConfig:
                 1: {"host": self.parties[0]['host'], "port": self.parties[0]['port']},
                 2: {"host": self.parties[1]['host'], "port": self.parties[1]['port']},
                 3: {"host": self.parties[2]['host'], "port": self.parties[2]['port']}
-            }
+            },
+            "legacy_framing": self.legacy_framing
         }
 
         return network_config
@@ -72,6 +76,39 @@ class SparkConfig:
         self.spark_master_url = spark_master_url
 
 
+class PythonConfig:
+    """ Python backend configuration. """
+
+    def __init__(self, use_numpy: bool = False, chunk_size: [int, None] = None,
+                 memory_budget: [int, None] = None, fuse_ops: bool = True,
+                 dispatch_mode: str = "process", num_workers: int = 1):
+        """ Initialize PythonConfig object. """
+
+        # Generated jobs keep relations as typed NumPy column arrays
+        # and run vectorized operators instead of iterating over rows.
+        self.use_numpy = use_numpy
+        # Size in bytes of the input blocks that streaming operators
+        # (project, multiply, divide, filter) process at a time. If None,
+        # every relation is loaded into memory in full.
+        self.chunk_size = chunk_size
+        # Size in bytes that operator state, such as the hash table of an
+        # aggregation, may take up before it gets spilled to disk. If None,
+        # operator state is always kept in memory.
+        self.memory_budget = memory_budget
+        # Compile chains of row-local operators (project, multiply, divide,
+        # filter) into one function instead of materializing every
+        # intermediate relation.
+        self.fuse_ops = fuse_ops
+        # How jobs are run: "process" starts a python3 process per job,
+        # "in_process" runs them in the dispatching process and "pool" in a
+        # pool of num_workers long-lived worker processes. In the latter two
+        # modes, relations stay in memory for later jobs in the same process
+        # until no later job reads them, and a pool runs each job on the
+        # worker that produced its inputs.
+        self.dispatch_mode = dispatch_mode
+        self.num_workers = num_workers
+
+
 class CodeGenConfig:
     """ Config object for code generation module. """
 
@@ -89,6 +126,11 @@ class CodeGenConfig:
         self.input_path = '/tmp'
         self.output_path = '/tmp'
         self.system_configs = {}
+        # maximum number of jobs that run at the same time, per framework
+        self.max_concurrent_jobs = {}
+        # partitioner used to split the workflow into jobs, and its cost model if cost-based
+        self.partitioner = "heupart"
+        self.cost_model = None
         self.pid = 1
         self.all_pids = [1, 2, 3]
         self.network_config = {
@@ -136,6 +178,34 @@ class CodeGenConfig:
 
         return self
 
+    def with_python_config(self, cfg: PythonConfig):
+        """ Add PythonConfig object to this object. """
+
+        if not self.inited:
+            self.__init__()
+        self.system_configs["python"] = cfg
+
+        return self
+
+    def with_max_concurrent_jobs(self, framework: str, limit: int):
+        """ Set how many jobs of a framework may run at the same time (default is 1). """
+
+        if not self.inited:
+            self.__init__()
+        self.max_concurrent_jobs[framework] = limit
+
+        return self
+
+    def with_partitioner(self, partitioner: str, cost_model=None):
+        """ Select partitioner, either 'heupart' (default) or cost-based 'costpart' with optional CostModel. """
+
+        if not self.inited:
+            self.__init__()
+        self.partitioner = partitioner
+        self.cost_model = cost_model
+
+        return self
+
     def with_network_config(self, cfg: NetworkConfig):
         """ Add network config to this object. """
 
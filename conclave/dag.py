@@ -2,19 +2,66 @@
 Data structure for representing a workflow directed acyclic graph (DAG).
 """
 import copy
+import functools
 from conclave import rel
 
 
+class EdgeSet(set):
+    """
+    Set of a node's parents or children. Counts modifications to any edge set
+    so that DAGs can tell when a cached topological order is stale.
+    """
+    version = 0
+
+
+def _modifies_edges(method):
+
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        EdgeSet.version += 1
+        return method(self, *args)
+
+    return wrapper
+
+
+for _method in ["add", "remove", "discard", "pop", "clear", "update", "difference_update",
+                "intersection_update", "symmetric_difference_update",
+                "__ior__", "__iand__", "__isub__", "__ixor__"]:
+    setattr(EdgeSet, _method, _modifies_edges(getattr(set, _method)))
+
+
 class Node:
     """
     Graph node data structure.
     """
+    __slots__ = ("name", "_children", "_parents")
+
     def __init__(self, name: str):
         """ Initalize graph node object. """
         self.name = name
         self.children = set()
         self.parents = set()
 
+    @property
+    def children(self):
+        """ Set of child nodes. """
+        return self._children
+
+    @children.setter
+    def children(self, nodes: set):
+        EdgeSet.version += 1
+        self._children = nodes if isinstance(nodes, EdgeSet) else EdgeSet(nodes)
+
+    @property
+    def parents(self):
+        """ Set of parent nodes. """
+        return self._parents
+
+    @parents.setter
+    def parents(self, nodes: set):
+        EdgeSet.version += 1
+        self._parents = nodes if isinstance(nodes, EdgeSet) else EdgeSet(nodes)
+
     def debug_str(self):
         """ Return extended string representation for debugging. """
         children_str = str([n.name for n in self.children])
@@ -38,6 +85,8 @@ class OpNode(Node):
     """
     Base class for nodes that store relational operations
     """
+    __slots__ = ("out_rel", "is_local", "is_mpc")
+
     def __init__(self, name: str, out_rel: rel.Relation):
         """ Initialize OpNode object. """
         super(OpNode, self).__init__(name)
@@ -86,6 +135,28 @@ class OpNode(Node):
         """ Overridden in subclasses. """
         return
 
+    def clone(self):
+        """
+        Return a copy of this node that is not linked to any other node. The output
+        relation is cloned and the remaining operator metadata is copied shallowly,
+        so the cost does not depend on the size of the DAG. Inserting the copy with
+        insert_between rebinds its op-specific columns to its new parent.
+        """
+        cls = type(self)
+        clone = cls.__new__(cls)
+        for klass in cls.__mro__:
+            for slot in getattr(klass, "__slots__", ()):
+                if slot in ("_children", "_parents") or not hasattr(self, slot):
+                    continue
+                value = getattr(self, slot)
+                if isinstance(value, (list, set, dict)):
+                    value = copy.copy(value)
+                setattr(clone, slot, value)
+        clone.children = set()
+        clone.parents = set()
+        clone.out_rel = self.out_rel.clone()
+        return clone
+
     def make_orphan(self):
         """ Remove link between this node and it's parent nodes. """
         self.parents = set()
@@ -123,6 +194,8 @@ class OpNode(Node):
 
 class UnaryOpNode(OpNode):
     """ An OpNode with exactly one parent (e.g. - Multiply, Project, etc.). """
+    __slots__ = ("parent",)
+
     def __init__(self, name: str, out_rel: rel.Relation, parent: OpNode):
         """ Initialize UnaryOpNode object. """
         super(UnaryOpNode, self).__init__(name, out_rel)
@@ -130,6 +203,12 @@ class UnaryOpNode(OpNode):
         if self.parent:
             self.parents.add(parent)
 
+    def clone(self):
+        """ Return a copy of this node without a parent. """
+        clone = super(UnaryOpNode, self).clone()
+        clone.parent = None
+        return clone
+
     def get_in_rel(self):
         """ Returns out_rel of parent node. """
         return self.parent.out_rel
@@ -160,6 +239,8 @@ class UnaryOpNode(OpNode):
 
 class BinaryOpNode(OpNode):
     """ An OpNode with exactly two parents (e.g. - Join). """
+    __slots__ = ("left_parent", "right_parent")
+
     def __init__(self, name: str, out_rel: rel.Relation, left_parent: OpNode, right_parent: OpNode):
 
         super(BinaryOpNode, self).__init__(name, out_rel)
@@ -170,6 +251,13 @@ class BinaryOpNode(OpNode):
         if self.right_parent:
             self.parents.add(right_parent)
 
+    def clone(self):
+        """ Return a copy of this node without parents. """
+        clone = super(BinaryOpNode, self).clone()
+        clone.left_parent = None
+        clone.right_parent = None
+        return clone
+
     def get_left_in_rel(self):
         """ Returns left input relation to this node. """
         return self.left_parent.out_rel
@@ -190,16 +278,17 @@ class BinaryOpNode(OpNode):
 
     def make_orphan(self):
         """ Removes link between this node and both of it's parents. """
-        super(UnaryOpNode, self).make_orphan()
+        super(BinaryOpNode, self).make_orphan()
         self.left_parent = None
         self.right_parent = None
 
     def replace_parent(self, old_parent: Node, new_parent: OpNode):
         """ Replace either the left or the right parent of this node. """
         super(BinaryOpNode, self).replace_parent(old_parent, new_parent)
+        # both may be replaced in a self-join
         if self.left_parent == old_parent:
             self.left_parent = new_parent
-        elif self.right_parent == old_parent:
+        if self.right_parent == old_parent:
             self.right_parent = new_parent
 
     def remove_parent(self, parent: OpNode):
@@ -213,6 +302,8 @@ class BinaryOpNode(OpNode):
 
 class NaryOpNode(OpNode):
     """ An OpNode with arbitrarily many parents (e.g. - Concat)."""
+    __slots__ = ()
+
     def __init__(self, name: str, out_rel: rel.Relation, parents: set):
         """ Initialize NaryOpNode object. """
         super(NaryOpNode, self).__init__(name, out_rel)
@@ -239,11 +330,15 @@ class NaryOpNode(OpNode):
 
 class Create(UnaryOpNode):
     """ Object for creating datasets in a DAG. """
-    def __init__(self, out_rel: rel.Relation):
+    __slots__ = ("stats",)
+
+    def __init__(self, out_rel: rel.Relation, stats=None):
         """ Initialize Create object. """
         super(Create, self).__init__("create", out_rel, None)
         # Input can be done by parties locally
         self.is_local = True
+        # stats.RelationStats of the input data, if known
+        self.stats = stats
 
     def requires_mpc(self):
         """ Create operations are always done locally and will never require MPC. """
@@ -252,6 +347,8 @@ class Create(UnaryOpNode):
 
 class Store(UnaryOpNode):
     """ Object for storing data returned by a workflow. """
+    __slots__ = ()
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode):
         """ Initialize Store object. """
         super(Store, self).__init__("store", out_rel, parent)
@@ -266,6 +363,8 @@ class Store(UnaryOpNode):
 
 class Persist(UnaryOpNode):
     """ ??? """
+    __slots__ = ()
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode):
 
         super(Persist, self).__init__("persist", out_rel, parent)
@@ -277,6 +376,8 @@ class Persist(UnaryOpNode):
 
 class Open(UnaryOpNode):
     """ Object for opening results of a computation to participating parties. """
+    __slots__ = ()
+
     def __init__(self, out_rel: rel.Relation, parent: [OpNode, None]):
         """ Initialize Open object. """
         super(Open, self).__init__("open", out_rel, parent)
@@ -289,6 +390,8 @@ class Open(UnaryOpNode):
 
 class Close(UnaryOpNode):
     """ Object for marking the boundary between local and MPC operations. """
+    __slots__ = ()
+
     def __init__(self, out_rel: rel.Relation, parent: [OpNode, None]):
         """ Initialize Close object. """
         super(Close, self).__init__("close", out_rel, parent)
@@ -301,6 +404,8 @@ class Close(UnaryOpNode):
 
 class Send(UnaryOpNode):
     """ Object for Sending secret shares to another party. """
+    __slots__ = ()
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode):
         """ Initialize Send object."""
         super(Send, self).__init__("send", out_rel, parent)
@@ -312,6 +417,8 @@ class Send(UnaryOpNode):
 
 class Concat(NaryOpNode):
     """ Object to store the concatenation of several relations' datasets. """
+    __slots__ = ("ordered",)
+
     def __init__(self, out_rel: rel.Relation, parents: list):
         """ Initialize a Concat object. """
         parent_set = set(parents)
@@ -320,6 +427,12 @@ class Concat(NaryOpNode):
         super(Concat, self).__init__("concat", out_rel, parent_set)
         self.ordered = parents
 
+    def clone(self):
+        """ Return a copy of this node without parents. """
+        clone = super(Concat, self).clone()
+        clone.ordered = []
+        return clone
+
     def is_reversible(self):
         """ No data is changed during a Concat operation."""
         return True
@@ -342,6 +455,8 @@ class Concat(NaryOpNode):
 
 class Aggregate(UnaryOpNode):
     """ Object to store an aggregation over data. """
+    __slots__ = ("group_cols", "agg_col", "aggregator")
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode,
                  group_cols: list, agg_col: rel.Column, aggregator: str):
         """ Initialize Aggregate object. """
@@ -363,6 +478,8 @@ class Aggregate(UnaryOpNode):
 
 class IndexAggregate(Aggregate):
     """ Object to store an indexed aggregation operation. """
+    __slots__ = ("eq_flag_op", "sorted_keys_op")
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, group_cols: list,
                  agg_col: rel.Column, aggregator: str, eq_flag_op: OpNode, sorted_keys_op: OpNode):
         """ Initialize IndexAggregate object. """
@@ -380,6 +497,8 @@ class IndexAggregate(Aggregate):
 
 class Project(UnaryOpNode):
     """ Object to store a project operation. """
+    __slots__ = ("selected_cols",)
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, selected_cols: list):
         """ Initialize project object. """
         super(Project, self).__init__("project", out_rel, parent)
@@ -400,12 +519,14 @@ class Project(UnaryOpNode):
 
         """
         temp_cols = self.get_in_rel().columns
-        self.selected_cols = [temp_cols[col.idx] for col in temp_cols]
+        self.selected_cols = [temp_cols[col.idx] for col in self.selected_cols]
 
 
 class Index(UnaryOpNode):
     """ Add a column with row indeces to relation. """
 
+    __slots__ = ("idx_col_name",)
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, idx_col_name: str):
         """ Initialize Index object"""
         super(Index, self).__init__("index", out_rel, parent)
@@ -421,6 +542,8 @@ class Index(UnaryOpNode):
 class Shuffle(UnaryOpNode):
     """ Randomly permute rows of relation. """
 
+    __slots__ = ()
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode):
         """ Initialize Shuffle object. """
         super(Shuffle, self).__init__("shuffle", out_rel, parent)
@@ -433,6 +556,8 @@ class Shuffle(UnaryOpNode):
 
 class Multiply(UnaryOpNode):
     """ Object to store multiplication between columns. """
+    __slots__ = ("operands", "target_col")
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, target_col: rel.Column, operands: list):
         """ Initialize Multiply object. """
         super(Multiply, self).__init__("multiply", out_rel, parent)
@@ -457,6 +582,8 @@ class Multiply(UnaryOpNode):
 
 class SortBy(UnaryOpNode):
     """ Object to store the sorting of a relation over a particular column. """
+    __slots__ = ("sort_by_col",)
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, sort_by_col: rel.Column):
         """ Initialize SortBy object. """
         super(SortBy, self).__init__("sortBy", out_rel, parent)
@@ -474,6 +601,8 @@ class CompNeighs(UnaryOpNode):
     Object that stores equality comparison between neighboring row values in a relation.
     Used in Hybrid Aggregation to allow parties to obliviously aggregate during MPC.
     """
+    __slots__ = ("comp_col",)
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, comp_col: rel.Column):
         """ Initialize CompNeighs object. """
         super(CompNeighs, self).__init__("compNeighs", out_rel, parent)
@@ -491,6 +620,8 @@ class Distinct(UnaryOpNode):
     Object that stores removing duplicate rows from a relation,
     with respect to a set of selected columns.
     """
+    __slots__ = ("selected_cols",)
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, selected_cols: list):
         """ Initialize Distinct object. """
         super(Distinct, self).__init__("distinct", out_rel, parent)
@@ -506,6 +637,8 @@ class Distinct(UnaryOpNode):
 
 class Divide(UnaryOpNode):
 
+    __slots__ = ("operands", "target_col")
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, target_col: rel.Column, operands: list):
 
         super(Divide, self).__init__("divide", out_rel, parent)
@@ -527,6 +660,8 @@ class Divide(UnaryOpNode):
 
 class Filter(UnaryOpNode):
 
+    __slots__ = ("operator", "filter_expr", "target_col")
+
     def __init__(self, out_rel: rel.Relation, parent: OpNode, target_col: rel.Column, operator: str, expr: str):
 
         super(Filter, self).__init__("filter", out_rel, parent)
@@ -539,9 +674,17 @@ class Filter(UnaryOpNode):
 
         return False
 
+    def update_op_specific_cols(self):
+        """
+        Updates this node's target_col with the column of it's input relation with matching idx.
+        """
+        self.target_col = self.get_in_rel().columns[self.target_col.idx]
+
 
 class Join(BinaryOpNode):
 
+    __slots__ = ("left_join_cols", "right_join_cols")
+
     def __init__(self, out_rel: rel.Relation, left_parent: OpNode,
                  right_parent: OpNode, left_join_cols: list, right_join_cols: list):
 
@@ -560,6 +703,8 @@ class Join(BinaryOpNode):
 class IndexJoin(Join):
     """TODO"""
 
+    __slots__ = ("index_rel",)
+
     def __init__(self, out_rel: rel.Relation, left_parent: OpNode, right_parent: OpNode,
                  left_join_cols: list, right_join_cols: list, index_op: OpNode):
 
@@ -588,6 +733,8 @@ class RevealJoin(Join):
     provided that their key column a key in P's input.
     """
 
+    __slots__ = ("revealed_in_rel", "recepient")
+
     # TODO: (ben) recipient == pid (int) ?
     def __init__(self, out_rel: rel.Relation, left_parent: OpNode, right_parent: OpNode,
                  left_join_cols: list, right_join_cols: list, revealed_in_rel: rel.Relation, recepient):
@@ -622,6 +769,8 @@ class HybridJoin(Join):
     in both key columns
     """
 
+    __slots__ = ("trusted_party",)
+
     # TODO: (ben) trusted_party == pid (int) ?
     def __init__(self, out_rel: rel.Relation, left_parent: OpNode, right_parent: OpNode,
                  left_join_cols: list, right_join_cols: list, trusted_party):
@@ -647,15 +796,21 @@ class Dag:
     def __init__(self, roots: set):
 
         self.roots = roots
+        # (edge version, rename count, roots, deterministic flag, order) of the last top_sort
+        self._top_sort_cache = None
 
     # TODO: (ben) type of visitor?
     def _dfs_visit(self, node: OpNode, visitor, visited: set):
 
-        visitor(node)
-        visited.add(node)
-        for child in node.children:
-            if child not in visited:
-                self._dfs_visit(child, visitor, visited)
+        # iterative to support arbitrarily deep DAGs
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node in visited:
+                continue
+            visitor(node)
+            visited.add(node)
+            stack.extend(child for child in node.children if child not in visited)
 
     def dfs_visit(self, visitor):
 
@@ -674,52 +829,66 @@ class Dag:
 
         return self.dfs_visit(lambda node: node)
 
-    # Note: not optimized at all but we're dealing with very small
-    # graphs so performance shouldn't be a problem
-    # Side-effects on all inputs other than node
-    def _top_sort_visit(self, node: OpNode, marked: set, temp_marked: set,
-                        unmarked, ordered: list, deterministic: bool = True):
-
-        if node in temp_marked:
-            raise Exception("Not a Dag!")
-
-        if node not in marked:
-            if node in unmarked:
-                unmarked.remove(node)
-            temp_marked.add(node)
-
-            children = node.children
-            if deterministic:
-                children = sorted(list(children), key=lambda x: x.out_rel.name)
-            for other_node in children:
-                self._top_sort_visit(
-                    other_node, marked, temp_marked, unmarked, ordered)
+    def _top_sort_visit(self, node: OpNode, marked: set, ordered: list, deterministic: bool = True):
+        """
+        Appends node and all its unmarked descendants to ordered in DFS post-order.
+        """
 
-            marked.add(node)
+        def _children(other: OpNode):
+            children = [child for child in other.children if child not in marked]
             if deterministic:
-                unmarked.append(node)
+                children.sort(key=lambda x: x.out_rel.name)
+            return iter(children)
+
+        # nodes on the current DFS path
+        temp_marked = {node}
+        stack = [(node, _children(node))]
+        while stack:
+            current, children = stack[-1]
+            for child in children:
+                if child in temp_marked:
+                    raise Exception("Not a Dag!")
+                if child not in marked:
+                    temp_marked.add(child)
+                    stack.append((child, _children(child)))
+                    break
             else:
-                unmarked.add(node)
-            temp_marked.remove(node)
-            ordered.insert(0, node)
+                stack.pop()
+                temp_marked.remove(current)
+                marked.add(current)
+                ordered.append(current)
 
     # TODO: the deterministic flag is a hack, come up with something more elegant
     def top_sort(self, deterministic: bool = True):
+        """
+        Returns nodes in topological order. With deterministic set, DFS starts
+        from nodes in descending order of relation name and visits children in
+        ascending order. The order is cached until a node's edges, the roots or
+        a relation name change.
+        """
 
-        unmarked = self.get_all_nodes()
+        roots = frozenset(self.roots)
+        cache = self._top_sort_cache
+        if cache is not None:
+            version, renames, cached_roots, cached_deterministic, ordered = cache
+            if version == EdgeSet.version and renames == rel.Relation.renames \
+                    and cached_roots == roots and cached_deterministic == deterministic:
+                return list(ordered)
 
+        unmarked = list(self.get_all_nodes())
         if deterministic:
-            unmarked = sorted(list(unmarked), key=lambda x: x.out_rel.name)
+            unmarked.sort(key=lambda x: x.out_rel.name)
         marked = set()
-        temp_marked = set()
         ordered = []
 
-        while unmarked:
+        for node in reversed(unmarked):
+            if node not in marked:
+                self._top_sort_visit(node, marked, ordered, deterministic)
+        ordered.reverse()
 
-            node = unmarked.pop()
-            self._top_sort_visit(node, marked, temp_marked, unmarked, ordered)
+        self._top_sort_cache = (EdgeSet.version, rel.Relation.renames, roots, deterministic, ordered)
 
-        return ordered
+        return list(ordered)
 
 
 class OpDag(Dag):
@@ -752,6 +921,22 @@ def remove_between(parent: OpNode, child: OpNode, other: OpNode):
     other.children = set()
 
 
+def remove_between_children(parent: OpNode, other: OpNode):
+
+    assert len(other.parents) < 2
+    # only dealing with unary nodes for now
+    assert isinstance(other, UnaryOpNode)
+
+    parent.children.remove(other)
+    for child in copy.copy(other.children):
+        child.replace_parent(other, parent)
+        child.update_op_specific_cols()
+        parent.children.add(child)
+
+    other.make_orphan()
+    other.children = set()
+
+
 def insert_between_children(parent: OpNode, other: OpNode):
 
     assert not other.children
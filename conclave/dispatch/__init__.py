@@ -1,28 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 import conclave.job
+from conclave.config import PythonConfig
 from . import sharemind, spark, python
 
+# framework names used for per-framework concurrency limits
+FRAMEWORKS = {
+    conclave.job.SharemindJob: "sharemind",
+    conclave.job.SparkJob: "spark",
+    conclave.job.PythonJob: "python"
+}
+
+
+def _concurrency_limits(conclave_config, py_config: PythonConfig):
+    """
+    Returns the maximum number of concurrently running jobs for each job class.
+    """
+
+    limits = {}
+    for job_type, framework in FRAMEWORKS.items():
+        limits[job_type] = max(1, conclave_config.max_concurrent_jobs.get(framework, 1))
+
+    # sharemind jobs share the networked peer's event loop and must start in
+    # the same order at all parties, so they always run one at a time
+    limits[conclave.job.SharemindJob] = 1
+    # in-process python jobs share the interpreter's __main__ module
+    if py_config.dispatch_mode == "in_process":
+        limits[conclave.job.PythonJob] = 1
+    elif py_config.dispatch_mode == "pool":
+        limits[conclave.job.PythonJob] = min(limits[conclave.job.PythonJob], py_config.num_workers)
+
+    return limits
+
+
+def _input_deps(job, idx: int, job_queue: list):
+    """
+    Returns names of the jobs that produce job's inputs.
+    """
+
+    if job.deps is None:
+        return [other.name for other in job_queue[:idx]]
+    return list(job.deps)
+
+
+def _is_ready(job, idx: int, job_queue: list, done: set):
+    """
+    Returns True if all jobs that job depends on are done.
+    """
+
+    deps = _input_deps(job, idx, job_queue)
+    # sharemind jobs run in job queue order
+    if isinstance(job, conclave.job.SharemindJob):
+        deps += [other.name for other in job_queue[:idx] if isinstance(other, conclave.job.SharemindJob)]
+
+    return all(dep in done for dep in deps)
+
+
+def _run_job(dispatcher, job):
+    try:
+        # look up dispatcher and dispatch
+        dispatcher.dispatch(job)
+    except Exception as e:
+        print(e)
+
+
+def _run_jobs(dispatchers: dict, limits: dict, job_queue: list):
+    """
+    Runs the jobs in job queue on the dispatchers for their job classes, launching
+    each job as soon as the jobs it depends on are done and as long as fewer than
+    limits[job class] jobs of its class are running.
+    """
+
+    pending = list(enumerate(job_queue))
+    done = set()
+    running = {}
+    num_running = {job_type: 0 for job_type in limits}
+
+    with ThreadPoolExecutor(max_workers=sum(limits.values())) as executor:
+        while pending or running:
+            # launch ready jobs, rescanning after skipped jobs since they unblock others
+            launched = True
+            while launched:
+                launched = False
+                for idx, job in list(pending):
+                    job_type = type(job)
+                    # sharemind imports only wait for the jobs producing the inputs
+                    if job_type is conclave.job.SharemindJob and not job.skip and dispatchers[job_type] \
+                            and all(dep in done for dep in _input_deps(job, idx, job_queue)):
+                        dispatchers[job_type].prepare(job)
+                    if not _is_ready(job, idx, job_queue, done):
+                        continue
+                    if job.skip:
+                        print("Skipping other party's job: ", job)
+                        pending.remove((idx, job))
+                        done.add(job.name)
+                        launched = True
+                    elif num_running.get(job_type, 0) < limits.get(job_type, 1):
+                        pending.remove((idx, job))
+                        future = executor.submit(_run_job, dispatchers.get(job_type), job)
+                        running[future] = job
+                        num_running[job_type] = num_running.get(job_type, 0) + 1
+
+            if not running:
+                if pending:
+                    raise Exception("Jobs {} depend on jobs that never run.".format(
+                        [job.name for (_, job) in pending]))
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                num_running[type(job)] -= 1
+                done.add(job.name)
+
 
 def dispatch_all(conclave_config, networked_peer, job_queue: list):
     """
-    Dispatches jobs in job queue.
+    Dispatches jobs in job queue. A job is launched as soon as the jobs it depends
+    on are done, with at most conclave_config.max_concurrent_jobs running jobs per
+    framework. Sharemind jobs start importing their inputs as soon as these exist,
+    while earlier Sharemind jobs may still be running.
     """
 
+    py_config = conclave_config.system_configs.get("python", PythonConfig())
+
     # create a lookup from job class to instantiated dispatcher
     dispatchers = {
         conclave.job.SharemindJob: sharemind.SharemindDispatcher(networked_peer) if networked_peer else None,
         conclave.job.SparkJob: spark.SparkDispatcher(
             conclave_config.system_configs[
                 "spark"].spark_master_url) if "spark" in conclave_config.system_configs else None,
-        conclave.job.PythonJob: python.PythonDispatcher()
+        conclave.job.PythonJob: python.PythonDispatcher(py_config.dispatch_mode, py_config.num_workers)
     }
+    # lets python jobs drop relations from memory once no later job reads them
+    dispatchers[conclave.job.PythonJob].plan([
+        (job, _input_deps(job, idx, job_queue)) for idx, job in enumerate(job_queue)
+        if isinstance(job, conclave.job.PythonJob) and not job.skip
+    ])
+    _run_jobs(dispatchers, _concurrency_limits(conclave_config, py_config), job_queue)
 
-    # dispatch each job
-    for job in job_queue:
-        if not job.skip:
-            try:
-                # look up dispatcher and dispatch
-                dispatchers[type(job)].dispatch(job)
-            except Exception as e:
-                print(e)
-        else:
-            print("Skipping other party's job: ", job)
+    dispatchers[conclave.job.PythonJob].shutdown()
+    if dispatchers[conclave.job.SharemindJob]:
+        dispatchers[conclave.job.SharemindJob].shutdown()
@@ -1,9 +1,156 @@
+import runpy
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from subprocess import call
 
+# relations that the jobs run by a pool worker have read or written,
+# see REL_CACHE in the job templates
+_worker_rel_cache = {}
+
+
+class _JobRelCache:
+    """ View of a relation cache that records which relations a job stores in it. """
+
+    def __init__(self, rel_cache: dict):
+
+        self.rel_cache = rel_cache
+        self.stored = set()
+
+    def __contains__(self, key):
+
+        return key in self.rel_cache
+
+    def __getitem__(self, key):
+
+        return self.rel_cache[key]
+
+    def __setitem__(self, key, value):
+
+        self.rel_cache[key] = value
+        self.stored.add(key)
+
+    def get(self, key, default=None):
+
+        return self.rel_cache.get(key, default)
+
+
+def run_workflow(path: str, rel_cache: [dict, None] = None):
+    """
+    Run a generated Python job in the current process. Returns the keys of the
+    relations the job stored in the relation cache.
+    """
+
+    rel_cache = rel_cache if rel_cache is not None else _worker_rel_cache
+    job_cache = _JobRelCache(rel_cache)
+    runpy.run_path(path, init_globals={"REL_CACHE": job_cache}, run_name="__main__")
+    return list(job_cache.stored)
+
+
+def evict_rels(keys: list, rel_cache: [dict, None] = None):
+    """ Drop relations from the relation cache of the current process. """
+
+    rel_cache = rel_cache if rel_cache is not None else _worker_rel_cache
+    for key in keys:
+        rel_cache.pop(key, None)
+
 
 class PythonDispatcher:
     """ Dispatches Python jobs. """
 
+    def __init__(self, mode: str = "process", num_workers: int = 1):
+        """
+        Initialize PythonDispatcher object. Jobs are either run in a fresh
+        python3 process each ("process"), in the dispatching process
+        ("in_process") or in a pool of worker processes that is kept alive
+        across jobs ("pool"). In the latter two modes relations stay in memory
+        for later jobs run by the same process, see plan. A pool sends each job to the
+        worker that ran the jobs producing most of its inputs, so that these
+        are read from memory.
+        """
+
+        if mode not in ["process", "in_process", "pool"]:
+            raise Exception("Unknown Python dispatch mode: {}".format(mode))
+        self.mode = mode
+        self.num_workers = num_workers
+        # single-process executors, one per pool worker
+        self.workers = []
+        # index of the worker that ran each job, by job name
+        self.worker_of = {}
+        # number of jobs queued at and ever sent to each worker
+        self.queued = []
+        self.assigned = []
+        self.lock = threading.Lock()
+        # jobs run as __main__, which runpy swaps out while a job runs, so
+        # jobs in the dispatching process run one at a time
+        self.main_lock = threading.Lock()
+        # relations shared between jobs run in the dispatching process
+        self.rel_cache = {}
+        # number of planned jobs that have yet to read each job's relations,
+        # and the jobs whose relations each planned job reads, by job name
+        self.num_readers = {}
+        self.inputs_of = {}
+        # (worker index or None, cache keys) of the relations each job stored
+        self.stored = {}
+
+    def plan(self, jobs: list):
+        """
+        Announces the Python jobs that will be dispatched, as (job, names of
+        the jobs producing its inputs) pairs. The relations a planned job
+        stores in memory are dropped once all planned jobs that read them
+        have run. They can still be read from their files afterwards.
+        """
+
+        with self.lock:
+            for job, inputs in jobs:
+                self.num_readers.setdefault(job.name, 0)
+                self.inputs_of[job.name] = list(inputs)
+                for name in inputs:
+                    self.num_readers[name] = self.num_readers.get(name, 0) + 1
+
+    def _release(self, name: str):
+        """ Drops the relations that job name stored. Called with lock held. """
+
+        idx, keys = self.stored.pop(name, (None, []))
+        if not keys:
+            return
+        if idx is None:
+            evict_rels(keys, self.rel_cache)
+        else:
+            self.workers[idx].submit(evict_rels, keys)
+
+    def _job_done(self, job, idx: [int, None], keys: list):
+        """ Records the relations job stored and drops those no other job reads. """
+
+        with self.lock:
+            self.stored[job.name] = (idx, keys)
+            if self.num_readers.get(job.name) == 0:
+                self._release(job.name)
+            for name in self.inputs_of.pop(job.name, []):
+                self.num_readers[name] -= 1
+                if self.num_readers[name] == 0:
+                    self._release(name)
+
+    def _pick_worker(self, job):
+        """
+        Returns index of the worker that holds most of job's input relations,
+        or if none does, of the least busy worker, and queues job there.
+        """
+
+        with self.lock:
+            if not self.workers:
+                self.workers = [ProcessPoolExecutor(max_workers=1) for _ in range(self.num_workers)]
+                self.queued = [0] * self.num_workers
+                self.assigned = [0] * self.num_workers
+            holding = [self.worker_of[dep] for dep in job.deps or [] if dep in self.worker_of]
+            if holding:
+                idx = max(sorted(set(holding)), key=holding.count)
+            else:
+                idx = min(range(self.num_workers), key=lambda i: (self.queued[i], self.assigned[i]))
+            self.worker_of[job.name] = idx
+            self.queued[idx] += 1
+            self.assigned[idx] += 1
+            return idx
+
     def dispatch(self, job):
 
         cmd = "{}/workflow.py".format(job.code_dir)
@@ -12,6 +159,31 @@ class PythonDispatcher:
               .format(job.name, job.code_dir))
 
         try:
-            call(["python3", cmd])
+            if self.mode == "process":
+                call(["python3", cmd])
+            elif self.mode == "in_process":
+                with self.main_lock:
+                    keys = run_workflow(cmd, self.rel_cache)
+                self._job_done(job, None, keys)
+            else:
+                idx = self._pick_worker(job)
+                try:
+                    keys = self.workers[idx].submit(run_workflow, cmd).result()
+                finally:
+                    with self.lock:
+                        self.queued[idx] -= 1
+                self._job_done(job, idx, keys)
         except Exception as e:
             print(e)
+
+    def shutdown(self):
+        """ Stop the worker pool, if any, and drop relations kept in memory. """
+
+        self.rel_cache = {}
+        for worker in self.workers:
+            worker.shutdown()
+        self.workers = []
+        self.worker_of = {}
+        self.num_readers = {}
+        self.inputs_of = {}
+        self.stored = {}
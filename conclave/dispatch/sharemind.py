@@ -1,23 +1,64 @@
 import asyncio
+import functools
 import re
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import call, Popen, PIPE
 
 
+def _import_task(job, rel_name: str):
+    """ Name of the task of importing relation rel_name for job. """
+
+    return "{}.{}.input".format(job.name, rel_name)
+
+
 class SharemindDispatcher:
-    """ Dispatches sharemind jobs. """
+    """
+    Dispatches sharemind jobs. Importing a job's input relations is separate
+    from running it, so that the imports for the next job can overlap with the
+    computation of the current one.
+    """
 
-    def __init__(self, peer):
+    def __init__(self, peer, max_parallel_imports: int = 4):
 
         self.peer = peer
         self.loop = peer.loop
-        self.to_wait_on = {}
-        self.early = set()
-
-    def _input_data(self, job):
-        """ Calls input.sh script to load input data. """
-
-        cmd = "{}/input.sh".format(
-            job.code_dir
+        # futures for tasks completed by parties, by (pid, task name). Parties can
+        # report tasks before anyone waits for them, even tasks of later jobs.
+        self.tasks = {}
+        # names of the jobs whose imports have been started
+        self.prepared = set()
+        self.import_pool = ThreadPoolExecutor(max_workers=max_parallel_imports)
+
+    def _task(self, pid: int, task_name: str):
+        """ Future that completes when party pid reports task_name done. """
+
+        key = (pid, task_name)
+        if key not in self.tasks:
+            self.tasks[key] = self.loop.create_future()
+        return self.tasks[key]
+
+    def _task_done(self, pid: int, task_name: str):
+
+        future = self._task(pid, task_name)
+        if not future.done():
+            future.set_result(True)
+
+    def _wait_for(self, keys: list):
+        """ Runs the event loop until the tasks for all (pid, task name) keys are done. """
+
+        futures = [self._task(pid, task_name) for pid, task_name in keys]
+        # gather without futures would look up the event loop of the calling
+        # thread, which dispatch threads do not have
+        if futures:
+            self.loop.run_until_complete(asyncio.gather(*futures))
+        for key in keys:
+            self.tasks.pop(key, None)
+
+    def _input_data(self, job, rel_name: str):
+        """ Calls the input script of relation rel_name to load it. """
+
+        cmd = "{}/input_{}.sh".format(
+            job.code_dir, rel_name
         )
         print("Will run data submission: " + cmd)
         try:
@@ -25,6 +66,30 @@ class SharemindDispatcher:
         except Exception:
             print("Failed data input")
 
+    def _report_import(self, job, rel_name: str, future):
+        """ Reports relation rel_name of job as imported to the controller. """
+
+        # runs on an import thread, the event loop may be running on another
+        task_name = _import_task(job, rel_name)
+        if self.peer.pid == job.controller:
+            self.loop.call_soon_threadsafe(self._task_done, self.peer.pid, task_name)
+        else:
+            self.loop.call_soon_threadsafe(self.peer.send_done_msg, job.controller, task_name)
+
+    def prepare(self, job):
+        """
+        Starts importing the relations that this party inputs to job, in parallel
+        and without blocking. The controller is told about each relation as soon as
+        it is imported. Inputs must be available, but other jobs can still run.
+        """
+
+        if job.name in self.prepared:
+            return
+        self.prepared.add(job.name)
+        for rel_name in job.input_rels.get(self.peer.pid, []):
+            future = self.import_pool.submit(self._input_data, job, rel_name)
+            future.add_done_callback(functools.partial(self._report_import, job, rel_name))
+
     def _submit_to_miners(self, job):
         """ Submits Sharemind code to miners. """
 
@@ -50,17 +115,9 @@ class SharemindDispatcher:
     def _dispatch_as_controller(self, job):
         """ Dispatch Sharemind job as controller for computation. """
 
-        # track which participants have completed data submission
-        for input_party in job.input_parties:
-            if input_party != self.peer.pid and input_party not in self.early:
-                self.to_wait_on[input_party] = asyncio.Future()
-
-        # wait until other peers are done submitting
-        futures = self.to_wait_on.values()
-        self.loop.run_until_complete(asyncio.gather(*futures))
-
-        # submit data to miners
-        self._input_data(job)
+        # wait until every input relation has been imported by its party
+        self._wait_for([(pid, _import_task(job, rel_name))
+                        for pid, rel_names in job.input_rels.items() for rel_name in rel_names])
 
         # submit job to miners
         self._submit_to_miners(job)
@@ -75,15 +132,9 @@ class SharemindDispatcher:
     def _regular_dispatch(self, job):
         """ Dispatch Sharemind job not as controler. """
 
-        # submit data to miners
-        self._input_data(job)
-
-        # notify controller that we're done
-        self.peer.send_done_msg(job.controller, job.name + ".input")
-
-        # wait on controller to confirm that the job has finished
-        self.to_wait_on = {job.controller: asyncio.Future()}
-        self.loop.run_until_complete(self.to_wait_on[job.controller])
+        # wait on controller to confirm that the job has finished, the event
+        # loop also sends out the notifications for relations we imported
+        self._wait_for([(job.controller, job.name + ".controller")])
 
     def dispatch(self, job):
         """ Top level dispatch method. """
@@ -91,22 +142,20 @@ class SharemindDispatcher:
         # register self as current dispatcher with peer
         self.peer.register_dispatcher(self)
 
+        # start imports unless they were started ahead of time
+        self.prepare(job)
         if self.peer.pid == job.controller:
             self._dispatch_as_controller(job)
         else:
             self._regular_dispatch(job)
-        # un-register with dispatcher
-        self.peer.dispatcher = None
-        # not waiting on any peers
-        self.to_wait_on = {}
-        self.early = set()
+        self.prepared.discard(job.name)
 
     def receive_msg(self, msg: str):
         """ Receive message from other party in computation. """
 
-        done_peer = msg.pid
-        if done_peer in self.to_wait_on:
-            self.to_wait_on[done_peer].set_result(True)
-        else:
-            self.early.add(done_peer)
-            print("early message", msg)
+        self._task_done(msg.pid, msg.task_name)
+
+    def shutdown(self):
+        """ Wait for running imports and stop the import threads. """
+
+        self.import_pool.shutdown()
@@ -8,17 +8,22 @@ class Job:
         self.code_dir = code_dir
         # set skip to True if dispatching party is not involved in it
         self.skip = False
+        # names of the jobs that produce this job's inputs, None if the job
+        # depends on all jobs before it in the job queue
+        self.deps = None
 
 
 class SharemindJob(Job):
     """ Job subclass for Sharemind jobs. """
 
-    def __init__(self, name: str, code_dir: str, controller: int, input_parties: list):
+    def __init__(self, name: str, code_dir: str, controller: int, input_parties: list, input_rels: dict):
         """ Initialize SharemindJob object. """
 
         super(SharemindJob, self).__init__(name, code_dir)
         self.controller = controller
         self.input_parties = input_parties
+        # names of the relations each input party imports, by pid
+        self.input_rels = input_rels
 
 
 class SparkJob(Job):
@@ -7,20 +7,21 @@ import conclave.dag as saldag
 import conclave.utils as utils
 
 
-def create(rel_name: str, columns: list, stored_with: set):
+def create(rel_name: str, columns: list, stored_with: set, stats=None):
     """
     Define Create relation.
 
     :param rel_name: Name of returned Create node.
     :param columns: List of column objects.
     :param stored_with: Set of input party IDs that own this relation.
+    :param stats: Optional stats.RelationStats of the input data, used for cost estimates.
     :return: Create OpNode.
     """
 
     columns = [rel.Column(rel_name, col_name, idx, type_str, collusion_set)
                for idx, (col_name, type_str, collusion_set) in enumerate(columns)]
     out_rel = rel.Relation(rel_name, columns, stored_with)
-    op = saldag.Create(out_rel)
+    op = saldag.Create(out_rel, stats)
     return op
 
 
@@ -43,22 +44,21 @@ def aggregate(input_op_node: saldag.OpNode, output_name: str, group_col_names: l
     in_rel = input_op_node.out_rel
 
     # Get relevant columns and reset their collusion sets
-    in_cols = in_rel.columns
-    group_cols = [utils.find(in_cols, group_col_name) for group_col_name in group_col_names]
+    group_cols = [in_rel.find_column(group_col_name) for group_col_name in group_col_names]
     for group_col in group_cols:
-        group_col.coll_sets = set()
-    over_col = utils.find(in_cols, over_col_name)
-    over_col.coll_sets = set()
+        group_col.coll_sets = utils.CollusionRecord()
+    over_col = in_rel.find_column(over_col_name)
+    over_col.coll_sets = utils.CollusionRecord()
 
     # Create output relation. Default column order is
     # key column first followed by column that will be
     # aggregated. Note that we want copies as these are
     # copies on the output relation and changes to them
     # shouldn't affect the original columns
-    agg_out_col = copy.deepcopy(over_col)
+    agg_out_col = over_col.clone()
     agg_out_col.name = agg_out_col_name
-    out_rel_cols = [copy.deepcopy(group_col) for group_col in group_cols]
-    out_rel_cols.append(copy.deepcopy(agg_out_col))
+    out_rel_cols = [group_col.clone() for group_col in group_cols]
+    out_rel_cols.append(agg_out_col.clone())
     out_rel = rel.Relation(output_name, out_rel_cols, copy.copy(in_rel.stored_with))
     out_rel.update_columns()
 
@@ -116,12 +116,12 @@ def sort_by(input_op_node: saldag.OpNode, output_name: str, sort_by_col_name: st
     in_rel = input_op_node.out_rel
 
     # Get relevant columns and create copies
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
-    sort_by_col = utils.find(in_rel.columns, sort_by_col_name)
+    sort_by_col = in_rel.find_column(sort_by_col_name)
 
     for col in out_rel_cols:
-        col.coll_sets = set()
+        col.coll_sets = utils.CollusionRecord()
 
     # Create output relation
     out_rel = rel.Relation(output_name, out_rel_cols, copy.copy(in_rel.stored_with))
@@ -150,11 +150,11 @@ def project(input_op_node: saldag.OpNode, output_name: str, selected_col_names:
     in_rel = input_op_node.out_rel
 
     # Find all columns by name
-    selected_cols = [utils.find(in_rel.columns, col_name) for col_name in selected_col_names]
+    selected_cols = [in_rel.find_column(col_name) for col_name in selected_col_names]
 
-    out_rel_cols = copy.deepcopy(selected_cols)
+    out_rel_cols = [col.clone() for col in selected_cols]
     for col in out_rel_cols:
-        col.coll_sets = set()
+        col.coll_sets = utils.CollusionRecord()
 
     # Create output relation
     out_rel = rel.Relation(output_name, out_rel_cols, copy.copy(in_rel.stored_with))
@@ -183,11 +183,11 @@ def distinct(input_op_node: saldag.OpNode, output_name: str, selected_col_names:
     in_rel = input_op_node.out_rel
 
     # Find all columns by name
-    selected_cols = [utils.find(in_rel.columns, col_name) for col_name in selected_col_names]
+    selected_cols = [in_rel.find_column(col_name) for col_name in selected_col_names]
 
-    out_rel_cols = copy.deepcopy(selected_cols)
+    out_rel_cols = [col.clone() for col in selected_cols]
     for col in out_rel_cols:
-        col.coll_sets = set()
+        col.coll_sets = utils.CollusionRecord()
 
     # Create output relation
     out_rel = rel.Relation(output_name, out_rel_cols, copy.copy(in_rel.stored_with))
@@ -222,19 +222,19 @@ def divide(input_op_node: saldag.OpNode, output_name: str, target_col_name: str,
     in_rel = input_op_node.out_rel
 
     # Get relevant columns and create copies
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
     # Replace all column names with corresponding columns.
-    operands = [utils.find(in_rel.columns, op) if isinstance(
+    operands = [in_rel.find_column(op) if isinstance(
         op, str) else op for op in operands]
     for operand in operands:
         if hasattr(operand, "coll_sets"):
-            operand.coll_sets = set()
+            operand.coll_sets = utils.CollusionRecord()
 
     # if target_col already exists, it will be at the 0th index of operands
     if target_col_name == operands[0].name:
-        target_column = utils.find(in_rel.columns, target_col_name)
-        target_column.coll_sets = set()
+        target_column = in_rel.find_column(target_col_name)
+        target_column.coll_sets = utils.CollusionRecord()
     else:
         # TODO: figure out new column's coll_sets
         target_column = rel.Column(
@@ -271,11 +271,11 @@ def filter(input_op_node: saldag.OpNode, output_name: str, filter_col_name: str,
     in_rel = input_op_node.out_rel
 
     # Get relevant columns and create copies
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
     # Get index of filter column
-    filter_col = utils.find(in_rel.columns, filter_col_name)
-    filter_col.coll_sets = set()
+    filter_col = in_rel.find_column(filter_col_name)
+    filter_col.coll_sets = utils.CollusionRecord()
 
     # Create output relation
     out_rel = rel.Relation(output_name, out_rel_cols, copy.copy(in_rel.stored_with))
@@ -310,19 +310,19 @@ def multiply(input_op_node: saldag.OpNode, output_name: str, target_col_name: st
     in_rel = input_op_node.out_rel
 
     # Get relevant columns and create copies
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
     # Replace all column names with corresponding columns.
-    operands = [utils.find(in_rel.columns, op) if isinstance(
+    operands = [in_rel.find_column(op) if isinstance(
         op, str) else op for op in operands]
     for operand in operands:
         if hasattr(operand, "coll_sets"):
-            operand.coll_sets = set()
+            operand.coll_sets = utils.CollusionRecord()
 
     # if target_col already exists, it will be at the 0th index of operands
     if target_col_name == operands[0].name:
-        target_column = utils.find(in_rel.columns, target_col_name)
-        target_column.coll_sets = set()
+        target_column = in_rel.find_column(target_col_name)
+        target_column.coll_sets = utils.CollusionRecord()
     else:
         # TODO: figure out new column's coll_sets
         target_column = rel.Column(
@@ -381,13 +381,9 @@ def join(left_input_node: saldag.OpNode, right_input_node: saldag.OpNode, output
     left_in_rel = left_input_node.out_rel
     right_in_rel = right_input_node.out_rel
 
-    # Get columns from both relations
-    left_cols = left_in_rel.columns
-    right_cols = right_in_rel.columns
-
     # Get columns we will join on
-    left_join_cols = [utils.find(left_cols, left_col_name) for left_col_name in left_col_names]
-    right_join_cols = [utils.find(right_cols, right_col_name) for right_col_name in right_col_names]
+    left_join_cols = [left_in_rel.find_column(left_col_name) for left_col_name in left_col_names]
+    right_join_cols = [right_in_rel.find_column(right_col_name) for right_col_name in right_col_names]
 
     # # Get the key columns' merged collusion set
     # keyCollusionSet = utils.mergeCollusionSets(
@@ -464,14 +460,14 @@ def concat(input_op_nodes: list, output_name: str, column_names: [list, None] =
         assert(len(column_names) == num_cols)
 
     # Copy over columns from existing relation
-    out_rel_cols = copy.deepcopy(in_rels[0].columns)
+    out_rel_cols = [col.clone() for col in in_rels[0].columns]
     for (i, col) in enumerate(out_rel_cols):
         if column_names is not None:
             col.name = column_names[i]
         else:
             # we use the column names from the first input
             pass
-        col.coll_sets = set()
+        col.coll_sets = utils.CollusionRecord()
 
     # The result of the concat will be stored with the union
     # of the parties storing the input relations
@@ -505,7 +501,7 @@ def index(input_op_node: saldag.OpNode, output_name: str, idx_col_name: str = "i
     in_rel = input_op_node.out_rel
 
     # Copy over columns from existing relation
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
     index_col = rel.Column(
         output_name, idx_col_name, len(in_rel.columns), "INTEGER", set())
@@ -534,7 +530,7 @@ def shuffle(input_op_node: saldag.OpNode, output_name: str):
     in_rel = input_op_node.out_rel
 
     # Copy over columns from existing relation
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
     # Create output relation
     out_rel = rel.Relation(output_name, out_rel_cols, copy.copy(in_rel.stored_with))
@@ -577,16 +573,16 @@ def _comp_neighs(input_op_node: saldag.OpNode, output_name: str, comp_col_name:
     in_rel = input_op_node.out_rel
 
     # Get relevant columns and create copies
-    out_rel_cols = copy.deepcopy(in_rel.columns)
+    out_rel_cols = [col.clone() for col in in_rel.columns]
 
-    comp_col = utils.find(in_rel.columns, comp_col_name)
-    comp_col.stored_with = set()
+    comp_col = in_rel.find_column(comp_col_name)
+    comp_col.coll_sets = utils.CollusionRecord()
 
     for col in out_rel_cols:
-        col.coll_sets = set()
+        col.coll_sets = utils.CollusionRecord()
 
     # Create output relation
-    out_rel = rel.Relation(output_name, [copy.deepcopy(comp_col)], copy.copy(in_rel.stored_with))
+    out_rel = rel.Relation(output_name, [comp_col.clone()], copy.copy(in_rel.stored_with))
     out_rel.update_columns()
 
     # Create our operator node
@@ -635,7 +631,7 @@ def _persist(input_op_node: saldag.OpNode, output_name: str):
     :return: Persist OpNode.
     """
 
-    out_rel = copy.deepcopy(input_op_node.out_rel)
+    out_rel = input_op_node.out_rel.clone()
     out_rel.rename(output_name)
     persist_op = saldag.Persist(out_rel, input_op_node)
     input_op_node.children.add(persist_op)
@@ -652,7 +648,7 @@ def _close(input_op_node: saldag.OpNode, output_name: str, target_parties: set):
     :return: Close OpNode.
     """
 
-    out_rel = copy.deepcopy(input_op_node.out_rel)
+    out_rel = input_op_node.out_rel.clone()
     out_rel.stored_with = target_parties
     out_rel.rename(output_name)
     close_op = saldag.Close(out_rel, input_op_node)
@@ -670,7 +666,7 @@ def _open(input_op_node: saldag.OpNode, output_name: str, target_party: int):
     :return: Open OpNode.
     """
 
-    out_rel = copy.deepcopy(input_op_node.out_rel)
+    out_rel = input_op_node.out_rel.clone()
     out_rel.stored_with = set([target_party])
     out_rel.rename(output_name)
     open_op = saldag.Open(out_rel, input_op_node)
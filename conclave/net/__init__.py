@@ -1,6 +1,64 @@
+import array
 import asyncio
 import functools
+import itertools
 import pickle
+import struct
+import sys
+
+# frames are a (frame type, payload length) header followed by the payload
+FRAME_HEADER = struct.Struct("!BI")
+# frame type of a pickled message
+MSG_FRAME = 0x01
+# old format: pickled messages separated by a delimiter
+LEGACY_DELIMITER = b"\n\n\n"
+# first byte of a pickle (PROTO opcode), never used as a frame type
+PICKLE_PROTO = 0x80
+# frame types of the relation data channel: a pickled RelationHeader, one
+# column of a chunk of rows, the end of a relation, and flow control credit
+RELATION_START_FRAME = 0x02
+COLUMN_FRAME = 0x03
+RELATION_END_FRAME = 0x04
+CREDIT_FRAME = 0x05
+# (stream id, column index / number of rows / credit) prefix of data channel payloads
+STREAM_HEADER = struct.Struct("!II")
+# rows per chunk of a relation sent over the data channel
+RELATION_CHUNK_SIZE = 65536
+# chunks a sender may send ahead of the receiver's credit
+RELATION_WINDOW = 8
+
+
+def write_frame(transport, frame_type: int, payload: bytes):
+    """
+    Writes a length-prefixed frame to transport.
+    """
+
+    transport.write(FRAME_HEADER.pack(frame_type, len(payload)))
+    transport.write(payload)
+
+
+def write_msg(transport, msg, legacy_framing: bool = False):
+    """
+    Writes a pickled message to transport, as a frame or followed by the legacy
+    delimiter.
+    """
+
+    payload = pickle.dumps(msg)
+    if legacy_framing:
+        transport.write(payload + LEGACY_DELIMITER)
+    else:
+        write_frame(transport, MSG_FRAME, payload)
+
+
+def encode_column(values):
+    """
+    Encodes integer column values as little-endian 64 bit integers.
+    """
+
+    col = array.array("q", values)
+    if sys.byteorder == "big":
+        col.byteswap()
+    return col.tobytes()
 
 
 class IAMMsg:
@@ -24,6 +82,19 @@ class DoneMsg:
         return "DoneMsg({})".format(self.pid)
 
 
+class RelationHeader:
+    """ Message starting the transfer of a relation over the data channel. """
+
+    def __init__(self, pid: int, stream_id: int, name: str, columns: list):
+        self.pid = pid
+        self.stream_id = stream_id
+        self.name = name
+        self.columns = columns
+
+    def __str__(self):
+        return "RelationHeader({}, {})".format(self.pid, self.name)
+
+
 class FailMsg:
     """ Message signifying that peer failed to complete a task. """
 
@@ -31,6 +102,69 @@ class FailMsg:
     pass
 
 
+class RelationSender:
+    """
+    Sends the rows of a relation as chunks of binary columns. At most
+    RELATION_WINDOW chunks are sent ahead of the receiver's credit, and
+    nothing is sent while the transport's write buffer is full.
+    """
+
+    def __init__(self, stream_id: int, protocol, rows, chunk_size: int):
+
+        self.stream_id = stream_id
+        self.protocol = protocol
+        self.rows = iter(rows)
+        self.chunk_size = chunk_size
+        self.credit = RELATION_WINDOW
+        self.num_rows = 0
+        # completes with the number of rows sent
+        self.done = protocol.peer.loop.create_future()
+
+    def add_credit(self, credit: int):
+
+        self.credit += credit
+        self.pump()
+
+    def pump(self):
+        """ Sends chunks until out of credit, rows, or transport buffer space. """
+
+        transport = self.protocol.transport
+        while not self.done.done() and self.credit > 0 and not self.protocol.paused:
+            chunk = list(itertools.islice(self.rows, self.chunk_size))
+            if not chunk:
+                write_frame(transport, RELATION_END_FRAME, STREAM_HEADER.pack(self.stream_id, self.num_rows))
+                self.done.set_result(self.num_rows)
+                break
+            for idx, col in enumerate(zip(*chunk)):
+                write_frame(transport, COLUMN_FRAME, STREAM_HEADER.pack(self.stream_id, idx) + encode_column(col))
+            self.num_rows += len(chunk)
+            self.credit -= 1
+
+
+class RelationReceiver:
+    """ Collects the columns of a relation received over the data channel. """
+
+    def __init__(self, header: RelationHeader):
+
+        self.header = header
+        self.columns = [array.array("q") for _ in header.columns]
+
+    def add_column(self, idx: int, data: memoryview):
+
+        self.columns[idx].frombytes(data)
+
+    def finish(self, num_rows: int):
+        """ Checks that num_rows rows arrived and returns the column buffers. """
+
+        for col in self.columns:
+            if len(col) != num_rows:
+                raise Exception("Received {} of {} rows of relation {}".format(
+                    len(col), num_rows, self.header.name))
+            if sys.byteorder == "big":
+                col.byteswap()
+        return self.columns
+
+
 class SalmonProtocol(asyncio.Protocol):
     """
     The Salmon network protocol defines what messages salmon
@@ -41,17 +175,54 @@ class SalmonProtocol(asyncio.Protocol):
         """ Initialize SalmonProtocol object. """
 
         self.peer = peer
-        self.buffer = b""
+        self.buffer = bytearray()
+        # position of the first byte in buffer that is not parsed yet
+        self.offset = 0
+        # position from which to look for the next legacy delimiter
+        self.search_from = 0
+        # whether the other peer uses the legacy format, None until its first byte arrives
+        self.legacy_framing = None
+        # relations being sent and received on this connection, by stream id
+        self.outgoing = {}
+        self.incoming = {}
+        # whether the transport asked us to stop writing
+        self.paused = False
         self.transport = None
 
     def connection_made(self, transport):
 
         self.transport = transport
 
+    def pause_writing(self):
+
+        self.paused = True
+
+    def resume_writing(self):
+
+        self.paused = False
+        for sender in list(self.outgoing.values()):
+            sender.pump()
+
     def data_received(self, data):
 
         self.buffer += data
-        self.handle_lines()
+        if self.legacy_framing is None:
+            # messages in the legacy format are bare pickles
+            self.legacy_framing = self.buffer[0] == PICKLE_PROTO
+        if self.legacy_framing:
+            self.handle_lines()
+        else:
+            self.handle_frames()
+        self._compact()
+
+    def _compact(self):
+
+        # drop parsed bytes once they make up at least half of the buffer so
+        # that each byte is moved a constant number of times on average
+        if self.offset and 2 * self.offset >= len(self.buffer):
+            del self.buffer[:self.offset]
+            self.search_from -= self.offset
+            self.offset = 0
 
     def parse_line(self, line):
 
@@ -92,17 +263,69 @@ class SalmonProtocol(asyncio.Protocol):
         else:
             raise Exception("Weird message: " + str(msg))
 
-    def handle_lines(self):
+    def handle_frame(self, frame_type: int, payload: memoryview):
 
-        # using delimiters for now
-        # TODO: switch to sending length flags
-        while b"\n\n\n" in self.buffer:
-            line, self.buffer = self.buffer.split(b"\n\n\n", 1)
-            parsed = self.parse_line(line)
+        if frame_type == MSG_FRAME:
+            parsed = self.parse_line(payload)
             if parsed:
                 self.handle_msg(parsed)
             else:
-                print("failed to parse line:", line)
+                print("failed to parse frame:", bytes(payload))
+        elif frame_type == RELATION_START_FRAME:
+            header = self.parse_line(payload)
+            self.incoming[header.stream_id] = RelationReceiver(header)
+        elif frame_type == COLUMN_FRAME:
+            stream_id, idx = STREAM_HEADER.unpack_from(payload)
+            receiver = self.incoming[stream_id]
+            with payload[STREAM_HEADER.size:] as data:
+                receiver.add_column(idx, data)
+            if idx == len(receiver.columns) - 1:
+                # the whole chunk arrived, let the sender send another one
+                write_frame(self.transport, CREDIT_FRAME, STREAM_HEADER.pack(stream_id, 1))
+        elif frame_type == RELATION_END_FRAME:
+            stream_id, num_rows = STREAM_HEADER.unpack_from(payload)
+            receiver = self.incoming.pop(stream_id)
+            self.peer.receive_relation(receiver.header, receiver.finish(num_rows))
+        elif frame_type == CREDIT_FRAME:
+            stream_id, credit = STREAM_HEADER.unpack_from(payload)
+            # credit for the last chunks arrives after the sender is done
+            if stream_id in self.outgoing:
+                self.outgoing[stream_id].add_credit(credit)
+        else:
+            raise Exception("Unknown frame type: " + str(frame_type))
+
+    def handle_frames(self):
+
+        # payloads are handed out as views into the buffer, which must be
+        # released before the buffer is resized
+        with memoryview(self.buffer) as view:
+            while len(self.buffer) - self.offset >= FRAME_HEADER.size:
+                frame_type, length = FRAME_HEADER.unpack_from(self.buffer, self.offset)
+                start = self.offset + FRAME_HEADER.size
+                if len(self.buffer) < start + length:
+                    break
+                self.offset = start + length
+                with view[start:start + length] as payload:
+                    self.handle_frame(frame_type, payload)
+
+    def handle_lines(self):
+
+        # legacy format, pickled messages separated by delimiters
+        with memoryview(self.buffer) as view:
+            while True:
+                end = self.buffer.find(LEGACY_DELIMITER, max(self.offset, self.search_from))
+                if end < 0:
+                    # the delimiter might be split across reads
+                    self.search_from = max(self.offset, len(self.buffer) - len(LEGACY_DELIMITER) + 1)
+                    break
+                start = self.offset
+                self.offset = end + len(LEGACY_DELIMITER)
+                with view[start:end] as line:
+                    parsed = self.parse_line(line)
+                    if parsed:
+                        self.handle_msg(parsed)
+                    else:
+                        print("failed to parse line:", bytes(line))
 
 
 class SalmonPeer:
@@ -118,6 +341,12 @@ class SalmonPeer:
         self.host = self.parties[self.pid]["host"]
         self.port = self.parties[self.pid]["port"]
         self.peer_connections = {}
+        self.peer_protocols = {}
+        # relations received over the data channel, by (sender pid, relation name)
+        self.relations = {}
+        self.stream_ids = itertools.count()
+        # send messages in the delimiter-separated format of older peers
+        self.legacy_framing = config.get("legacy_framing", False)
         self.dispatcher = None
         self.msg_buffer = []
         self.server = loop.create_server(
@@ -136,7 +365,7 @@ class SalmonPeer:
         for msg in self.msg_buffer:
             if isinstance(msg, DoneMsg):
                 self.dispatcher.receive_msg(msg)
-        self.msg_buffer = [msg for msg in self.msg_buffer if isinstance(msg, DoneMsg)]
+        self.msg_buffer = [msg for msg in self.msg_buffer if not isinstance(msg, DoneMsg)]
 
     def connect_to_others(self):
 
@@ -155,9 +384,8 @@ class SalmonPeer:
         def _send_IAM(pid, conn):
 
             msg = IAMMsg(pid)
-            formatted = pickle.dumps(msg) + b"\n\n\n"
             transport, protocol = conn.result()
-            transport.write(formatted)
+            write_msg(transport, msg, self.legacy_framing)
 
         to_wait_on = []
         for other_pid in self.parties.keys():
@@ -190,14 +418,12 @@ class SalmonPeer:
         for pid in self.peer_connections:
             completed_future = self.peer_connections[pid]
             # the result is a (transport, protocol) tuple
-            # we only want the transport
-            self.peer_connections[pid] = completed_future.result()[0]
+            self.peer_connections[pid], self.peer_protocols[pid] = completed_future.result()
 
     def _send_msg(self, receiver, msg):
 
         # sends formatted message
-        formatted = pickle.dumps(msg) + b"\n\n\n"
-        self.peer_connections[receiver].write(formatted)
+        write_msg(self.peer_connections[receiver], msg, self.legacy_framing)
 
     def send_done_msg(self, receiver, task_name):
 
@@ -205,6 +431,57 @@ class SalmonPeer:
         done_msg = DoneMsg(self.pid, task_name)
         self._send_msg(receiver, done_msg)
 
+    def send_relation(self, receiver: int, name: str, columns: list, rows, chunk_size: int = RELATION_CHUNK_SIZE):
+        """
+        Sends a relation of integer rows to another peer over the data channel.
+        :param receiver: pid of the receiving peer
+        :param name: relation name, used by the receiver to look up the relation
+        :param columns: column names
+        :param rows: iterable of rows, consumed chunk_size rows at a time
+        :return: future that completes with the number of rows sent
+        """
+
+        if self.legacy_framing:
+            raise Exception("Sending relations requires length-prefixed framing.")
+        protocol = self.peer_protocols[receiver]
+        stream_id = next(self.stream_ids)
+        header = RelationHeader(self.pid, stream_id, name, columns)
+        write_frame(protocol.transport, RELATION_START_FRAME, pickle.dumps(header))
+        sender = RelationSender(stream_id, protocol, rows, chunk_size)
+        protocol.outgoing[stream_id] = sender
+        sender.done.add_done_callback(lambda f: protocol.outgoing.pop(stream_id, None))
+        sender.pump()
+        return sender.done
+
+    def recv_relation(self, sender: int, name: str):
+        """
+        Receives a relation sent by another peer over the data channel.
+        :param sender: pid of the sending peer
+        :param name: relation name
+        :return: future that completes with a (column names, column buffers)
+        tuple, one array of int64 values per column
+        """
+
+        key = (sender, name)
+        if key not in self.relations:
+            self.relations[key] = self.loop.create_future()
+        future = self.relations[key]
+
+        def _forget(f):
+            if self.relations.get(key) is f:
+                del self.relations[key]
+
+        future.add_done_callback(_forget)
+        return future
+
+    def receive_relation(self, header: RelationHeader, columns: list):
+
+        # relations can arrive before anyone asks for them
+        key = (header.pid, header.name)
+        if key not in self.relations or self.relations[key].done():
+            self.relations[key] = self.loop.create_future()
+        self.relations[key].set_result((header.columns, columns))
+
 
 def setup_peer(config):
     """
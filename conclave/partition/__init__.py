@@ -1,30 +1,52 @@
 from . import part
+from .cost import CostModel, assign_frameworks
 from conclave.dag import OpDag, Dag, Create, Open, Persist, OpNode
-from copy import copy, deepcopy
+from copy import copy
 from conclave.codegen.scotch import ScotchCodeGen
 from conclave.config import CodeGenConfig
 
 
-def part_dag(dag: Dag):
-    """ Exhaustive search partition function. """
-    sorted_nodes = dag.top_sort()
-    best = part.get_best_partition(sorted_nodes)
+def get_stored_with(node: OpNode):
+    """ Returns stored_with set of out_rel or in_rel of a node, depending on it's type. """
+    if isinstance(node, Open):
+        return node.get_in_rel().stored_with
+    elif isinstance(node, Create) and node.children:
+        return get_stored_with(next(iter(node.children)))
+    else:
+        return node.out_rel.stored_with
 
-    return best
+
+def stays_secret(parent: OpNode, child: OpNode):
+    """ Returns whether parent's output can be passed to child in a later MPC job without opening it. """
+
+    return parent.is_mpc and child.is_mpc and not isinstance(parent, Create)
+
+
+def persist_across_jobs(parent: OpNode, child: OpNode):
+    """
+    Returns the node whose output a job running child reads in place of parent's output.
+    When both run under MPC, parent's output is persisted in the MPC framework's table
+    database and read back from there, so that it stays secret-shared rather than being
+    opened and shared again. The Persist node is added as a child of parent.
+    """
+
+    if not stays_secret(parent, child) or isinstance(parent, Persist):
+        return parent
+    # each relation is only persisted once, however many jobs read it
+    for other in parent.children:
+        if isinstance(other, Persist):
+            return other
+    out_rel = parent.out_rel.clone()
+    out_rel.rename(parent.out_rel.name + "_persisted")
+    persist_op = Persist(out_rel, parent)
+    persist_op.is_mpc = True
+    parent.children.add(persist_op)
+    return persist_op
 
 
 def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
     """ Non-exhaustive partition. Returns best partition with respect to certain heuristics. """
 
-    def get_stored_with(node: OpNode):
-        """ Returns stored_with set of out_rel or in_rel of a node, depending on it's type. """
-        if isinstance(node, Open):
-            return node.get_in_rel().stored_with
-        elif isinstance(node, Create):
-            return get_stored_with(next(iter(node.children)))
-        else:
-            return node.out_rel.stored_with
-
     def is_correct_mode(node: OpNode, available: set, stored_with: set):
         """ Verifies that node is stored with same set of parties passed to this function. """
 
@@ -34,18 +56,23 @@ def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
         # otherwise check parents
         return node.parents.issubset(available) or not (node.parents or available)
 
-    def can_partition(dag: Dag, stored_with: set, top_available: set):
-        """ Returns whether the Dag passed to it can be partitioned. """
+    def can_partition(dag: Dag, stored_with: set, top_available: set, persist: bool = False):
+        """
+        Returns whether the Dag passed to it can be partitioned. If persist is set, MPC
+        nodes may be left to a later job with the same parties, which reads the results
+        of their MPC parents from where these are persisted.
+        """
 
         # copy so we don't overwrite global available nodes in this pass
-        available = deepcopy(top_available)
+        available = set(top_available)
         ordered = dag.top_sort()
         unavailable = set()
 
         for node in ordered:
             if node in unavailable and get_stored_with(node) == stored_with:
                 for parent in node.parents:
-                    if parent in available and not isinstance(parent, Persist):
+                    if parent in available and not (isinstance(parent, Persist) or
+                                                    (persist and stays_secret(parent, node))):
                         return False
             if is_correct_mode(node, available, stored_with):
                 available.add(node)
@@ -64,7 +91,7 @@ def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
                 if parent in available:
                     create_op = None
                     if parent not in previous_parents:
-                        create_op = Create(deepcopy(parent.out_rel))
+                        create_op = Create(persist_across_jobs(parent, root).out_rel.clone())
                         # create op is in same mode as root
                         create_op.is_mpc = root.is_mpc
                         previous_parents.add(parent)
@@ -127,10 +154,12 @@ def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
     def next_holding_ps(nextdag, available):
 
         roots = nextdag.roots
-        for root in sorted(roots, key=lambda node: node.out_rel.name):
-            holding_ps = get_stored_with(root)
-            if can_partition(nextdag, holding_ps, available):
-                return holding_ps, root.is_mpc
+        # only split MPC computations across jobs if there is no other way to partition
+        for persist in [False, True]:
+            for root in sorted(roots, key=lambda node: node.out_rel.name):
+                holding_ps = get_stored_with(root)
+                if can_partition(nextdag, holding_ps, available, persist):
+                    return holding_ps, root.is_mpc
         raise Exception("Found no roots to partition on")
 
     def merge_neighbor_dags(mapping):
@@ -185,3 +214,94 @@ def heupart(dag: Dag, mpc_frameworks: list, local_frameworks: list):
 
     merged = merge_neighbor_dags(mapping)
     return merged
+
+
+def costpart(dag: Dag, mpc_frameworks: list, local_frameworks: list, cost_model: [CostModel, None] = None):
+    """
+    Cost-based partition. Assigns each operator the framework that minimizes estimated operator
+    and job boundary costs, then cuts the DAG into jobs at every change of framework or holding
+    parties. Runs in polynomial time in the number of operators.
+    """
+
+    if cost_model is None:
+        cost_model = CostModel()
+    cost_model.estimate(dag)
+
+    ordered = dag.top_sort()
+    # inputs are read by whichever job consumes them, so they are placed after framework assignment
+    inputs = [node for node in ordered if isinstance(node, Create) and node.children]
+    ops = [node for node in ordered if not (isinstance(node, Create) and node.children)]
+
+    candidates = {node: mpc_frameworks if node.is_mpc else local_frameworks for node in ops}
+    fmwks = assign_frameworks(ops, candidates, cost_model)
+
+    # a job runs the nodes with the same framework and holding parties that sit in the same
+    # stage, where a node's stage is at least that of its parents, plus one when the framework
+    # or holding parties change; dependencies between jobs thus point to later stages and
+    # never form cycles
+    def _job_key(job):
+        stage, (fmwk, stored_with) = job
+        return stage, fmwk, sorted(stored_with)
+
+    def _crossing_cost(node: OpNode, stage: int):
+        """ Cost of the boundaries between node and neighbours in its job if placed in stage. """
+
+        cost = 0
+        for parent in node.parents:
+            if parent in job_of and job_of[parent][1] == job_of[node][1] and job_of[parent][0] != stage:
+                cost += cost_model.crossing_cost(parent)
+        for child in node.children:
+            if job_of[child][1] == job_of[node][1] and job_of[child][0] != stage:
+                cost += cost_model.crossing_cost(node)
+        return cost
+
+    job_of = {}
+    # earliest stage of each node
+    for node in ops:
+        label = (fmwks[node], frozenset(get_stored_with(node)))
+        stage = 0
+        for parent in node.parents:
+            if parent in job_of:
+                parent_stage, parent_label = job_of[parent]
+                stage = max(stage, parent_stage + (parent_label != label))
+        job_of[node] = (stage, label)
+    # move nodes to the latest stage their children allow when that avoids job boundaries
+    for node in reversed(ops):
+        if not node.children:
+            continue
+        stage, label = job_of[node]
+        latest = min(job_of[child][0] - (job_of[child][1] != label) for child in node.children)
+        if latest > stage and _crossing_cost(node, latest) < _crossing_cost(node, stage):
+            job_of[node] = (latest, label)
+    for node in inputs:
+        job_of[node] = min((job_of[child] for child in node.children), key=_job_key)
+
+    # disconnect at job boundaries, inserting one create op per consuming job
+    boundary_creates = dict()
+    for child in ordered:
+        for parent in sorted(child.parents, key=lambda node: node.out_rel.name):
+            if job_of[parent] == job_of[child]:
+                continue
+            key = (parent, job_of[child])
+            create_op = boundary_creates.get(key)
+            if create_op is None:
+                persisted = persist_across_jobs(parent, child)
+                if persisted is not parent:
+                    # persisted in the same job as parent
+                    job_of[persisted] = job_of[parent]
+                create_op = Create(persisted.out_rel.clone())
+                # create op is in same mode as the node that consumes it
+                create_op.is_mpc = child.is_mpc
+                boundary_creates[key] = create_op
+                job_of[create_op] = job_of[child]
+            parent.children.remove(child)
+            child.replace_parent(parent, create_op)
+            create_op.children.add(child)
+
+    jobs = dict()
+    for node in job_of:
+        if not node.parents:
+            jobs.setdefault(job_of[node], set()).add(node)
+
+    return [(fmwk, OpDag(jobs[(stage, (fmwk, stored_with))]), set(stored_with))
+            for stage, (fmwk, stored_with) in sorted(jobs, key=_job_key)]
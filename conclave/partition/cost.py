@@ -0,0 +1,189 @@
+from collections import deque
+
+from conclave import stats
+from conclave.dag import Dag, OpNode
+
+inf = float("inf")
+
+# relative cost per value processed by an operator in a framework, keyed by
+# operator name; "default" covers operators that are not listed
+DEFAULT_OP_COSTS = {
+    "sharemind": {
+        "default": 100,
+        "create": 1,
+        "persist": 1,
+        "close": 10,
+        "open": 10,
+        "project": 10,
+        "concat": 10,
+        "multiply": 50,
+        "divide": 200,
+        "aggregation": 1000,
+        "join": 2000,
+        "sortBy": 2000,
+        "distinct": 2000,
+    },
+    "spark": {
+        "default": 5,
+        "create": 2,
+    },
+    "python": {
+        "default": 1,
+        "create": 1,
+        "join": 4,
+        "aggregation": 2,
+    },
+}
+
+
+class CostModel:
+    """ Per-operator, per-framework cost estimates used by the cost-based partitioner. """
+
+    def __init__(self, op_costs: [dict, None] = None, boundary_cost: float = 20):
+        """
+        Initialize CostModel object.
+        :param op_costs: framework name -> {operator name -> cost per value processed}
+        :param boundary_cost: cost per value of writing a relation out at the end of one
+        job and reading it back in at the start of another
+        """
+
+        self.op_costs = DEFAULT_OP_COSTS if op_costs is None else op_costs
+        self.boundary_cost = boundary_cost
+        # estimated stats.RelationStats per node, set by estimate
+        self.cardinalities = {}
+
+    def estimate(self, dag: Dag):
+        """ Estimate the output size of every node in dag from the statistics of its inputs. """
+
+        self.cardinalities = stats.estimate_cardinalities(dag)
+
+    def _size(self, node: OpNode):
+        """ Estimated number of values in the output of node, one row if not estimated. """
+
+        row_count = self.cardinalities[node].row_count if node in self.cardinalities else 1
+        return max(row_count, 1) * max(len(node.out_rel.columns), 1)
+
+    def op_cost(self, node: OpNode, fmwk: str):
+        """ Estimated cost of running node in fmwk, scaled by the larger of its input and output size. """
+
+        costs = self.op_costs.get(fmwk, {})
+        size = max(self._size(node), sum(self._size(parent) for parent in node.parents))
+        return costs.get(node.name, costs.get("default", 1)) * size
+
+    def crossing_cost(self, node: OpNode):
+        """ Estimated cost of passing the output of node across a job boundary. """
+
+        return self.boundary_cost * self._size(node)
+
+
+def _min_cut(num_vertices: int, source: int, sink: int, capacities: dict):
+    """
+    Returns the vertices on the source side of a minimum source-sink cut. Capacities
+    map (from, to) vertex pairs to edge capacities. Edmonds-Karp, O(VE^2).
+    """
+
+    residual = [dict() for _ in range(num_vertices)]
+    for (u, v), cap in capacities.items():
+        residual[u][v] = residual[u].get(v, 0) + cap
+        residual[v].setdefault(u, 0)
+
+    while True:
+        prev = {source: None}
+        queue = deque([source])
+        while queue and sink not in prev:
+            u = queue.popleft()
+            for v, cap in residual[u].items():
+                if cap > 0 and v not in prev:
+                    prev[v] = u
+                    queue.append(v)
+        if sink not in prev:
+            return set(prev)
+        # find bottleneck along augmenting path and push flow through it
+        flow = inf
+        v = sink
+        while prev[v] is not None:
+            flow = min(flow, residual[prev[v]][v])
+            v = prev[v]
+        v = sink
+        while prev[v] is not None:
+            u = prev[v]
+            residual[u][v] -= flow
+            residual[v][u] += flow
+            v = u
+
+
+def _energy(labels: dict, edges: list, cost_model: CostModel):
+
+    total = sum(cost_model.op_cost(node, fmwk) for node, fmwk in labels.items())
+    for parent, child, weight in edges:
+        if labels[parent] != labels[child]:
+            total += weight
+    return total
+
+
+def _expand(labels: dict, candidates: dict, edges: list, alpha: str, cost_model: CostModel):
+    """
+    Returns the labelling with least energy among those where every node either keeps
+    its framework or switches to alpha, found by a single minimum cut.
+    """
+
+    nodes = list(labels)
+    index = {node: idx for idx, node in enumerate(nodes)}
+    source, sink = len(nodes), len(nodes) + 1
+    # per-node coefficient of x, where x = 1 means the node switches to alpha
+    linear = [0] * len(nodes)
+    capacities = {}
+
+    for node in nodes:
+        if alpha in candidates[node]:
+            linear[index[node]] += cost_model.op_cost(node, alpha) - cost_model.op_cost(node, labels[node])
+        else:
+            linear[index[node]] = inf
+
+    for parent, child, weight in edges:
+        u, v = index[parent], index[child]
+        # pairwise energies for (x_u, x_v) = (0, 0), (0, 1), (1, 0), (1, 1)
+        keep = weight if labels[parent] != labels[child] else 0
+        child_moves = weight if labels[parent] != alpha else 0
+        parent_moves = weight if alpha != labels[child] else 0
+        linear[u] += parent_moves - keep
+        linear[v] -= parent_moves
+        capacities[(u, v)] = capacities.get((u, v), 0) + child_moves + parent_moves - keep
+
+    for idx, coeff in enumerate(linear):
+        if coeff > 0:
+            capacities[(source, idx)] = coeff
+        elif coeff < 0:
+            capacities[(idx, sink)] = -coeff
+
+    keep_side = _min_cut(len(nodes) + 2, source, sink, capacities)
+    return {node: labels[node] if index[node] in keep_side else alpha for node in nodes}
+
+
+def assign_frameworks(nodes: list, candidates: dict, cost_model: CostModel):
+    """
+    Maps each node to one of its candidate frameworks so that the summed operator costs,
+    plus crossing costs for parent-child pairs that run in different frameworks, are minimal.
+    Exact when nodes choose between two frameworks, otherwise found via alpha-expansion
+    over minimum cuts, which stays within a factor of two of the optimum.
+    """
+
+    labels = {node: min(candidates[node], key=lambda fmwk: cost_model.op_cost(node, fmwk)) for node in nodes}
+    edges = [(parent, node, cost_model.crossing_cost(parent))
+             for node in nodes for parent in node.parents if parent in labels]
+    frameworks = sorted(set().union(*candidates.values()))
+    if len(frameworks) < 2:
+        return labels
+
+    energy = _energy(labels, edges, cost_model)
+    improved = True
+    while improved:
+        improved = False
+        for alpha in frameworks:
+            expanded = _expand(labels, candidates, edges, alpha, cost_model)
+            expanded_energy = _energy(expanded, edges, cost_model)
+            if expanded_energy < energy - 1e-9:
+                labels, energy = expanded, expanded_energy
+                improved = True
+
+    return labels
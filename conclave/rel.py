@@ -8,14 +8,39 @@ class Column:
     """
     Column data structure.
     """
+    __slots__ = ("rel_name", "name", "idx", "type_str", "_coll_sets", "bit_width")
 
-    def __init__(self, rel_name: str, name: str, idx: int, type_str: str, coll_sets: set):
+    def __init__(self, rel_name: str, name: str, idx: int, type_str: str, coll_sets: [utils.CollusionRecord, set],
+                 bit_width: [int, None] = None):
         """Initialize object."""
         self.rel_name = rel_name
         self.name = name
         self.idx = idx  # Integer index of the column in the relation.
         self.type_str = type_str  # Currently can only be "INTEGER".
         self.coll_sets = coll_sets  # Record of all sets of parties that can collude together to recover values in this column.
+        self.bit_width = bit_width  # Bits needed to hold any value in this column, None if unknown. See widths.py.
+
+    @property
+    def coll_sets(self):
+        """Return collusion record of column."""
+        return self._coll_sets
+
+    @coll_sets.setter
+    def coll_sets(self, coll_sets: [utils.CollusionRecord, set]):
+        """Set collusion record of column, converting sets of party sets."""
+        if not isinstance(coll_sets, utils.CollusionRecord):
+            coll_sets = utils.CollusionRecord(coll_sets)
+        self._coll_sets = coll_sets
+
+    def clone(self):
+        """Return a copy of this column. All fields are immutable so they can be shared."""
+        return Column(self.rel_name, self.name, self.idx, self.type_str, self._coll_sets, self.bit_width)
+
+    def __deepcopy__(self, memo):
+        """Deep copies of columns are clones."""
+        copied = self.clone()
+        memo[id(self)] = copied
+        return copied
 
     def get_name(self):
         """Return column name."""
@@ -31,7 +56,7 @@ class Column:
             " ".join(sorted(["{" + ",".join([str(p) for p in coll_set]) + "}" for coll_set in self.coll_sets]))
         return self.get_name() + " " + coll_set_str
 
-    def merge_coll_sets_in(self, other_coll_sets: set):
+    def merge_coll_sets_in(self, other_coll_sets: [utils.CollusionRecord, set]):
         """Merge collusion sets into column."""
         self.coll_sets = utils.merge_coll_sets(self.coll_sets, other_coll_sets)
 
@@ -44,12 +69,52 @@ class Relation:
     """
     Relation data structure.
     """
+    __slots__ = ("_name", "columns", "stored_with", "_column_index")
+    # number of renames of any relation, DAGs order nodes by relation name
+    # and use this to tell when a cached topological order is stale
+    renames = 0
 
     def __init__(self, name: str, columns: list, stored_with: set):
         """Initialize object."""
-        self.name = name
+        self._name = name
         self.columns = columns
         self.stored_with = stored_with  # Ownership of this data set. Does this refer to secret shares or open data?
+        # (columns list, its length, {name: position}) lookup for find_column
+        self._column_index = None
+
+    @property
+    def name(self):
+        """Relation name."""
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        Relation.renames += 1
+        self._name = name
+
+    def find_column(self, col_name: str):
+        """
+        Retrieve column by name in constant time. Returns the first column with
+        that name like utils.find, or None if there is no such column.
+        """
+        index = self._column_index
+        if index is not None and index[0] is self.columns and index[1] == len(self.columns):
+            pos = index[2].get(col_name)
+            # columns can be replaced or renamed in place, check before trusting the index
+            if pos is not None and self.columns[pos].name == col_name:
+                return self.columns[pos]
+        positions = {}
+        for pos, col in enumerate(self.columns):
+            positions.setdefault(col.name, pos)
+        self._column_index = (self.columns, len(self.columns), positions)
+        if col_name not in positions:
+            print("column '{}' not found in {}".format(col_name, [c.get_name() for c in self.columns]))
+            return None
+        return self.columns[positions[col_name]]
+
+    def clone(self):
+        """Return a copy of this relation with copies of its columns."""
+        return Relation(self.name, [col.clone() for col in self.columns], set(self.stored_with))
 
     def rename(self, new_name):
         """Rename relation."""
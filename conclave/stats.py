@@ -0,0 +1,329 @@
+"""
+Statistics catalog for input relations and cardinality estimation over DAGs.
+
+Statistics are attached to Create nodes, either loaded from a JSON sidecar file
+next to the input data or computed by sampling the input. All parties must use
+the same statistics, otherwise cost-based decisions can diverge between them.
+Code generation does not collect statistics itself, since parties only hold their
+own inputs: protocols attach them to Create nodes, e.g. via collect_stats on data
+or sidecar files that are the same at every party.
+"""
+import csv
+import json
+import math
+import os
+from collections import Counter
+
+import conclave.dag as saldag
+
+# row count assumed for inputs without statistics
+DEFAULT_ROW_COUNT = 1000
+# fraction of rows kept by filters that cannot be estimated from column statistics
+EQUALITY_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3
+# filter operators that test for equality, the DSL writes "=" and generated code "=="
+EQUALITY_OPERATORS = {"=", "=="}
+
+
+class ColumnStats:
+    """
+    Number of distinct values and value range of a column. None means unknown. The
+    range must hold every value of the column, code generators size data types by it.
+    """
+
+    __slots__ = ("distinct", "min_val", "max_val")
+
+    def __init__(self, distinct: [int, None] = None, min_val=None, max_val=None):
+
+        self.distinct = distinct
+        self.min_val = min_val
+        self.max_val = max_val
+
+    def capped(self, row_count: int):
+        """ Return copy of these statistics for a relation with row_count rows. """
+
+        distinct = None if self.distinct is None else min(self.distinct, row_count)
+        return ColumnStats(distinct, self.min_val, self.max_val)
+
+    def __eq__(self, other):
+
+        return isinstance(other, ColumnStats) and \
+            (self.distinct, self.min_val, self.max_val) == (other.distinct, other.min_val, other.max_val)
+
+    def __repr__(self):
+
+        return "ColumnStats({}, {}, {})".format(self.distinct, self.min_val, self.max_val)
+
+
+class RelationStats:
+    """ Row count and per-column statistics, keyed by column name, of a relation. """
+
+    __slots__ = ("row_count", "columns")
+
+    def __init__(self, row_count: int, columns: [dict, None] = None):
+
+        self.row_count = row_count
+        self.columns = {} if columns is None else columns
+
+    def column(self, name: str):
+        """ Return statistics for column name, which are empty if unknown. """
+
+        return self.columns.get(name, ColumnStats())
+
+    def distinct(self, name: str):
+        """ Return number of distinct values in column name, or the row count if unknown. """
+
+        distinct = self.column(name).distinct
+        return self.row_count if distinct is None else distinct
+
+    @classmethod
+    def from_dict(cls, stats: dict):
+
+        columns = {name: ColumnStats(col.get("distinct"), col.get("min"), col.get("max"))
+                   for name, col in stats.get("columns", {}).items()}
+        return cls(stats["row_count"], columns)
+
+    def to_dict(self):
+
+        return {
+            "row_count": self.row_count,
+            "columns": {name: {"distinct": col.distinct, "min": col.min_val, "max": col.max_val}
+                        for name, col in self.columns.items()}
+        }
+
+    def __repr__(self):
+
+        return "RelationStats({}, {})".format(self.row_count, self.columns)
+
+
+def load_stats(path: str):
+    """ Load RelationStats from a JSON sidecar file. """
+
+    with open(path, "r") as f:
+        return RelationStats.from_dict(json.load(f))
+
+
+def _parse(value: str):
+
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def sample_stats(path: str, delimiter: str = ",", sample_size: int = 10000):
+    """
+    Compute RelationStats for a CSV file with a header row. Rows are counted exactly;
+    distinct counts are extrapolated from the first sample_size rows with the GEE
+    estimator (sqrt(rows / sample) * singletons + values seen more than once). Value
+    ranges are taken over all rows.
+    """
+
+    with open(path, "r") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader)
+        sample = []
+        mins, maxs = [None] * len(header), [None] * len(header)
+        row_count = 0
+        for row in reader:
+            values = [_parse(value) for value in row]
+            if row_count < sample_size:
+                sample.append(values)
+            mins = [val if low is None else min(low, val) for low, val in zip(mins, values)]
+            maxs = [val if high is None else max(high, val) for high, val in zip(maxs, values)]
+            row_count += 1
+
+    columns = {}
+    for idx, name in enumerate(header):
+        values = [row[idx] for row in sample]
+        if not values:
+            columns[name] = ColumnStats(0)
+            continue
+        counts = Counter(values)
+        singletons = sum(1 for count in counts.values() if count == 1)
+        distinct = math.sqrt(row_count / len(sample)) * singletons + len(counts) - singletons
+        columns[name] = ColumnStats(min(int(round(distinct)), row_count), mins[idx], maxs[idx])
+
+    return RelationStats(row_count, columns)
+
+
+def collect_stats(dag: saldag.Dag, input_path: str, delimiter: str = ",", sample_size: int = 10000):
+    """
+    Attach statistics to Create nodes of dag that have none, preferring a
+    <name>.stats.json sidecar file and otherwise sampling <name>.csv in input_path.
+    Inputs with neither file are left without statistics.
+    """
+
+    for node in dag.roots:
+        if not isinstance(node, saldag.Create) or node.stats is not None:
+            continue
+        base = os.path.join(input_path, node.out_rel.name)
+        if os.path.exists(base + ".stats.json"):
+            node.stats = load_stats(base + ".stats.json")
+        elif os.path.exists(base + ".csv"):
+            node.stats = sample_stats(base + ".csv", delimiter, sample_size)
+
+
+def _rows(row_count: float):
+
+    return int(math.ceil(row_count))
+
+
+def _carry(node: saldag.OpNode, in_stats: RelationStats, row_count: int, changed: tuple = ()):
+    """ Statistics of node's output, taking over input column statistics by name. """
+
+    columns = {}
+    for col in node.out_rel.columns:
+        if col.name in in_stats.columns and col.name not in changed:
+            columns[col.name] = in_stats.columns[col.name].capped(row_count)
+    return RelationStats(row_count, columns)
+
+
+def _estimate_create(node: saldag.Create, estimates: dict):
+
+    if node.stats is not None:
+        return node.stats
+    return RelationStats(DEFAULT_ROW_COUNT)
+
+
+def _estimate_unary(node: saldag.UnaryOpNode, estimates: dict):
+
+    in_stats = estimates[node.parent]
+    return _carry(node, in_stats, in_stats.row_count)
+
+
+def _estimate_arithmetic(node: [saldag.Multiply, saldag.Divide], estimates: dict):
+
+    in_stats = estimates[node.parent]
+    return _carry(node, in_stats, in_stats.row_count, (node.target_col.name,))
+
+
+def _estimate_index(node: saldag.Index, estimates: dict):
+
+    in_stats = estimates[node.parent]
+    row_count = in_stats.row_count
+    stats = _carry(node, in_stats, row_count, (node.idx_col_name,))
+    stats.columns[node.idx_col_name] = ColumnStats(row_count, 0, max(row_count - 1, 0))
+    return stats
+
+
+def _estimate_comp_neighs(node: saldag.CompNeighs, estimates: dict):
+
+    in_stats = estimates[node.parent]
+    stats = _carry(node, in_stats, in_stats.row_count, (node.comp_col.name,))
+    stats.columns[node.comp_col.name] = ColumnStats(2, 0, 1)
+    return stats
+
+
+def _group_count(in_stats: RelationStats, cols: list):
+    """ Estimated number of distinct combinations of values in cols. """
+
+    count = 1
+    for col in cols:
+        count *= in_stats.distinct(col.name)
+    return min(count, in_stats.row_count)
+
+
+def _estimate_aggregate(node: saldag.Aggregate, estimates: dict):
+
+    in_stats = estimates[node.parent]
+    row_count = _group_count(in_stats, node.group_cols)
+    agg_names = set(col.name for col in node.out_rel.columns) - set(col.name for col in node.group_cols)
+    return _carry(node, in_stats, row_count, tuple(agg_names))
+
+
+def _estimate_distinct(node: saldag.Distinct, estimates: dict):
+
+    in_stats = estimates[node.parent]
+    return _carry(node, in_stats, _group_count(in_stats, node.selected_cols))
+
+
+def _estimate_filter(node: saldag.Filter, estimates: dict):
+
+    in_stats = estimates[node.parent]
+    name = node.target_col.name
+    if node.operator in EQUALITY_OPERATORS:
+        distinct = in_stats.column(name).distinct
+        selectivity = 1 / distinct if distinct else EQUALITY_SELECTIVITY
+    else:
+        selectivity = RANGE_SELECTIVITY
+    stats = _carry(node, in_stats, _rows(in_stats.row_count * selectivity))
+    if node.operator in EQUALITY_OPERATORS and name in stats.columns:
+        stats.columns[name] = ColumnStats(1, stats.columns[name].min_val, stats.columns[name].max_val)
+    return stats
+
+
+def _estimate_concat(node: saldag.Concat, estimates: dict):
+
+    in_stats = [estimates[parent] for parent in node.ordered]
+    row_count = sum(stats.row_count for stats in in_stats)
+    columns = {}
+    # concat matches columns by position, output names may differ from input names
+    for idx, col in enumerate(node.out_rel.columns):
+        col_stats = [stats.column(parent.out_rel.columns[idx].name)
+                     for stats, parent in zip(in_stats, node.ordered)]
+        distincts = [s.distinct for s in col_stats]
+        mins = [s.min_val for s in col_stats]
+        maxs = [s.max_val for s in col_stats]
+        columns[col.name] = ColumnStats(
+            None if None in distincts else min(sum(distincts), row_count),
+            None if None in mins else min(mins),
+            None if None in maxs else max(maxs)
+        )
+    return RelationStats(row_count, columns)
+
+
+def _estimate_join(node: saldag.Join, estimates: dict):
+
+    left, right = estimates[node.left_parent], estimates[node.right_parent]
+    # assume containment of key values, so each key pair keeps 1 / max(distinct) of the cross product
+    row_count = left.row_count * right.row_count
+    for left_col, right_col in zip(node.left_join_cols, node.right_join_cols):
+        row_count /= max(left.distinct(left_col.name), right.distinct(right_col.name), 1)
+    row_count = _rows(row_count)
+
+    columns = {}
+    for in_stats in [right, left]:
+        for col in node.out_rel.columns:
+            if col.name in in_stats.columns:
+                columns[col.name] = in_stats.columns[col.name].capped(row_count)
+    return RelationStats(row_count, columns)
+
+
+# estimation function per node type, looked up along the class hierarchy
+_estimators = {
+    saldag.Create: _estimate_create,
+    saldag.UnaryOpNode: _estimate_unary,
+    saldag.Multiply: _estimate_arithmetic,
+    saldag.Divide: _estimate_arithmetic,
+    saldag.Index: _estimate_index,
+    saldag.CompNeighs: _estimate_comp_neighs,
+    saldag.Aggregate: _estimate_aggregate,
+    saldag.Distinct: _estimate_distinct,
+    saldag.Filter: _estimate_filter,
+    saldag.Concat: _estimate_concat,
+    saldag.Join: _estimate_join,
+}
+
+
+def _estimator(node: saldag.OpNode):
+
+    for klass in type(node).__mro__:
+        if klass in _estimators:
+            return _estimators[klass]
+    raise Exception("No cardinality estimate for {}".format(type(node).__name__))
+
+
+def estimate_cardinalities(dag: saldag.Dag):
+    """
+    Return dict mapping every node of dag to RelationStats estimated for its output,
+    propagated in topological order from the statistics attached to Create nodes.
+    """
+
+    estimates = {}
+    for node in dag.top_sort():
+        estimates[node] = _estimator(node)(node, estimates)
+    return estimates
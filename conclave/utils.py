@@ -4,16 +4,123 @@ Functions for working with collusion set annotations.
 TODO: Turn this into a dedicated module for working with collusion sets.
 """
 import functools
-import copy
 
 
-def merge_coll_sets(left: set, right: set):
+def _minimal(masks):
+    """
+    Drop party sets that contain another party set, since any superset of a set
+    of colluding parties can collude too.
+    """
+
+    masks = frozenset(masks)
+    if len(masks) < 2:
+        return masks
+    kept = []
+    for mask in sorted(masks, key=lambda m: (bin(m).count("1"), m)):
+        if not any(k & mask == k for k in kept):
+            kept.append(mask)
+    return frozenset(kept)
+
+
+class CollusionRecord:
+    """
+    Immutable record of all sets of parties that can collude together to recover
+    the values of a column. Party sets are stored as integer bitmasks (bit p is set
+    for party p) and only minimal sets are kept. Iterating yields frozensets of
+    party IDs in ascending mask order.
+    """
+
+    __slots__ = ("masks",)
+
+    def __init__(self, coll_sets=()):
+
+        if isinstance(coll_sets, CollusionRecord):
+            masks = coll_sets.masks
+        else:
+            masks = _minimal(sum(1 << party for party in coll_set) for coll_set in coll_sets)
+        object.__setattr__(self, "masks", masks)
+
+    @classmethod
+    def from_masks(cls, masks):
+
+        record = cls()
+        object.__setattr__(record, "masks", _minimal(masks))
+        return record
+
+    def __setattr__(self, key, value):
+
+        raise AttributeError("CollusionRecord is immutable")
+
+    def __iter__(self):
+
+        for mask in sorted(self.masks):
+            yield frozenset(party for party in range(mask.bit_length()) if mask >> party & 1)
+
+    def __len__(self):
+
+        return len(self.masks)
+
+    def __eq__(self, other):
+
+        if isinstance(other, (set, frozenset)):
+            other = CollusionRecord(other)
+        if not isinstance(other, CollusionRecord):
+            return NotImplemented
+        return self.masks == other.masks
+
+    def __hash__(self):
+
+        return hash(self.masks)
+
+    def __or__(self, other):
+
+        if not isinstance(other, CollusionRecord):
+            other = CollusionRecord(other)
+        if other.masks <= self.masks:
+            return self
+        elif self.masks <= other.masks:
+            return other
+        return CollusionRecord.from_masks(self.masks | other.masks)
+
+    __ror__ = __or__
+
+    def __copy__(self):
+
+        return self
+
+    def __deepcopy__(self, memo):
+
+        return self
+
+    def __reduce__(self):
+
+        return CollusionRecord.from_masks, (self.masks,)
+
+    def __repr__(self):
+
+        return "CollusionRecord({})".format([set(coll_set) for coll_set in self])
+
+    def merge(self, other):
+        """
+        Combine with another record, e.g. for a value computed from two columns.
+        Parties can recover the result if they can recover both inputs.
+        """
+
+        other = CollusionRecord(other)
+        if not self.masks:
+            return other
+        elif not other.masks:
+            return self
+        return CollusionRecord.from_masks(l | r for l in self.masks for r in other.masks)
+
+
+def merge_coll_sets(left: [CollusionRecord, set], right: [CollusionRecord, set]):
     """
     Merge two collusion records if possible.
     :param left: collusion record
     :param right: collusion record
-    :returns: all combinations of collusion sets from records
-    
+    :returns: all (minimal) combinations of collusion sets from records
+
     >>> left = set([frozenset([1, 2]), frozenset([3, 4])])
     >>> right = set([frozenset([5, 6]), frozenset([7])])
     >>> actual = merge_coll_sets(left, right)
@@ -22,18 +129,14 @@ def merge_coll_sets(left: set, right: set):
     True
     """
 
-    if not left:
-        return copy.copy(right)
-    elif not right:
-        return copy.copy(left)
-    return {l | r for l in left for r in right}
+    return CollusionRecord(left).merge(right)
 
 
 def coll_sets_from_columns(columns: list):
     """
     Returned
     """
-    coll_sets = [col.coll_sets if hasattr(col, "coll_sets") else set() for col in columns]
+    coll_sets = [col.coll_sets if hasattr(col, "coll_sets") else CollusionRecord() for col in columns]
     return functools.reduce(lambda set_a, set_b: merge_coll_sets(set_a, set_b), coll_sets)
 
 
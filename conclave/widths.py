@@ -0,0 +1,217 @@
+"""
+Bit-width inference for the values of columns in DAGs.
+
+The width of a column is an upper bound on the number of bits needed to hold any of
+its values as an unsigned integer. Widths are seeded from the value ranges and row
+counts in the statistics attached to Create nodes and propagated through operators,
+widening them where values can grow, e.g. in sums and products. Columns that cannot
+be bounded, such as columns with negative or non-integer values, get no width and
+code generators fall back to their default data type for them.
+"""
+import conclave.dag as saldag
+from conclave import rel
+
+# widths of the unsigned integer types available to code generators, narrowest first
+UINT_WIDTHS = [8, 16, 32, 64]
+# width assumed for columns that cannot be bounded
+DEFAULT_WIDTH = 32
+
+
+def _bits(value):
+    """ Bits needed to hold value, None if it is not a non-negative integer. """
+
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        return None
+    return max(value.bit_length(), 1)
+
+
+def _add(*widths):
+
+    return None if None in widths else sum(widths)
+
+
+def _widths_by_name(node: saldag.OpNode):
+
+    widths = {}
+    for col in node.out_rel.columns:
+        widths.setdefault(col.name, col.bit_width)
+    return widths
+
+
+def _carry(node: saldag.OpNode, parent: saldag.OpNode, changed: dict = None):
+    """ Widths of node's output columns, taking over parent column widths by name. """
+
+    in_widths = _widths_by_name(parent)
+    if changed:
+        in_widths.update(changed)
+    return [in_widths.get(col.name) for col in node.out_rel.columns]
+
+
+def _operand_width(operand, in_widths: dict):
+
+    if isinstance(operand, rel.Column):
+        return in_widths.get(operand.name)
+    return _bits(operand)
+
+
+def _infer_create(node: saldag.Create, rows: dict):
+
+    # value ranges in statistics hold for every row, see stats.ColumnStats
+    if node.stats is None:
+        # keep widths inferred for the relation this input was cut from
+        return None, [col.bit_width for col in node.out_rel.columns]
+    widths = []
+    for col in node.out_rel.columns:
+        col_stats = node.stats.column(col.name)
+        if col_stats.min_val is not None and _bits(col_stats.min_val) is not None:
+            widths.append(_bits(col_stats.max_val))
+        else:
+            widths.append(col.bit_width)
+    return node.stats.row_count, widths
+
+
+def _infer_unary(node: saldag.UnaryOpNode, rows: dict):
+
+    return rows[node.parent], _carry(node, node.parent)
+
+
+def _infer_multiply(node: saldag.Multiply, rows: dict):
+
+    in_widths = _widths_by_name(node.parent)
+    # a product has at most as many bits as its factors together
+    width = _add(*[_operand_width(operand, in_widths) for operand in node.operands])
+    return rows[node.parent], _carry(node, node.parent, {node.target_col.name: width})
+
+
+def _infer_divide(node: saldag.Divide, rows: dict):
+
+    in_widths = _widths_by_name(node.parent)
+    width = _operand_width(node.operands[0], in_widths)
+    # integer division by positive values never grows the dividend
+    for operand in node.operands[1:]:
+        if not isinstance(operand, rel.Column) and _bits(operand) is None:
+            width = None
+    return rows[node.parent], _carry(node, node.parent, {node.target_col.name: width})
+
+
+def _infer_index(node: saldag.Index, rows: dict):
+
+    row_count = rows[node.parent]
+    width = None if row_count is None else _bits(max(row_count - 1, 0))
+    return row_count, _carry(node, node.parent, {node.idx_col_name: width})
+
+
+def _infer_comp_neighs(node: saldag.CompNeighs, rows: dict):
+
+    return rows[node.parent], _carry(node, node.parent, {node.comp_col.name: 1})
+
+
+def _infer_aggregate(node: saldag.Aggregate, rows: dict):
+
+    row_count = rows[node.parent]
+    in_widths = _widths_by_name(node.parent)
+    agg_width = in_widths.get(node.agg_col.name)
+    row_bits = None if row_count is None else _bits(row_count)
+    if node.aggregator in {"+", "sum"}:
+        # a sum of n values has at most as many bits as n and its widest value together
+        width = _add(agg_width, row_bits)
+    elif node.aggregator == "count":
+        width = row_bits
+    elif node.aggregator in {"min", "max", "mean", "avg"}:
+        width = agg_width
+    else:
+        width = None
+    group_names = set(col.name for col in node.group_cols)
+    widths = [in_widths.get(col.name) if col.name in group_names else width for col in node.out_rel.columns]
+    return row_count, widths
+
+
+def _infer_concat(node: saldag.Concat, rows: dict):
+
+    row_counts = [rows[parent] for parent in node.ordered]
+    row_count = None if None in row_counts else sum(row_counts)
+    widths = []
+    # concat matches columns by position, output names may differ from input names
+    for idx in range(len(node.out_rel.columns)):
+        col_widths = [parent.out_rel.columns[idx].bit_width for parent in node.ordered]
+        widths.append(None if None in col_widths else max(col_widths))
+    return row_count, widths
+
+
+def _infer_join(node: saldag.Join, rows: dict):
+
+    left_rows, right_rows = rows[node.left_parent], rows[node.right_parent]
+    row_count = None if left_rows is None or right_rows is None else left_rows * right_rows
+    # output columns are the key columns, then the other left and right columns, by position,
+    # since left and right columns may share names
+    left_cols, right_cols = node.left_parent.out_rel.columns, node.right_parent.out_rel.columns
+    left_keys = [col.idx for col in node.left_join_cols]
+    right_keys = [col.idx for col in node.right_join_cols]
+    widths = []
+    for left_idx, right_idx in zip(left_keys, right_keys):
+        key_widths = [left_cols[left_idx].bit_width, right_cols[right_idx].bit_width]
+        widths.append(None if None in key_widths else max(key_widths))
+    widths += [col.bit_width for idx, col in enumerate(left_cols) if idx not in left_keys]
+    widths += [col.bit_width for idx, col in enumerate(right_cols) if idx not in right_keys]
+    return row_count, widths
+
+
+def _infer_unknown(node: saldag.OpNode, rows: dict):
+
+    return None, [None for _ in node.out_rel.columns]
+
+
+# inference function per node type, looked up along the class hierarchy
+_inferrers = {
+    saldag.Create: _infer_create,
+    saldag.UnaryOpNode: _infer_unary,
+    saldag.Multiply: _infer_multiply,
+    saldag.Divide: _infer_divide,
+    saldag.Index: _infer_index,
+    saldag.CompNeighs: _infer_comp_neighs,
+    saldag.Aggregate: _infer_aggregate,
+    saldag.Concat: _infer_concat,
+    saldag.Join: _infer_join,
+}
+
+
+def _inferrer(node: saldag.OpNode):
+
+    for klass in type(node).__mro__:
+        if klass in _inferrers:
+            return _inferrers[klass]
+    return _infer_unknown
+
+
+def infer_widths(dag: saldag.Dag):
+    """
+    Set bit_width on the output columns of every node of dag, in topological order.
+    Returns dict mapping every node to an upper bound on its number of output rows,
+    or None if there is none.
+    """
+
+    rows = {}
+    for node in dag.top_sort():
+        rows[node], widths = _inferrer(node)(node, rows)
+        for col, width in zip(node.out_rel.columns, widths):
+            col.bit_width = width
+    return rows
+
+
+def uint_width(width: [int, None]):
+    """
+    Width of the narrowest unsigned integer type that holds values of width bits, of
+    the type for DEFAULT_WIDTH if width is None. Wider values get the widest type.
+    """
+
+    width = DEFAULT_WIDTH if width is None else width
+    for type_width in UINT_WIDTHS:
+        if width <= type_width:
+            return type_width
+    return UINT_WIDTHS[-1]
+
+
+def uint_type(width: [int, None]):
+    """ Name of the narrowest unsigned integer type that holds values of width bits. """
+
+    return "uint{}".format(uint_width(width))
@@ -0,0 +1,70 @@
+"""
+Measures construction time, memory use and rewrite time for a large generated
+protocol. Usage: python protocol_size.py [num_ops] [num_cols]
+"""
+import sys
+import time
+import tracemalloc
+
+import conclave.lang as sal
+from conclave.comp import rewrite_dag
+from conclave.dag import OpDag
+from conclave.utils import *
+
+
+def protocol(num_ops: int, num_cols: int):
+    """
+    Each of three parties runs a chain of local multiplies and projections over a
+    wide relation, then the chains are concatenated and aggregated under MPC.
+    """
+
+    col_names = ["c{}".format(i) for i in range(num_cols)]
+    per_party = num_ops // 3
+    inputs = set()
+    chains = []
+    for pid in [1, 2, 3]:
+        cols = [defCol(name, "INTEGER", [pid]) for name in col_names]
+        node = sal.create("in_{}".format(pid), cols, {pid})
+        inputs.add(node)
+        for i in range(per_party):
+            target = col_names[i % num_cols]
+            if i % 2:
+                node = sal.multiply(node, "mult_{}_{}".format(pid, i), target, [target, col_names[-1]])
+            else:
+                node = sal.project(node, "proj_{}_{}".format(pid, i), list(reversed(col_names)))
+        chains.append(sal.project(node, "out_{}".format(pid), col_names[:2]))
+    rel = sal.concat(chains, "rel")
+    agg = sal.aggregate(rel, "agg", [col_names[0]], col_names[1], "+", "total")
+    sal.collect(agg, 1)
+
+    return inputs
+
+
+def main():
+
+    num_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_cols = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    start = time.time()
+    OpDag(protocol(num_ops, num_cols))
+    construct_time = time.time() - start
+
+    # build again with allocation tracing on, which slows construction down
+    tracemalloc.start()
+    dag = OpDag(protocol(num_ops, num_cols))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_nodes = len(dag.get_all_nodes())
+
+    start = time.time()
+    rewrite_dag(dag)
+    rewrite_time = time.time() - start
+
+    print("nodes: {}, columns: {}".format(num_nodes, num_cols))
+    print("construction: {:.2f}s, rewrite: {:.2f}s".format(construct_time, rewrite_time))
+    print("memory: {:.1f} MB ({:.1f} MB peak), {:.0f} bytes per node".format(
+        current / 2 ** 20, peak / 2 ** 20, current / num_nodes))
+
+
+if __name__ == "__main__":
+    main()
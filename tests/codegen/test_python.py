@@ -2,9 +2,24 @@ from unittest import TestCase
 import conclave.lang as sal
 from conclave.codegen.python import PythonCodeGen
 from conclave import CodeGenConfig
+from conclave.config import PythonConfig
 from conclave.utils import *
 from conclave.comp import dag_only
 import os
+import pystache
+
+
+# start of the code that differs between jobs, everything before it is the runtime
+MAIN = 'if __name__ == "__main__":'
+
+
+def render_runtime(cg: PythonCodeGen):
+    """ Renders the operator runtime that precedes the job's code in every generated job. """
+
+    template_name = "top_level_numpy" if cg.py_config.use_numpy else "top_level"
+    with open("{}/{}.tmpl".format(cg.template_directory, template_name), 'r') as f:
+        template = f.read()
+    return pystache.render(template[:template.index(MAIN)], {'MEMORY_BUDGET': str(cg.py_config.memory_budget)})
 
 
 def setup():
@@ -24,14 +39,20 @@ def setup():
 
 class TestPython(TestCase):
 
-    def check_workflow(self, dag, name: str):
+    def check_workflow(self, dag, name: str, py_cfg: [PythonConfig, None] = None):
         expected_rootdir = \
             "{}/python_expected".format(os.path.dirname(os.path.realpath(__file__)))
 
         cfg = CodeGenConfig('cfg')
+        if py_cfg is not None:
+            cfg.with_python_config(py_cfg)
         cg = PythonCodeGen(cfg, dag)
 
         actual = cg._generate('code', '/tmp')[1]
+        # expected files only hold the job's code, the runtime is run by test_python_run
+        runtime = render_runtime(cg)
+        self.assertEqual(runtime, actual[:len(runtime)])
+        actual = actual[len(runtime):]
 
         with open(expected_rootdir + '/{}'.format(name), 'r') as f:
             expected = f.read()
@@ -53,6 +74,21 @@ class TestPython(TestCase):
         dag = protocol()
         self.check_workflow(dag, 'agg')
 
+    def test_agg_spill(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1 = inpts[0]
+
+            agg = sal.aggregate(in_1, "agg", ["b", "a", "d"], "c", "max", "agg_1")
+            out = sal.collect(agg, 1)
+
+            return set([in_1])
+
+        dag = protocol()
+        self.check_workflow(dag, 'agg_spill', PythonConfig(chunk_size=1 << 20, memory_budget=1 << 26))
+
     def test_multiply(self):
 
         @dag_only
@@ -68,6 +104,74 @@ class TestPython(TestCase):
         dag = protocol()
         self.check_workflow(dag, 'multiply')
 
+    def test_divide(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1 = inpts[0]
+
+            div = sal.divide(in_1, "div", "e", ["a", "b", 2])
+            out = sal.collect(div, 1)
+
+            return set([in_1])
+
+        dag = protocol()
+        self.check_workflow(dag, 'divide')
+
+    def test_filter(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1 = inpts[0]
+
+            filt = sal.filter(in_1, "filt", "a", "<", "b")
+            out = sal.collect(filt, 1)
+
+            return set([in_1])
+
+        dag = protocol()
+        self.check_workflow(dag, 'filter')
+
+    def test_fused_chain(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1 = inpts[0]
+
+            mult = sal.multiply(in_1, "mult", "e", ["a", "b"])
+            filt = sal.filter(mult, "filt", "e", ">", "c")
+            div = sal.divide(filt, "div", "a", ["a", 3])
+            proj = sal.project(div, "proj", ["e", "a"])
+            agg = sal.aggregate(proj, "agg", ["e"], "a", "sum", "total")
+            out = sal.collect(agg, 1)
+
+            return set([in_1])
+
+        dag = protocol()
+        self.check_workflow(dag, 'fused_chain')
+
+    def test_fused_chain_numpy(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1 = inpts[0]
+
+            mult = sal.multiply(in_1, "mult", "e", ["a", "b"])
+            filt = sal.filter(mult, "filt", "e", ">", "c")
+            div = sal.divide(filt, "div", "a", ["a", 3])
+            proj = sal.project(div, "proj", ["e", "a"])
+            agg = sal.aggregate(proj, "agg", ["e"], "a", "sum", "total")
+            out = sal.collect(agg, 1)
+
+            return set([in_1])
+
+        dag = protocol()
+        self.check_workflow(dag, 'fused_chain_numpy', PythonConfig(use_numpy=True))
+
     def test_join(self):
 
         @dag_only
@@ -83,6 +187,22 @@ class TestPython(TestCase):
         dag = protocol()
         self.check_workflow(dag, 'join')
 
+    def test_join_spill(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1, in_2 = inpts[0], inpts[1]
+
+            proj = sal.project(in_1, "proj", ["a", "c"])
+            join = sal.join(proj, in_2, 'join', ['c', 'a'], ['b', 'a'])
+            out = sal.collect(join, 1)
+
+            return set([in_1, in_2])
+
+        dag = protocol()
+        self.check_workflow(dag, 'join_spill', PythonConfig(chunk_size=1 << 20, memory_budget=1 << 26))
+
     def test_project(self):
 
         @dag_only
@@ -113,6 +233,21 @@ class TestPython(TestCase):
         dag = protocol()
         self.check_workflow(dag, 'distinct')
 
+    def test_distinct_numpy(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1 = inpts[0]
+
+            dist = sal.distinct(in_1, "dist", ["a", "b"])
+            out = sal.collect(dist, 1)
+
+            return set([in_1])
+
+        dag = protocol()
+        self.check_workflow(dag, 'distinct_numpy', PythonConfig(use_numpy=True))
+
     def test_index(self):
 
         @dag_only
@@ -177,3 +312,40 @@ class TestPython(TestCase):
         self.check_workflow(dag, 'workflow_one')
 
 
+
+    def test_workflow_one_numpy(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1, in_2 = inpts[0], inpts[1]
+
+            mult = sal.multiply(in_1, "mult", "a", ["b", "c"])
+            proj_2 = sal.project(in_2, "proj_2", ["a", "b"])
+            join = sal.join(mult, proj_2, "join", ["a", "b"], ["a", "b"])
+            agg = sal.aggregate(join, "agg", ["a", "b"], "c", "sum", "agg_1")
+            out = sal.collect(agg, 1)
+
+            return set([in_1, in_2])
+
+        dag = protocol()
+        self.check_workflow(dag, 'workflow_one_numpy', PythonConfig(use_numpy=True))
+
+    def test_workflow_one_streamed(self):
+
+        @dag_only
+        def protocol():
+            inpts = setup()
+            in_1, in_2 = inpts[0], inpts[1]
+
+            mult = sal.multiply(in_1, "mult", "a", ["b", "c"])
+            proj_2 = sal.project(in_2, "proj_2", ["a", "b"])
+            filt = sal.filter(proj_2, "filt", "a", "=", 5)
+            join = sal.join(mult, filt, "join", ["a", "b"], ["a", "b"])
+            agg = sal.aggregate(join, "agg", ["a", "b"], "c", "sum", "agg_1")
+            out = sal.collect(agg, 1)
+
+            return set([in_1, in_2])
+
+        dag = protocol()
+        self.check_workflow(dag, 'workflow_one_streamed', PythonConfig(chunk_size=1 << 20))
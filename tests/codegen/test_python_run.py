@@ -0,0 +1,182 @@
+from unittest import TestCase
+import conclave.lang as sal
+from conclave.codegen.python import PythonCodeGen
+from conclave import CodeGenConfig
+from conclave.config import PythonConfig
+from conclave.utils import *
+from conclave.comp import dag_only
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+
+# runtime configurations that must all compute the same relations
+CONFIGS = {
+    "list": PythonConfig(),
+    "list_unfused": PythonConfig(fuse_ops=False),
+    "numpy": PythonConfig(use_numpy=True),
+    "numpy_unfused": PythonConfig(use_numpy=True, fuse_ops=False),
+    "streamed": PythonConfig(chunk_size=97),
+    "streamed_numpy": PythonConfig(use_numpy=True, chunk_size=97),
+    "spilled": PythonConfig(chunk_size=97, memory_budget=3000),
+    "spilled_numpy": PythonConfig(use_numpy=True, chunk_size=97, memory_budget=3000),
+    "spilled_in_memory": PythonConfig(memory_budget=1)
+}
+
+
+def setup():
+
+    cols = [
+        defCol("a", "INTEGER", [1]),
+        defCol("b", "INTEGER", [1]),
+        defCol("c", "INTEGER", [1]),
+        defCol("d", "INTEGER", [1])
+    ]
+
+    in_1 = sal.create("in_1", cols, set([1]))
+    in_2 = sal.create("in_2", cols, set([1]))
+
+    return [in_1, in_2]
+
+
+def write_input(path: str, rows: list):
+
+    with open(path, "w") as f:
+        f.write('"a","b","c","d"\n')
+        for row in rows:
+            f.write(",".join(str(val) for val in row) + "\n")
+
+
+def read_output(path: str):
+
+    with open(path, "r") as f:
+        header = f.readline()
+        return header, sorted([int(val) for val in line.split(",")] for line in f if line.strip())
+
+
+class TestPythonRun(TestCase):
+    """ Runs generated Python jobs on small inputs in every runtime configuration. """
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        rand = random.Random(0)
+        self.inputs = {
+            name: [[rand.randint(0, 9) for _ in range(4)] for _ in range(300)] for name in ["in_1", "in_2"]
+        }
+
+    def run_job(self, protocol, name: str, py_cfg: PythonConfig):
+
+        root = "{}/{}".format(self.tmp.name, name)
+        os.makedirs(root + "/in")
+        os.makedirs(root + "/out")
+        for rel, rows in self.inputs.items():
+            write_input("{}/in/{}.csv".format(root, rel), rows)
+        cfg = CodeGenConfig(name).with_python_config(py_cfg)
+        cfg.code_path = root + "/code"
+        cfg.input_path = root + "/in"
+        cfg.output_path = root + "/out"
+        PythonCodeGen(cfg, protocol()).generate(name, cfg.output_path)
+
+        proc = subprocess.run(
+            [sys.executable, "{}/{}/workflow.py".format(cfg.code_path, name)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        return {rel: read_output("{}/{}".format(cfg.output_path, rel)) for rel in sorted(os.listdir(cfg.output_path))}
+
+    def check_configs(self, protocol, name: str):
+        """ Runs the workflow in every configuration, returning the outputs they agree on. """
+
+        expected = self.run_job(dag_only(protocol), name + "_list", CONFIGS["list"])
+        self.assertTrue(expected)
+        for config_name, py_cfg in CONFIGS.items():
+            if config_name == "list":
+                continue
+            with self.subTest(config=config_name):
+                actual = self.run_job(dag_only(protocol), "{}_{}".format(name, config_name), py_cfg)
+                self.assertEqual(expected, actual)
+        return expected
+
+    def test_aggregate(self):
+
+        aggregators = ["sum", "count", "min", "max", "mean"]
+
+        def protocol():
+            in_1 = setup()[0]
+            for aggregator in aggregators:
+                agg = sal.aggregate(in_1, "agg_" + aggregator, ["a", "b"], "c", aggregator, "v")
+                sal.collect(agg, 1)
+            return set([in_1])
+
+        outputs = self.check_configs(protocol, "aggregate")
+        groups = {}
+        for row in self.inputs["in_1"]:
+            groups.setdefault((row[0], row[1]), []).append(row[2])
+        reference = {
+            "sum": sum, "count": len, "min": min, "max": max, "mean": lambda vals: sum(vals) // len(vals)
+        }
+        for aggregator in aggregators:
+            header, rows = outputs["agg_{}.csv".format(aggregator)]
+            self.assertEqual(header, '"a","b","v"\n')
+            self.assertEqual(rows, sorted([a, b, reference[aggregator](vals)] for (a, b), vals in groups.items()))
+
+    def test_join(self):
+
+        def protocol():
+            in_1, in_2 = setup()
+            composite = sal.join(in_1, in_2, "composite", ["a", "b"], ["b", "a"])
+            sal.collect(composite, 1)
+            proj = sal.project(in_1, "proj", ["c", "a"])
+            filt = sal.filter(in_2, "filt", "d", "<", 5)
+            joined = sal.join(proj, filt, "joined", ["c"], ["a"])
+            agg = sal.aggregate(joined, "agg", ["c", "b"], "d", "count", "v")
+            sal.collect(agg, 1)
+            return set([in_1, in_2])
+
+        outputs = self.check_configs(protocol, "join")
+        expected = sorted(
+            [l[0], l[1], l[2], l[3], r[2], r[3]]
+            for l in self.inputs["in_1"] for r in self.inputs["in_2"] if (l[0], l[1]) == (r[1], r[0]))
+        self.assertEqual(outputs["composite.csv"][1], expected)
+
+    def test_chain(self):
+
+        def protocol():
+            in_1, in_2 = setup()
+            mult = sal.multiply(in_1, "mult", "e", ["a", "b"])
+            filt = sal.filter(mult, "filt", "e", ">", "c")
+            div = sal.divide(filt, "div", "a", ["a", 3])
+            proj = sal.project(div, "proj", ["e", "a"])
+            agg = sal.aggregate(proj, "agg", ["e"], "a", "sum", "total")
+            sal.collect(agg, 1)
+            distinct = sal.distinct(in_2, "distinct", ["b"])
+            sal.collect(distinct, 1)
+            return set([in_1, in_2])
+
+        outputs = self.check_configs(protocol, "chain")
+        groups = {}
+        for a, b, c, d in self.inputs["in_1"]:
+            if a * b > c:
+                groups[a * b] = groups.get(a * b, 0) + a // 3
+        self.assertEqual(outputs["agg.csv"][1], sorted([key, val] for key, val in groups.items()))
+        self.assertEqual(outputs["distinct.csv"][1], sorted([val] for val in set(row[1] for row in self.inputs["in_2"])))
+
+    def test_empty_inputs(self):
+
+        self.inputs = {"in_1": [], "in_2": []}
+
+        def protocol():
+            in_1, in_2 = setup()
+            agg = sal.aggregate(in_1, "agg", ["a", "b"], "c", "max", "v")
+            sal.collect(agg, 1)
+            mult = sal.multiply(in_2, "mult", "e", ["a", 2])
+            joined = sal.join(mult, in_1, "joined", ["a", "b"], ["a", "b"])
+            sal.collect(joined, 1)
+            return set([in_1, in_2])
+
+        outputs = self.check_configs(protocol, "empty")
+        self.assertEqual(outputs["agg.csv"], ('"a","b","v"\n', []))
+        self.assertEqual(outputs["joined.csv"][1], [])
@@ -3,8 +3,11 @@ import conclave.lang as sal
 from conclave.codegen.sharemind import SharemindCodeGen
 from conclave.utils import *
 from conclave.comp import dag_only
+from conclave.stats import ColumnStats, RelationStats
+import conclave.widths as widths
 from conclave.config import CodeGenConfig, SharemindCodeGenConfig
 import os
+import re
 
 
 def setup():
@@ -144,6 +147,66 @@ class TestSharemind(TestCase):
         dag = protocol()
         self.check_workflow(dag, 'agg')
 
+    def test_agg_keep_flags(self):
+
+        @dag_only
+        def protocol():
+            inputs, rel = setup()
+            agg = sal.aggregate(rel, "agg", ["a", "b"], "c", "sum", "agg_1")
+
+            out = sal._open(agg, "opened", 1)
+
+            return inputs
+
+        cfg = CodeGenConfig('cfg').with_sharemind_config(SharemindCodeGenConfig())
+        miner = SharemindCodeGen(cfg, protocol(), 1)._generate('code', '/tmp')[1]['miner']
+        self.assertIn("aggregateSum(rel, (uint){0,1}, (uint)2)", miner)
+
+        # only the flags marking the last row of each group may be revealed, which
+        # follow the key columns and the aggregate, whatever the number of keys
+        body = miner[miner.index("aggregateGroups("):]
+        body = body[:body.index("\n}\n")]
+        flag_col = re.search(r"result\[:,(\w+)\] = lasts;", body).group(1)
+        self.assertEqual("ncols", flag_col)
+        self.assertIn("ncols = nkeys + 1;", body)
+        self.assertIn("keepFlags = declassify(shuffled[:,{}]);".format(flag_col), body)
+
+    def test_agg_max(self):
+
+        @dag_only
+        def protocol():
+            inputs, rel = setup()
+            agg = sal.aggregate(rel, "agg", ["a"], "c", "max", "agg_1")
+
+            out = sal._open(agg, "opened", 1)
+
+            return inputs
+
+        dag = protocol()
+        self.check_workflow(dag, 'agg_max')
+
+    def test_agg_widths(self):
+
+        @dag_only
+        def protocol():
+            # three inputs of 100 rows with 4-bit values fit in uint8, their sums need uint16
+            in_stats = RelationStats(100, {name: ColumnStats(16, 0, 15) for name in ["a", "b", "c", "d"]})
+            closed = []
+            for pid in [1, 2, 3]:
+                cols_in = [defCol(name, "INTEGER", [pid]) for name in ["a", "b", "c", "d"]]
+                in_rel = sal.create("in{}".format(pid), cols_in, set([pid]), in_stats)
+                closed.append(sal._close(in_rel, "cl{}".format(pid), set([1, 2, 3])))
+            rel = sal.concat(closed, "rel")
+            agg = sal.aggregate(rel, "agg", ["a"], "c", "sum", "agg_1")
+
+            out = sal._open(agg, "opened", 1)
+
+            return set(cl.parent for cl in closed)
+
+        dag = protocol()
+        widths.infer_widths(dag)
+        self.check_workflow(dag, 'agg_widths')
+
     def test_shuffle(self):
 
         @dag_only
@@ -184,3 +247,31 @@ class TestSharemind(TestCase):
         dag = protocol()
         self.check_workflow(dag, 'join')
 
+    def test_join_composite(self):
+
+        @dag_only
+        def protocol():
+            colsIn1 = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1]),
+                defCol("c", "INTEGER", [1])
+            ]
+            in1 = sal.create("in1", colsIn1, set([1]))
+            colsIn2 = [
+                defCol("a", "INTEGER", [2]),
+                defCol("b", "INTEGER", [2]),
+                defCol("c", "INTEGER", [2])
+            ]
+            in2 = sal.create("in2", colsIn2, set([2]))
+
+            cl1 = sal._close(in1, "cl1", set([1, 2, 3]))
+            cl2 = sal._close(in2, "cl2", set([1, 2, 3]))
+            res = sal.join(cl1, cl2, "res", ["a", "b"], ["a", "b"])
+
+            opened = sal._open(res, "opened", 1)
+
+            return set([in1, in2])
+
+        dag = protocol()
+        self.check_workflow(dag, 'join_composite')
+
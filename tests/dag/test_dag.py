@@ -0,0 +1,168 @@
+from unittest import TestCase
+import conclave.dag as saldag
+import conclave.lang as sal
+from conclave.comp import DagRewriter, dag_only
+from conclave.utils import *
+
+
+def setup():
+
+    cols = [
+        defCol("a", "INTEGER", [1]),
+        defCol("b", "INTEGER", [1]),
+        defCol("c", "INTEGER", [1])
+    ]
+
+    in_1 = sal.create("in_1", cols, set([1]))
+    in_2 = sal.create("in_2", cols, set([1]))
+
+    return [in_1, in_2]
+
+
+class TestTopSort(TestCase):
+
+    def setUp(self):
+
+        @dag_only
+        def protocol():
+            in_1, in_2 = setup()
+            self.proj_1 = sal.project(in_1, "proj_1", ["a", "b"])
+            self.agg = sal.aggregate(self.proj_1, "agg", ["a"], "b", "sum", "total")
+            self.proj_2 = sal.project(in_2, "proj_2", ["a", "c"])
+            self.in_1, self.in_2 = in_1, in_2
+            return set([in_1, in_2])
+
+        self.dag = protocol()
+
+    def assertFresh(self):
+        """ Checks the possibly cached order against one computed from scratch. """
+
+        ordered = self.dag.top_sort()
+        self.assertEqual(saldag.OpDag(set(self.dag.roots)).top_sort(), ordered)
+        return ordered
+
+    def test_cached(self):
+
+        ordered = self.dag.top_sort()
+        cache = self.dag._top_sort_cache
+        again = self.dag.top_sort()
+        self.assertEqual(ordered, again)
+        self.assertIs(cache, self.dag._top_sort_cache)
+        # callers get their own copy
+        again.pop()
+        self.assertEqual(ordered, self.dag.top_sort())
+
+    def test_replace_parent(self):
+
+        self.assertFresh()
+        self.agg.replace_parent(self.proj_1, self.proj_2)
+        self.proj_1.children.remove(self.agg)
+        self.proj_2.children.add(self.agg)
+        ordered = self.assertFresh()
+        self.assertLess(ordered.index(self.proj_2), ordered.index(self.agg))
+
+    def test_child_edits(self):
+
+        self.assertFresh()
+        other = self.proj_1.clone()
+        other.out_rel.rename("aaa")
+        saldag.insert_between(self.in_1, self.proj_1, other)
+        ordered = self.assertFresh()
+        self.assertLess(ordered.index(other), ordered.index(self.proj_1))
+        self.in_2.children.clear()
+        self.assertNotIn(self.proj_2, self.assertFresh())
+
+    def test_rename(self):
+
+        before = self.assertFresh()
+        self.in_2.out_rel.rename("in_0")
+        self.proj_1.out_rel.name = "zzz"
+        after = self.assertFresh()
+        self.assertNotEqual(before, after)
+
+    def test_roots(self):
+
+        self.assertFresh()
+        self.dag.roots.remove(self.in_2)
+        self.assertEqual([self.in_1, self.proj_1, self.agg], self.assertFresh())
+
+
+class TestClone(TestCase):
+
+    def test_clone_independent(self):
+
+        in_1 = setup()[0]
+        agg = sal.aggregate(in_1, "agg", ["a", "b"], "c", "sum", "total")
+        clone = agg.clone()
+
+        self.assertEqual(set(), clone.children)
+        self.assertEqual(set(), clone.parents)
+        self.assertEqual(set([in_1]), agg.parents)
+        self.assertIsNot(agg.out_rel, clone.out_rel)
+        for col, cloned_col in zip(agg.out_rel.columns, clone.out_rel.columns):
+            self.assertIsNot(col, cloned_col)
+
+        clone.out_rel.rename("other")
+        clone.out_rel.columns[0].name = "x"
+        clone.out_rel.stored_with.add(2)
+        clone.group_cols.pop()
+        self.assertEqual("agg", agg.out_rel.name)
+        self.assertEqual("agg", agg.out_rel.columns[0].rel_name)
+        self.assertEqual("a", agg.out_rel.columns[0].name)
+        self.assertEqual(set([1]), agg.out_rel.stored_with)
+        self.assertEqual(2, len(agg.group_cols))
+
+
+class TestRewriteDispatch(TestCase):
+
+    def test_mro_lookup(self):
+
+        class JoinRewriter(DagRewriter):
+
+            def _rewrite_join(self, node):
+                pass
+
+        class SortRewriter(JoinRewriter):
+
+            def _rewrite_sort_by(self, node):
+                pass
+
+        SortRewriter.register(saldag.SortBy, "_rewrite_sort_by")
+        rewriter = JoinRewriter()
+        # subclasses without their own method use the closest registered base class
+        self.assertEqual(rewriter._rewrite_join, rewriter._get_handler(saldag.Join))
+        self.assertEqual(rewriter._rewrite_join, rewriter._get_handler(saldag.HybridJoin))
+        self.assertEqual(rewriter._rewrite_join, rewriter._get_handler(saldag.RevealJoin))
+        self.assertEqual(rewriter._rewrite_unknown, rewriter._get_handler(saldag.Aggregate))
+        # registrations only apply to the registering class and its subclasses
+        self.assertEqual(rewriter._rewrite_unknown, rewriter._get_handler(saldag.SortBy))
+        self.assertNotIn(saldag.SortBy, DagRewriter.rewrite_methods)
+        sort_rewriter = SortRewriter()
+        self.assertEqual(sort_rewriter._rewrite_sort_by, sort_rewriter._get_handler(saldag.SortBy))
+        self.assertEqual(sort_rewriter._rewrite_join, sort_rewriter._get_handler(saldag.HybridJoin))
+
+
+class TestFindColumn(TestCase):
+
+    def test_renamed_column(self):
+
+        rel = setup()[0].out_rel
+        col_a = rel.find_column("a")
+        self.assertIs(rel.columns[0], col_a)
+        col_a.name = "x"
+        self.assertIsNone(rel.find_column("a"))
+        self.assertIs(col_a, rel.find_column("x"))
+        # the first column of a name wins, as with utils.find
+        rel.columns[2].name = "b"
+        self.assertIs(rel.columns[1], rel.find_column("b"))
+        rel.columns[1].name = "y"
+        self.assertIs(rel.columns[2], rel.find_column("b"))
+
+    def test_replaced_columns(self):
+
+        rel = setup()[0].out_rel
+        self.assertIsNotNone(rel.find_column("c"))
+        rel.columns.pop()
+        self.assertIsNone(rel.find_column("c"))
+        rel.columns = [col.clone() for col in reversed(rel.columns)]
+        self.assertIs(rel.columns[0], rel.find_column("b"))
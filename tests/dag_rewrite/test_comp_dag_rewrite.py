@@ -1,10 +1,59 @@
 from unittest import TestCase
 import conclave.lang as sal
-from conclave.comp import mpc, scotch
+import conclave.dag as saldag
+from conclave.comp import mpc, scotch, dag_only
+from conclave.rel import Column
 from conclave.utils import *
 import os
 
 
+def evaluate(dag, inputs: dict):
+    """
+    Reference evaluation of dag on inputs, a dict mapping input relation names to lists
+    of rows. Returns the sorted rows of each leaf in the order of leaf relation names.
+    """
+
+    aggregators = {"+": sum, "sum": sum, "count": len, "min": min, "max": max}
+
+    def _value(operand, row):
+        return row[operand.idx] if isinstance(operand, Column) else operand
+
+    results = {}
+    for node in dag.top_sort():
+        if isinstance(node, saldag.Create):
+            rows = inputs[node.out_rel.name]
+        elif isinstance(node, saldag.Concat):
+            rows = [row for parent in node.ordered for row in results[parent]]
+        elif isinstance(node, saldag.Aggregate):
+            groups = {}
+            for row in results[node.parent]:
+                key = tuple(row[col.idx] for col in node.group_cols)
+                groups.setdefault(key, []).append(row[node.agg_col.idx])
+            rows = [list(key) + [aggregators[node.aggregator](vals)] for key, vals in groups.items()]
+        elif isinstance(node, (saldag.Multiply, saldag.Divide)):
+            rows = []
+            for row in results[node.parent]:
+                value = _value(node.operands[0], row)
+                for operand in node.operands[1:]:
+                    if isinstance(node, saldag.Multiply):
+                        value *= _value(operand, row)
+                    else:
+                        # integer division, as in the code generators
+                        value //= _value(operand, row)
+                out_row = list(row) + [None] * (len(node.out_rel.columns) - len(row))
+                out_row[node.target_col.idx] = value
+                rows.append(out_row)
+        elif isinstance(node, saldag.Project):
+            rows = [[row[col.idx] for col in node.selected_cols] for row in results[node.parent]]
+        else:
+            # opening, closing and storing relations leaves their rows unchanged
+            rows = results[next(iter(node.parents))]
+        results[node] = rows
+
+    leaves = sorted([node for node in results if not node.children], key=lambda node: node.out_rel.name)
+    return [sorted(results[leaf]) for leaf in leaves]
+
+
 class TestConclave(TestCase):
 
     def check_workflow(self, code, name):
@@ -260,3 +309,218 @@ class TestConclave(TestCase):
         actual = protocol()
         self.check_workflow(actual, 'agg_pushdown')
 
+
+    def test_dead_columns(self):
+
+        @scotch
+        @mpc
+        def protocol():
+
+            # define inputs
+            cols_in_1 = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1]),
+                defCol("c", "INTEGER", [1]),
+                defCol("d", "INTEGER", [1])
+            ]
+            in_1 = sal.create("in_1", cols_in_1, set([1]))
+            cols_in_2 = [
+                defCol("a", "INTEGER", [2]),
+                defCol("b", "INTEGER", [2]),
+                defCol("c", "INTEGER", [2]),
+                defCol("d", "INTEGER", [2])
+            ]
+            in_2 = sal.create("in_2", cols_in_2, set([2]))
+
+            # combine parties' inputs into one relation
+            rel = sal.concat([in_1, in_2], "rel")
+
+            # only a and c are used, so b and d are dropped before the concat
+            mult = sal.multiply(rel, "mult", "c", ["c", 2])
+            proj = sal.project(mult, "proj", ["a", "c"])
+            agg = sal.aggregate(proj, "agg", ["a"], "c", "+", "total")
+
+            sal.collect(agg, 1)
+
+            # return root nodes
+            return set([in_1, in_2])
+
+        actual = protocol()
+        self.check_workflow(actual, 'dead_columns')
+
+    def test_filter_pushdown(self):
+
+        @scotch
+        @mpc
+        def protocol():
+
+            # define inputs
+            cols_in_1 = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1])
+            ]
+            in_1 = sal.create("in_1", cols_in_1, set([1]))
+            cols_in_2 = [
+                defCol("c", "INTEGER", [2]),
+                defCol("d", "INTEGER", [2])
+            ]
+            in_2 = sal.create("in_2", cols_in_2, set([2]))
+
+            joined = sal.join(in_1, in_2, "joined", ["a"], ["c"])
+
+            # b comes from in_1 only, the key column from both inputs
+            by_b = sal.filter(joined, "by_b", "b", ">", 5)
+            by_key = sal.filter(by_b, "by_key", "a", "==", 3)
+            agg = sal.aggregate(by_key, "agg", ["a"], "d", "+", "total")
+
+            sal.collect(agg, 1)
+
+            # return root nodes
+            return set([in_1, in_2])
+
+        actual = protocol()
+        self.check_workflow(actual, 'filter_pushdown')
+
+    def test_count_pushdown(self):
+
+        @scotch
+        @mpc
+        def protocol():
+
+            # define inputs
+            cols_in_1 = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1]),
+                defCol("c", "INTEGER", [1])
+            ]
+            in_1 = sal.create("in_1", cols_in_1, set([1]))
+            cols_in_2 = [
+                defCol("a", "INTEGER", [2]),
+                defCol("b", "INTEGER", [2]),
+                defCol("c", "INTEGER", [2])
+            ]
+            in_2 = sal.create("in_2", cols_in_2, set([2]))
+
+            # combine parties' inputs into one relation
+            rel = sal.concat([in_1, in_2], "rel")
+
+            # per-party counts are summed under MPC, the filter only reads group columns
+            agg = sal.aggregate(rel, "agg", ["c", "a"], "b", "count", "num")
+            filtered = sal.filter(agg, "filtered", "c", ">", 3)
+            total = sal.aggregate(filtered, "total", ["a"], "num", "+", "total_num")
+
+            sal.collect(total, 1)
+
+            # return root nodes
+            return set([in_1, in_2])
+
+        actual = protocol()
+        self.check_workflow(actual, 'count_pushdown')
+
+    def test_mean_pushdown(self):
+
+        @scotch
+        @mpc
+        def protocol():
+
+            # define inputs
+            cols_in_1 = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1])
+            ]
+            in_1 = sal.create("in_1", cols_in_1, set([1]))
+            cols_in_2 = [
+                defCol("a", "INTEGER", [2]),
+                defCol("b", "INTEGER", [2])
+            ]
+            in_2 = sal.create("in_2", cols_in_2, set([2]))
+
+            # combine parties' inputs into one relation
+            rel = sal.concat([in_1, in_2], "rel")
+
+            # mean is computed from per-party sums and counts
+            agg = sal.aggregate(rel, "agg", ["a"], "b", "mean", "mean_b")
+
+            sal.collect(agg, 1)
+
+            # return root nodes
+            return set([in_1, in_2])
+
+        actual = protocol()
+        self.check_workflow(actual, 'mean_pushdown')
+
+    def test_common_subexpressions(self):
+
+        @scotch
+        @mpc
+        def protocol():
+
+            # define inputs
+            cols_in_1 = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1])
+            ]
+            in_1 = sal.create("in_1", cols_in_1, set([1]))
+            cols_in_2 = [
+                defCol("a", "INTEGER", [2]),
+                defCol("b", "INTEGER", [2])
+            ]
+            in_2 = sal.create("in_2", cols_in_2, set([2]))
+
+            # combine parties' inputs into one relation
+            rel = sal.concat([in_1, in_2], "rel")
+
+            # both branches multiply b by 2 and are computed once
+            mult_sum = sal.multiply(rel, "mult_sum", "b", ["b", 2])
+            mult_max = sal.multiply(rel, "mult_max", "b", ["b", 2])
+            agg_sum = sal.aggregate(mult_sum, "agg_sum", ["a"], "b", "+", "total")
+            agg_max = sal.aggregate(mult_max, "agg_max", ["a"], "b", "max", "largest")
+            joined = sal.join(agg_sum, agg_max, "joined", ["a"], ["a"])
+
+            sal.collect(joined, 1)
+
+            # return root nodes
+            return set([in_1, in_2])
+
+        actual = protocol()
+        self.check_workflow(actual, 'common_subexpressions')
+
+    def check_same_result(self, protocol, inputs):
+        """ Rewriting the dag of protocol must not change the result of evaluating it. """
+
+        expected = evaluate(dag_only(protocol)(), inputs)
+        actual = evaluate(mpc(protocol)(), inputs)
+        self.assertEqual(expected, actual)
+
+    def test_agg_commute_arithmetic(self):
+
+        # keys 2 and 3 become equal after division, values of 1 sum to 2 but round to 0
+        inputs = {
+            "in_1": [[1, 1], [2, 5], [3, 7]],
+            "in_2": [[1, 1], [2, 4], [3, 6]]
+        }
+
+        def protocol(aggregator, arithmetic, col, scalar):
+
+            def _protocol():
+
+                in_1 = sal.create("in_1", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], set([1]))
+                in_2 = sal.create("in_2", [defCol("a", "INTEGER", [2]), defCol("b", "INTEGER", [2])], set([2]))
+                rel = sal.concat([in_1, in_2], "rel")
+                agg = sal.aggregate(rel, "agg", ["a"], "b", aggregator, "agg_b")
+                res = arithmetic(agg, "res", col, [col, scalar])
+                # leaves stay under MPC, so only non-leaf operators are pushed down
+                proj = sal.project(res, "proj", ["a", "agg_b"])
+                sal.collect(proj, 1)
+
+                return set([in_1, in_2])
+
+            return _protocol
+
+        for aggregator in ["+", "sum", "count", "min", "max"]:
+            for arithmetic in [sal.multiply, sal.divide]:
+                for col in ["a", "agg_b"]:
+                    for scalar in [2, 3]:
+                        with self.subTest(aggregator=aggregator, arithmetic=arithmetic.__name__, col=col,
+                                          scalar=scalar):
+                            self.check_same_result(protocol(aggregator, arithmetic, col, scalar), inputs)
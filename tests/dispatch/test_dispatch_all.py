@@ -0,0 +1,147 @@
+from unittest import TestCase
+import threading
+import time
+from conclave.config import CodeGenConfig, PythonConfig
+from conclave.dispatch import _run_jobs, _concurrency_limits
+from conclave.job import PythonJob, SharemindJob, SparkJob
+
+
+class StubDispatcher:
+    """ Records when jobs start and end, and how many run at the same time. """
+
+    def __init__(self, log: list, lock, duration: float = 0.05):
+
+        self.log = log
+        self.lock = lock
+        self.duration = duration
+        self.num_running = 0
+        self.max_running = 0
+
+    def prepare(self, job):
+
+        with self.lock:
+            if ("prepare", job.name) not in self.log:
+                self.log.append(("prepare", job.name))
+
+    def dispatch(self, job):
+
+        with self.lock:
+            self.log.append(("start", job.name))
+            self.num_running += 1
+            self.max_running = max(self.max_running, self.num_running)
+        time.sleep(self.duration)
+        with self.lock:
+            self.num_running -= 1
+            self.log.append(("end", job.name))
+
+
+def python_job(name: str, deps: [list, None] = None):
+
+    job = PythonJob(name, "/tmp")
+    job.deps = deps
+    return job
+
+
+def sharemind_job(name: str, deps: [list, None] = None):
+
+    job = SharemindJob(name, "/tmp", 1, [1], {1: []})
+    job.deps = deps
+    return job
+
+
+class TestDispatchAll(TestCase):
+
+    def setUp(self):
+
+        self.log = []
+        lock = threading.Lock()
+        self.python = StubDispatcher(self.log, lock)
+        self.sharemind = StubDispatcher(self.log, lock)
+        self.dispatchers = {PythonJob: self.python, SharemindJob: self.sharemind, SparkJob: None}
+
+    def run_jobs(self, job_queue: list, python_limit: int = 4, sharemind_limit: int = 1):
+
+        limits = {PythonJob: python_limit, SharemindJob: sharemind_limit, SparkJob: 1}
+        _run_jobs(self.dispatchers, limits, job_queue)
+
+    def assertBefore(self, first: tuple, second: tuple):
+
+        self.assertLess(self.log.index(first), self.log.index(second))
+
+    def test_deps_order(self):
+
+        self.run_jobs([
+            python_job("a", []),
+            python_job("b", []),
+            python_job("c", ["a", "b"]),
+            python_job("d", ["c"]),
+            python_job("e", ["a"])
+        ])
+        self.assertBefore(("end", "a"), ("start", "c"))
+        self.assertBefore(("end", "b"), ("start", "c"))
+        self.assertBefore(("end", "c"), ("start", "d"))
+        self.assertBefore(("end", "a"), ("start", "e"))
+        # independent jobs overlap
+        self.assertBefore(("start", "b"), ("end", "a"))
+        self.assertEqual(len(self.log), 10)
+
+    def test_default_deps(self):
+
+        # jobs without deps wait for every job before them
+        self.run_jobs([python_job("a"), python_job("b"), python_job("c")])
+        self.assertEqual(self.python.max_running, 1)
+        self.assertEqual(self.log, [
+            ("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")])
+
+    def test_concurrency_limit(self):
+
+        for limit in [1, 2, 3]:
+            with self.subTest(limit=limit):
+                self.python.max_running = 0
+                self.run_jobs([python_job(str(i), []) for i in range(6)], python_limit=limit)
+                self.assertEqual(self.python.max_running, limit)
+
+    def test_skipped_jobs(self):
+
+        skipped = python_job("a", [])
+        skipped.skip = True
+        self.run_jobs([skipped, python_job("b", ["a"]), python_job("c"), python_job("d", ["c"])])
+        self.assertNotIn(("start", "a"), self.log)
+        self.assertEqual([name for (event, name) in self.log if event == "start"], ["b", "c", "d"])
+
+    def test_never_run(self):
+
+        with self.assertRaisesRegex(Exception, "never run"):
+            self.run_jobs([python_job("a", []), python_job("b", ["missing"]), python_job("c", ["b"])])
+        self.assertEqual(self.log, [("start", "a"), ("end", "a")])
+
+    def test_sharemind_queue_order(self):
+
+        # sharemind jobs do not depend on each other's data, but start in queue order
+        self.run_jobs([
+            sharemind_job("s1", []),
+            sharemind_job("s2", []),
+            python_job("p", ["s1"]),
+            sharemind_job("s3", ["p"])
+        ], sharemind_limit=2)
+        starts = [name for (event, name) in self.log if event == "start" and name.startswith("s")]
+        self.assertEqual(starts, ["s1", "s2", "s3"])
+        self.assertBefore(("end", "s1"), ("start", "s2"))
+        # imports of a job start once its inputs exist, while earlier jobs still run
+        self.assertBefore(("prepare", "s2"), ("end", "s1"))
+        self.assertBefore(("end", "p"), ("prepare", "s3"))
+
+
+class TestConcurrencyLimits(TestCase):
+
+    def test_limits(self):
+
+        config = CodeGenConfig("limits") \
+            .with_max_concurrent_jobs("python", 4) \
+            .with_max_concurrent_jobs("sharemind", 3)
+        limits = _concurrency_limits(config, PythonConfig(dispatch_mode="process"))
+        self.assertEqual(limits, {SharemindJob: 1, SparkJob: 1, PythonJob: 4})
+        limits = _concurrency_limits(config, PythonConfig(dispatch_mode="pool", num_workers=2))
+        self.assertEqual(limits[PythonJob], 2)
+        limits = _concurrency_limits(config, PythonConfig(dispatch_mode="in_process"))
+        self.assertEqual(limits[PythonJob], 1)
@@ -0,0 +1,117 @@
+from unittest import TestCase
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from conclave.dispatch.python import PythonDispatcher
+from conclave.job import PythonJob
+
+
+class TestPythonDispatch(TestCase):
+
+    def make_job(self, root: str, name: str, code: str, deps: list):
+
+        code_dir = os.path.join(root, name)
+        os.makedirs(code_dir)
+        with open(os.path.join(code_dir, "workflow.py"), "w") as f:
+            f.write(code)
+        job = PythonJob(name, code_dir)
+        job.deps = deps
+        return job
+
+    def test_pool_affinity(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            result_path = os.path.join(root, "result")
+            produce = self.make_job(root, "produce", "import os\nREL_CACHE['rel'] = os.getpid()\n", [])
+            others = [self.make_job(root, "other_{}".format(i), "", []) for i in range(3)]
+            consume = self.make_job(root, "consume", "\n".join([
+                "import os",
+                "with open({}, 'w') as f:".format(repr(result_path)),
+                "    f.write(str(REL_CACHE.get('rel') == os.getpid()))",
+                ""
+            ]), ["produce"])
+
+            dispatcher = PythonDispatcher("pool", 2)
+            try:
+                for job in [produce] + others + [consume]:
+                    dispatcher.dispatch(job)
+                # independent jobs are spread over the workers
+                self.assertEqual(set([0, 1]), set(dispatcher.worker_of.values()))
+                # the consumer runs where the relation it reads is kept in memory
+                self.assertEqual(dispatcher.worker_of["produce"], dispatcher.worker_of["consume"])
+                with open(result_path) as f:
+                    self.assertEqual("True", f.read())
+            finally:
+                dispatcher.shutdown()
+
+    def test_in_process_shared(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            produce = self.make_job(root, "produce", "REL_CACHE['rel'] = [[1, 2]]\n", [])
+            consumers = [self.make_job(root, "consume_{}".format(i), "\n".join([
+                "import time",
+                "REL_CACHE['running'] = REL_CACHE.get('running', 0) + 1",
+                "REL_CACHE['overlap'] = max(REL_CACHE.get('overlap', 0), REL_CACHE['running'])",
+                "time.sleep(0.05)",
+                "REL_CACHE['seen_{}'] = REL_CACHE.get('rel')".format(i),
+                "REL_CACHE['running'] -= 1",
+                ""
+            ]), ["produce"]) for i in range(3)]
+
+            dispatcher = PythonDispatcher("in_process")
+            main = sys.modules["__main__"]
+            try:
+                dispatcher.dispatch(produce)
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    list(executor.map(dispatcher.dispatch, consumers))
+                for i in range(3):
+                    self.assertEqual([[1, 2]], dispatcher.rel_cache["seen_{}".format(i)])
+                # jobs dispatched at the same time take turns running as __main__
+                self.assertEqual(1, dispatcher.rel_cache["overlap"])
+                self.assertIs(main, sys.modules["__main__"])
+            finally:
+                dispatcher.shutdown()
+
+    def test_evict_in_process(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            produce = self.make_job(root, "produce", "REL_CACHE['rel'] = [[1, 2]]\n", [])
+            first = self.make_job(root, "first", "REL_CACHE['first'] = REL_CACHE['rel']\n", ["produce"])
+            second = self.make_job(root, "second", "REL_CACHE['second'] = REL_CACHE['rel']\n", ["produce"])
+
+            dispatcher = PythonDispatcher("in_process")
+            try:
+                dispatcher.plan([(produce, []), (first, ["produce"]), (second, ["produce"])])
+                dispatcher.dispatch(produce)
+                self.assertIn("rel", dispatcher.rel_cache)
+                dispatcher.dispatch(first)
+                self.assertIn("rel", dispatcher.rel_cache)
+                # relations that no planned job reads are dropped right away
+                self.assertNotIn("first", dispatcher.rel_cache)
+                dispatcher.dispatch(second)
+                self.assertEqual({}, dispatcher.rel_cache)
+            finally:
+                dispatcher.shutdown()
+
+    def test_evict_pool(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            result_path = os.path.join(root, "result")
+            produce = self.make_job(root, "produce", "REL_CACHE['rel'] = [[1, 2]]\n", [])
+            consume = self.make_job(root, "consume", "assert 'rel' in REL_CACHE\n", ["produce"])
+            check = self.make_job(root, "check", "\n".join([
+                "with open({}, 'w') as f:".format(repr(result_path)),
+                "    f.write(str('rel' in REL_CACHE))",
+                ""
+            ]), [])
+
+            dispatcher = PythonDispatcher("pool", 1)
+            try:
+                dispatcher.plan([(produce, []), (consume, ["produce"])])
+                for job in [produce, consume, check]:
+                    dispatcher.dispatch(job)
+                with open(result_path) as f:
+                    self.assertEqual("False", f.read())
+            finally:
+                dispatcher.shutdown()
@@ -0,0 +1,139 @@
+from unittest import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from conclave.dispatch.sharemind import SharemindDispatcher, _import_task
+from conclave.job import SharemindJob
+from conclave.net import DoneMsg
+
+
+class FakePeer:
+    """ Stands in for SalmonPeer, recording the messages sent to other parties. """
+
+    def __init__(self, pid: int):
+
+        self.pid = pid
+        self.loop = asyncio.new_event_loop()
+        self.dispatcher = None
+        self.sent = []
+
+    def register_dispatcher(self, dispatcher):
+
+        self.dispatcher = dispatcher
+
+    def send_done_msg(self, receiver: int, task_name: str):
+
+        self.sent.append((receiver, task_name))
+
+
+def wait_until(condition, timeout: float = 5):
+
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class TestSharemindDispatch(TestCase):
+
+    def setUp(self):
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.code_dir = self.tmp.name
+        # dispatchers run on executor threads, which have no event loop of their own
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def tearDown(self):
+
+        self.executor.shutdown()
+        self.tmp.cleanup()
+
+    def make_dispatcher(self, pid: int):
+
+        peer = FakePeer(pid)
+        dispatcher = SharemindDispatcher(peer)
+        self.addCleanup(peer.loop.close)
+        self.addCleanup(dispatcher.shutdown)
+        return peer, dispatcher
+
+    def write_script(self, name: str, wait_for: [str, None] = None):
+        """ Script that waits for file wait_for, if set, then writes a file named after it. """
+
+        lines = []
+        if wait_for is not None:
+            lines.append("while [ ! -f {0} ]; do sleep 0.01; done".format(os.path.join(self.code_dir, wait_for)))
+        lines.append("touch {}".format(os.path.join(self.code_dir, name + ".ran")))
+        with open(os.path.join(self.code_dir, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def ran(self, name: str):
+
+        return os.path.exists(os.path.join(self.code_dir, name + ".ran"))
+
+    def test_prepare(self):
+
+        peer, dispatcher = self.make_dispatcher(1)
+        self.write_script("input_a.sh")
+        self.write_script("input_b.sh", wait_for="go")
+        job = SharemindJob("job", self.code_dir, 1, [1, 2], {1: ["a", "b"], 2: ["c"]})
+
+        dispatcher.prepare(job)
+        dispatcher.prepare(job)
+        wait_until(lambda: self.ran("input_a.sh"))
+        # each import reports its own relation as soon as it is done
+        peer.loop.run_until_complete(dispatcher._task(1, _import_task(job, "a")))
+        self.assertFalse(dispatcher._task(1, _import_task(job, "b")).done())
+        open(os.path.join(self.code_dir, "go"), "w").close()
+        peer.loop.run_until_complete(dispatcher._task(1, _import_task(job, "b")))
+        self.assertFalse(dispatcher._task(2, _import_task(job, "c")).done())
+
+    def test_controller_waits_for_imports(self):
+
+        peer, dispatcher = self.make_dispatcher(1)
+        self.write_script("input_a.sh")
+        self.write_script("submit.sh")
+        job = SharemindJob("job", self.code_dir, 1, [1, 2], {1: ["a"], 2: ["c"]})
+
+        # the other party's import can be reported before the job is dispatched
+        dispatcher.receive_msg(DoneMsg(2, "other.c.input"))
+        done = self.executor.submit(dispatcher.dispatch, job)
+        wait_until(lambda: self.ran("input_a.sh"))
+        time.sleep(0.1)
+        self.assertFalse(self.ran("submit.sh"))
+        peer.loop.call_soon_threadsafe(dispatcher.receive_msg, DoneMsg(2, _import_task(job, "c")))
+        done.result(timeout=5)
+
+        self.assertTrue(self.ran("submit.sh"))
+        self.assertEqual([(2, "job.controller")], peer.sent)
+        # readiness of tasks of other jobs is kept
+        self.assertEqual([(2, "other.c.input")], list(dispatcher.tasks))
+
+    def test_controller_without_imports(self):
+
+        peer, dispatcher = self.make_dispatcher(1)
+        self.write_script("submit.sh")
+        # e.g. a job that only reads relations persisted by earlier jobs
+        job = SharemindJob("job", self.code_dir, 1, [], {})
+
+        self.executor.submit(dispatcher.dispatch, job).result(timeout=5)
+
+        self.assertTrue(self.ran("submit.sh"))
+        self.assertEqual([], peer.sent)
+
+    def test_input_party(self):
+
+        peer, dispatcher = self.make_dispatcher(2)
+        self.write_script("input_c.sh")
+        job = SharemindJob("job", self.code_dir, 1, [1, 2], {1: ["a"], 2: ["c"]})
+
+        done = self.executor.submit(dispatcher.dispatch, job)
+        # the import is reported to the controller while waiting for it to finish the job
+        wait_until(lambda: peer.sent)
+        self.assertEqual([(1, _import_task(job, "c"))], peer.sent)
+        self.assertFalse(done.done())
+        peer.loop.call_soon_threadsafe(dispatcher.receive_msg, DoneMsg(1, "job.controller"))
+        done.result(timeout=5)
@@ -0,0 +1,97 @@
+from unittest import TestCase
+import pickle
+from conclave.net import SalmonProtocol, DoneMsg, write_msg, LEGACY_DELIMITER
+
+
+class Buffer:
+    """ Transport that keeps everything written to it. """
+
+    def __init__(self):
+
+        self.data = bytearray()
+
+    def write(self, data):
+
+        self.data += data
+
+
+class FakePeer:
+    """ Stands in for SalmonPeer, acting as its own dispatcher. """
+
+    def __init__(self):
+
+        self.dispatcher = self
+        self.peer_connections = {}
+        self.received = []
+
+    def receive_msg(self, msg):
+
+        self.received.append((msg.pid, msg.task_name))
+
+
+def encode(msgs, legacy_framing: bool = False):
+
+    transport = Buffer()
+    for msg in msgs:
+        write_msg(transport, msg, legacy_framing)
+    return bytes(transport.data)
+
+
+class TestFraming(TestCase):
+
+    def setUp(self):
+
+        self.peer = FakePeer()
+        self.protocol = SalmonProtocol(self.peer)
+        self.protocol.connection_made(Buffer())
+
+    def test_split_frame(self):
+
+        data = encode([DoneMsg(1, "job")])
+        self.protocol.data_received(data[:2])
+        self.protocol.data_received(data[2:7])
+        self.assertEqual(self.peer.received, [])
+        self.protocol.data_received(data[7:])
+        self.assertEqual(self.peer.received, [(1, "job")])
+        self.assertFalse(self.protocol.legacy_framing)
+        self.assertEqual(len(self.protocol.buffer), 0)
+
+    def test_several_frames(self):
+
+        data = encode([DoneMsg(1, "a"), DoneMsg(2, "b"), DoneMsg(3, "c")])
+        first = encode([DoneMsg(1, "a")])
+        # two and a half frames in one read, the rest in the next
+        cut = 2 * len(first) + 3
+        self.protocol.data_received(data[:cut])
+        self.assertEqual(self.peer.received, [(1, "a"), (2, "b")])
+        self.protocol.data_received(data[cut:])
+        self.assertEqual(self.peer.received, [(1, "a"), (2, "b"), (3, "c")])
+        self.assertEqual(len(self.protocol.buffer), 0)
+
+    def test_payload_with_delimiter(self):
+
+        msg = DoneMsg(1, "a" + LEGACY_DELIMITER.decode() + "b")
+        self.assertIn(LEGACY_DELIMITER, pickle.dumps(msg))
+        self.protocol.data_received(encode([msg, DoneMsg(2, "c")]))
+        self.assertEqual(self.peer.received, [(1, "a\n\n\nb"), (2, "c")])
+
+    def test_legacy_peer(self):
+
+        data = encode([DoneMsg(1, "a"), DoneMsg(2, "b")], legacy_framing=True)
+        self.assertEqual(data[0], 0x80)
+        # split inside the delimiter that ends the first message
+        cut = data.index(LEGACY_DELIMITER) + 1
+        self.protocol.data_received(data[:cut])
+        self.assertTrue(self.protocol.legacy_framing)
+        self.assertEqual(self.peer.received, [])
+        self.protocol.data_received(data[cut:])
+        self.assertEqual(self.peer.received, [(1, "a"), (2, "b")])
+
+    def test_legacy_byte_at_a_time(self):
+
+        msgs = [DoneMsg(i, "task{}".format(i)) for i in range(5)]
+        data = encode(msgs, legacy_framing=True)
+        for i in range(len(data)):
+            self.protocol.data_received(data[i:i + 1])
+        self.assertEqual(self.peer.received, [(msg.pid, msg.task_name) for msg in msgs])
+        self.assertEqual(len(self.protocol.buffer), 0)
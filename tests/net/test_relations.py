@@ -0,0 +1,146 @@
+from unittest import TestCase
+import asyncio
+from conclave.net import SalmonPeer, SalmonProtocol, FRAME_HEADER, COLUMN_FRAME, RELATION_WINDOW
+
+
+class FakeTransport:
+    """ Holds written bytes until they are delivered to the other end. """
+
+    def __init__(self):
+
+        self.written = bytearray()
+
+    def write(self, data):
+
+        self.written += data
+
+    def deliver(self, protocol: SalmonProtocol):
+
+        data = bytes(self.written)
+        self.written.clear()
+        if data:
+            protocol.data_received(data)
+        return len(data)
+
+
+def count_frames(data: bytes, frame_type: int):
+
+    count, offset = 0, 0
+    while offset < len(data):
+        typ, length = FRAME_HEADER.unpack_from(data, offset)
+        count += typ == frame_type
+        offset += FRAME_HEADER.size + length
+    return count
+
+
+class TestRelations(TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        # one connection between peers 1 and 2, with a protocol on each end
+        self.sender = self.make_peer(1)
+        self.receiver = self.make_peer(2)
+        self.out = self.connect(self.sender, 2)
+        self.back = self.connect(self.receiver, 1)
+
+    def make_peer(self, pid: int):
+
+        config = {"pid": pid, "parties": {1: {"host": "localhost", "port": 0}, 2: {"host": "localhost", "port": 0}}}
+        peer = SalmonPeer(self.loop, config)
+        # never listens
+        peer.server.close()
+        return peer
+
+    def connect(self, peer: SalmonPeer, other_pid: int):
+
+        protocol = SalmonProtocol(peer)
+        protocol.connection_made(FakeTransport())
+        peer.peer_connections[other_pid] = protocol.transport
+        peer.peer_protocols[other_pid] = protocol
+        return protocol
+
+    def exchange(self):
+        """ Delivers data and credit both ways until the connection is idle. """
+
+        while self.out.transport.deliver(self.back) + self.back.transport.deliver(self.out):
+            pass
+
+    def test_round_trip(self):
+
+        rows = [[i, -i, 2 ** 40 + i] for i in range(10)]
+        received = self.receiver.recv_relation(1, "rel")
+        sent = self.sender.send_relation(2, "rel", ["a", "b", "c"], rows, chunk_size=3)
+        self.exchange()
+        self.assertEqual(self.loop.run_until_complete(sent), 10)
+        columns, buffers = self.loop.run_until_complete(received)
+        self.assertEqual(columns, ["a", "b", "c"])
+        self.assertEqual([list(col) for col in buffers], [list(col) for col in zip(*rows)])
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.sender.peer_protocols[2].outgoing, {})
+        self.assertEqual(self.back.incoming, {})
+
+    def test_empty_relation(self):
+
+        sent = self.sender.send_relation(2, "rel", ["a"], [])
+        self.exchange()
+        self.assertEqual(self.loop.run_until_complete(sent), 0)
+        columns, buffers = self.loop.run_until_complete(self.receiver.recv_relation(1, "rel"))
+        self.assertEqual((columns, [list(col) for col in buffers]), (["a"], [[]]))
+
+    def test_window(self):
+
+        num_chunks = 2 * RELATION_WINDOW + 1
+        sent = self.sender.send_relation(2, "rel", ["a", "b"], ([i, i] for i in range(num_chunks)), chunk_size=1)
+        # without credit, the sender stops a window ahead of the receiver
+        self.assertEqual(count_frames(self.out.transport.written, COLUMN_FRAME), 2 * RELATION_WINDOW)
+        self.out.transport.deliver(self.back)
+        self.assertFalse(sent.done())
+        # each chunk received refills the window by one chunk
+        self.back.transport.deliver(self.out)
+        self.assertEqual(count_frames(self.out.transport.written, COLUMN_FRAME), 2 * RELATION_WINDOW)
+        self.exchange()
+        self.assertEqual(self.loop.run_until_complete(sent), num_chunks)
+        columns, buffers = self.loop.run_until_complete(self.receiver.recv_relation(1, "rel"))
+        self.assertEqual(list(buffers[0]), list(range(num_chunks)))
+
+    def test_pause_writing(self):
+
+        self.out.pause_writing()
+        sent = self.sender.send_relation(2, "rel", ["a"], [[i] for i in range(5)], chunk_size=2)
+        self.assertEqual(count_frames(self.out.transport.written, COLUMN_FRAME), 0)
+        # credit does not override a full transport
+        self.out.transport.deliver(self.back)
+        self.out.outgoing[0].add_credit(1)
+        self.assertEqual(len(self.out.transport.written), 0)
+        self.out.resume_writing()
+        self.assertEqual(count_frames(self.out.transport.written, COLUMN_FRAME), 3)
+        self.exchange()
+        self.assertEqual(self.loop.run_until_complete(sent), 5)
+
+    def test_receiver_registers_late(self):
+
+        sent = self.sender.send_relation(2, "rel", ["a"], [[1], [2]])
+        self.exchange()
+        self.loop.run_until_complete(sent)
+        # the relation arrived before anyone asked for it
+        columns, buffers = self.loop.run_until_complete(self.receiver.recv_relation(1, "rel"))
+        self.assertEqual(list(buffers[0]), [1, 2])
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.receiver.relations, {})
+
+    def test_split_reads(self):
+
+        rows = [[i, 3 * i] for i in range(7)]
+        sent = self.sender.send_relation(2, "rel", ["a", "b"], rows, chunk_size=2)
+        # deliver the data one byte at a time
+        while self.out.transport.written:
+            data = bytes(self.out.transport.written)
+            self.out.transport.written.clear()
+            for i in range(len(data)):
+                self.back.data_received(data[i:i + 1])
+            self.back.transport.deliver(self.out)
+        self.assertEqual(self.loop.run_until_complete(sent), 7)
+        columns, buffers = self.loop.run_until_complete(self.receiver.recv_relation(1, "rel"))
+        self.assertEqual([list(col) for col in buffers], [list(col) for col in zip(*rows)])
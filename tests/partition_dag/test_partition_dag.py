@@ -9,18 +9,22 @@ import os
 
 class TestConclave(TestCase):
 
-    def check_workflow(self, dag, name):
+    def check_workflow(self, dag, name, partitioner=part.heupart):
 
-        mapping = part.heupart(dag, ["sharemind"], ["spark"])
-        actual = "###".join([fmwk + str(subdag) + str(parties)
-                             for (fmwk, subdag, parties) in mapping])
+        mapping = partitioner(dag, ["sharemind"], ["spark"])
+        jobs = [fmwk + str(subdag) + str(parties) for (fmwk, subdag, parties) in mapping]
+        actual = "###".join(jobs)
 
         expected_rootdir = "{}/part_expected".format(os.path.dirname(os.path.realpath(__file__)))
 
         with open(expected_rootdir + '/{}'.format(name), 'r') as f:
             expected = f.read()
 
-        self.assertEqual(expected, actual)
+        if partitioner is part.heupart:
+            self.assertEqual(expected, actual)
+        else:
+            # jobs in the same stage may be listed in a different order
+            self.assertEqual(sorted(expected.split("###")), sorted(jobs))
 
     def test_partition_taxi(self):
 
@@ -75,6 +79,7 @@ class TestConclave(TestCase):
 
         dag = protocol()
         self.check_workflow(dag, 'taxi')
+        self.check_workflow(protocol(), 'taxi', part.costpart)
 
     def test_partition_ssn(self):
 
@@ -228,6 +233,7 @@ class TestConclave(TestCase):
 
         dag = protocol()
         self.check_workflow(dag, 'ssn')
+        self.check_workflow(protocol(), 'ssn', part.costpart)
 
     def test_inputs_out_of_order(self):
 
@@ -282,6 +288,7 @@ class TestConclave(TestCase):
 
         dag = protocol()
         self.check_workflow(dag, 'out_of_order')
+        self.check_workflow(protocol(), 'out_of_order', part.costpart)
 
     def test_partition_hybrid_join(self):
 
@@ -309,4 +316,135 @@ class TestConclave(TestCase):
 
         dag = protocol()
         self.check_workflow(dag, 'hybrid_join')
+        self.check_workflow(protocol(), 'hybrid_join', part.costpart)
 
+
+    def test_persist_across_jobs(self):
+
+        def protocol():
+
+            closed = []
+            for pid in [1, 2]:
+                cols = [
+                    defCol("a", "INTEGER", [pid]),
+                    defCol("b", "INTEGER", [pid])
+                ]
+                in_rel = sal.create("in_{}".format(pid), cols, set([pid]))
+                in_rel.is_mpc = False
+                proj = sal.project(in_rel, "proj_{}".format(pid), ["a", "b"])
+                proj.is_mpc = False
+                proj.out_rel.stored_with = set([pid])
+                cl = sal._close(proj, "cl_{}".format(pid), set([1, 2, 3]))
+                cl.is_mpc = True
+                closed.append(cl)
+
+            combined = sal.concat(closed, "combined")
+            combined.is_mpc = True
+            combined.out_rel.stored_with = set([1, 2, 3])
+
+            keys_closed = sal.project(combined, "keys_closed", ["a"])
+            keys_closed.is_mpc = True
+            keys_closed.out_rel.stored_with = set([1, 2, 3])
+            keys = sal._open(keys_closed, "keys", 1)
+            keys.is_mpc = True
+
+            indexed = sal.index(keys, "indexed", "index")
+            indexed.is_mpc = False
+            indexed.out_rel.stored_with = set([1])
+            indexed_closed = sal._close(indexed, "indexed_closed", set([1, 2, 3]))
+            indexed_closed.is_mpc = True
+
+            # combined is used by a later mpc job and must stay secret-shared until then
+            joined = sal.join(combined, indexed_closed, "joined", ["a"], ["a"])
+            joined.is_mpc = True
+            joined.out_rel.stored_with = set([1, 2, 3])
+            opened = sal._open(joined, "opened", 1)
+            opened.is_mpc = True
+
+            return saldag.OpDag(set([cl.parent.parent for cl in closed]))
+
+        dag = protocol()
+        self.check_workflow(dag, 'persist_across_jobs')
+        self.check_workflow(protocol(), 'persist_across_jobs', part.costpart)
+
+    def check_valid_partition(self, mapping, num_ops):
+
+        produced = set()
+        partitioned = 0
+        for fmwk, subdag, parties in mapping:
+            for node in subdag.top_sort():
+                if isinstance(node, saldag.Create):
+                    # inputs to a job are either workflow inputs or outputs of earlier jobs
+                    self.assertTrue(node.out_rel.name in produced or node.out_rel.name.startswith("in_"))
+                else:
+                    partitioned += 1
+                    self.assertEqual(part.get_stored_with(node), parties)
+                    self.assertEqual(fmwk == "sharemind", node.is_mpc)
+            produced |= set(node.out_rel.name for node in subdag.top_sort())
+        self.assertEqual(num_ops, partitioned)
+
+    def test_costpart_large(self):
+
+        @mpc(1)
+        def protocol():
+
+            inputs = set()
+            chains = []
+            for pid in [1, 2, 3]:
+                cols = [
+                    defCol("a", "INTEGER", [pid]),
+                    defCol("b", "INTEGER", [pid])
+                ]
+                node = sal.create("in_{}".format(pid), cols, set([pid]))
+                inputs.add(node)
+                for i in range(100):
+                    node = sal.multiply(node, "local_{}_{}".format(pid, i), "a", ["a", 1])
+                chains.append(node)
+
+            node = sal.concat(chains, "combined")
+            node = sal.aggregate(node, "total", ["a"], "b", "+", "total")
+            sal.collect(node, 1)
+
+            return inputs
+
+        dag = protocol()
+        num_ops = len([node for node in dag.get_all_nodes() if not isinstance(node, saldag.Create)])
+        self.assertGreater(num_ops, 300)
+
+        mapping = part.costpart(dag, ["sharemind"], ["spark"])
+
+        self.check_valid_partition(mapping, num_ops)
+        self.assertEqual(["spark", "spark", "spark", "sharemind"], [fmwk for (fmwk, _, _) in mapping][:4])
+
+    def test_costpart_frameworks(self):
+
+        def protocol():
+
+            cols = [
+                defCol("a", "INTEGER", [1]),
+                defCol("b", "INTEGER", [1])
+            ]
+            node = sal.create("in_1", cols, set([1]))
+            inputs = set([node])
+            for i in range(100):
+                node = sal.multiply(node, "mult_{}".format(i), "a", ["a", 1])
+                node = sal.project(node, "proj_{}".format(i), ["a", "b"])
+            return saldag.OpDag(inputs)
+
+        op_costs = {"python": {"multiply": 3, "project": 1}, "spark": {"multiply": 1, "project": 3}}
+
+        # cheap boundaries, so every operator runs in the framework where it is cheapest
+        dag = protocol()
+        mapping = part.costpart(dag, ["sharemind"], ["python", "spark"], part.CostModel(op_costs, 0.5))
+        self.check_valid_partition(mapping, 200)
+        self.assertEqual(200, len(mapping))
+        for fmwk, subdag, _ in mapping:
+            for node in subdag.top_sort():
+                if not isinstance(node, saldag.Create):
+                    self.assertEqual("spark" if node.name == "multiply" else "python", fmwk)
+
+        # expensive boundaries, so the whole chain stays in one job
+        dag = protocol()
+        mapping = part.costpart(dag, ["sharemind"], ["python", "spark"], part.CostModel(op_costs, 10))
+        self.check_valid_partition(mapping, 200)
+        self.assertEqual(1, len(mapping))
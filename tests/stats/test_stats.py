@@ -0,0 +1,89 @@
+from unittest import TestCase
+import conclave.lang as sal
+import conclave.dag as saldag
+import conclave.stats as stats
+from conclave.utils import *
+import json
+import os
+import tempfile
+
+
+class TestStats(TestCase):
+
+    def test_sample_stats(self):
+
+        with tempfile.TemporaryDirectory() as input_path:
+            with open(os.path.join(input_path, "in_1.csv"), "w") as f:
+                f.write("a,b\n")
+                for i in range(100):
+                    f.write("{},{}\n".format(i % 10, i))
+
+            actual = stats.sample_stats(os.path.join(input_path, "in_1.csv"))
+            self.assertEqual(100, actual.row_count)
+            self.assertEqual(stats.ColumnStats(10, 0, 9), actual.column("a"))
+            self.assertEqual(stats.ColumnStats(100, 0, 99), actual.column("b"))
+
+            # distinct counts are extrapolated when only part of the input is sampled
+            sampled = stats.sample_stats(os.path.join(input_path, "in_1.csv"), sample_size=25)
+            self.assertEqual(100, sampled.row_count)
+            self.assertEqual(10, sampled.column("a").distinct)
+            self.assertEqual(50, sampled.column("b").distinct)
+            # value ranges cover the rows beyond the sample
+            self.assertEqual(stats.ColumnStats(50, 0, 99), sampled.column("b"))
+
+    def test_collect_stats(self):
+
+        with tempfile.TemporaryDirectory() as input_path:
+            with open(os.path.join(input_path, "in_1.stats.json"), "w") as f:
+                json.dump({"row_count": 5000, "columns": {"a": {"distinct": 50}}}, f)
+            with open(os.path.join(input_path, "in_2.csv"), "w") as f:
+                f.write("a,b\n1,2\n3,4\n")
+
+            in_1 = sal.create("in_1", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], set([1]))
+            in_2 = sal.create("in_2", [defCol("a", "INTEGER", [2]), defCol("b", "INTEGER", [2])], set([2]))
+            in_3 = sal.create("in_3", [defCol("a", "INTEGER", [3]), defCol("b", "INTEGER", [3])], set([3]))
+            stats.collect_stats(saldag.OpDag(set([in_1, in_2, in_3])), input_path)
+
+            self.assertEqual(5000, in_1.stats.row_count)
+            self.assertEqual(stats.ColumnStats(50), in_1.stats.column("a"))
+            self.assertEqual(2, in_2.stats.row_count)
+            self.assertIsNone(in_3.stats)
+
+    def test_estimate_cardinalities(self):
+
+        left_stats = stats.RelationStats(1000, {
+            "a": stats.ColumnStats(100, 0, 99),
+            "b": stats.ColumnStats(1000, 0, 999)
+        })
+        right_stats = stats.RelationStats(200, {
+            "c": stats.ColumnStats(50, 0, 49),
+            "d": stats.ColumnStats(4, 0, 3)
+        })
+        left = sal.create("left", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], set([1]), left_stats)
+        right = sal.create("right", [defCol("c", "INTEGER", [1]), defCol("d", "INTEGER", [1])], set([1]), right_stats)
+        unknown = sal.create("unknown", [defCol("c", "INTEGER", [1]), defCol("d", "INTEGER", [1])], set([1]))
+
+        joined = sal.join(left, right, "joined", ["a"], ["c"])
+        agg = sal.aggregate(joined, "agg", ["d"], "b", "+", "total")
+        filtered = sal.filter(joined, "filtered", "d", "==", "1")
+        dsl_filtered = sal.filter(joined, "dsl_filtered", "d", "=", 1)
+        multiplied = sal.multiply(filtered, "multiplied", "a", ["a", 2])
+        combined = sal.concat([right, unknown], "combined")
+        indexed = sal.index(combined, "indexed", "row")
+
+        estimates = stats.estimate_cardinalities(saldag.OpDag(set([left, right, unknown])))
+
+        # 1000 * 200 / max(100, 50)
+        self.assertEqual(2000, estimates[joined].row_count)
+        self.assertEqual(stats.ColumnStats(100, 0, 99), estimates[joined].column("a"))
+        self.assertEqual(4, estimates[agg].row_count)
+        self.assertEqual(stats.ColumnStats(), estimates[agg].column("total"))
+        self.assertEqual(500, estimates[filtered].row_count)
+        self.assertEqual(1, estimates[filtered].column("d").distinct)
+        self.assertEqual(500, estimates[dsl_filtered].row_count)
+        self.assertEqual(1, estimates[dsl_filtered].column("d").distinct)
+        self.assertEqual(500, estimates[multiplied].row_count)
+        self.assertEqual(stats.ColumnStats(), estimates[multiplied].column("a"))
+        self.assertEqual(200 + stats.DEFAULT_ROW_COUNT, estimates[combined].row_count)
+        self.assertEqual(stats.ColumnStats(), estimates[combined].column("c"))
+        self.assertEqual(stats.ColumnStats(1200, 0, 1199), estimates[indexed].column("row"))
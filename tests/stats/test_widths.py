@@ -0,0 +1,97 @@
+from unittest import TestCase
+import os
+import tempfile
+import conclave.lang as sal
+import conclave.dag as saldag
+import conclave.stats as stats
+import conclave.widths as widths
+from conclave.utils import *
+
+
+class TestWidths(TestCase):
+
+    def test_infer_widths(self):
+
+        left_stats = stats.RelationStats(1000, {
+            "a": stats.ColumnStats(100, 0, 99),
+            "b": stats.ColumnStats(1000, 0, 999)
+        })
+        right_stats = stats.RelationStats(200, {
+            "c": stats.ColumnStats(50, 0, 49),
+            "d": stats.ColumnStats(4, -3, 3)
+        })
+        left = sal.create("left", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], set([1]), left_stats)
+        right = sal.create("right", [defCol("c", "INTEGER", [1]), defCol("d", "INTEGER", [1])], set([1]), right_stats)
+        unknown = sal.create("unknown", [defCol("c", "INTEGER", [1]), defCol("d", "INTEGER", [1])], set([1]))
+
+        joined = sal.join(left, right, "joined", ["a"], ["c"])
+        total = sal.aggregate(left, "total", ["a"], "b", "+", "b_total")
+        counted = sal.aggregate(joined, "counted", ["a"], "b", "count", "b_count")
+        multiplied = sal.multiply(left, "multiplied", "a", ["a", "b", 2])
+        divided = sal.divide(left, "divided", "b", ["b", 10])
+        combined = sal.concat([left, right], "combined")
+        indexed = sal.index(sal.concat([right, unknown], "mixed"), "indexed", "row")
+
+        rows = widths.infer_widths(saldag.OpDag(set([left, right, unknown])))
+
+        def _widths(node):
+            return [col.bit_width for col in node.out_rel.columns]
+
+        self.assertEqual(1000 * 200, rows[joined])
+        # negative values cannot be bounded
+        self.assertEqual([7, 10, None], _widths(joined))
+        # 1000 values of 10 bits sum to at most 20 bits
+        self.assertEqual([7, 20], _widths(total))
+        self.assertEqual([7, 18], _widths(counted))
+        self.assertEqual([19, 10], _widths(multiplied))
+        self.assertEqual([7, 10], _widths(divided))
+        self.assertEqual([7, None], _widths(combined))
+        self.assertIsNone(rows[indexed])
+        self.assertEqual([None, None, None], _widths(indexed))
+
+    def test_join_same_names(self):
+
+        left_stats = stats.RelationStats(10, {
+            "k": stats.ColumnStats(10, 0, 9),
+            "v": stats.ColumnStats(4, 0, 3)
+        })
+        right_stats = stats.RelationStats(10, {
+            "k": stats.ColumnStats(10, 0, 1000),
+            "v": stats.ColumnStats(10, 0, 2 ** 40)
+        })
+        left = sal.create("left", [defCol("k", "INTEGER", [1]), defCol("v", "INTEGER", [1])], set([1]), left_stats)
+        right = sal.create("right", [defCol("k", "INTEGER", [1]), defCol("v", "INTEGER", [1])], set([1]), right_stats)
+        joined = sal.join(left, right, "joined", ["k"], ["k"])
+
+        widths.infer_widths(saldag.OpDag(set([left, right])))
+
+        # both value columns are named v, the right one keeps its own width
+        self.assertEqual(["k", "v", "v"], [col.name for col in joined.out_rel.columns])
+        self.assertEqual([10, 2, 41], [col.bit_width for col in joined.out_rel.columns])
+
+    def test_sampled_input(self):
+
+        with tempfile.TemporaryDirectory() as input_path:
+            path = os.path.join(input_path, "in_1.csv")
+            with open(path, "w") as f:
+                f.write("a,b\n")
+                for i in range(20000):
+                    f.write("{},{}\n".format(i % 200, i % 10))
+                # beyond the sampled rows
+                f.write("70000,9\n")
+            in_stats = stats.sample_stats(path)
+
+        in_1 = sal.create("in_1", [defCol("a", "INTEGER", [1]), defCol("b", "INTEGER", [1])], set([1]), in_stats)
+        widths.infer_widths(saldag.OpDag(set([in_1])))
+
+        # the type picked for a column must hold values outside the sample too
+        self.assertGreaterEqual(widths.uint_width(in_1.out_rel.columns[0].bit_width), (70000).bit_length())
+        self.assertEqual(17, in_1.out_rel.columns[0].bit_width)
+
+    def test_uint_type(self):
+
+        self.assertEqual("uint8", widths.uint_type(1))
+        self.assertEqual("uint16", widths.uint_type(9))
+        self.assertEqual("uint32", widths.uint_type(None))
+        self.assertEqual("uint64", widths.uint_type(33))
+        self.assertEqual("uint64", widths.uint_type(80))